@@ -1,7 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, field_validator
-from typing import List, Any
-import asyncio
+from typing import Dict, List, Any
 
 
 class Settings(BaseSettings):
@@ -19,6 +18,167 @@ class Settings(BaseSettings):
     default_language: str = "ru"
     speechmatics_max_wait_time_seconds: int = 300
 
+    # Параметры общего HTTP-клиента для Speechmatics (пул keep-alive соединений)
+    speechmatics_connection_limit: int = 100
+    speechmatics_connection_limit_per_host: int = 20
+    speechmatics_keepalive_timeout_seconds: float = 30.0
+    speechmatics_dns_cache_ttl_seconds: int = 300
+    speechmatics_connect_timeout_seconds: float = 10.0
+    speechmatics_read_timeout_seconds: float = 120.0
+
+    # Опрос статуса задачи: адаптивный интервал с экспоненциальным ростом и случайным разбросом
+    speechmatics_poll_min_interval_seconds: float = 1.0
+    speechmatics_poll_max_interval_seconds: float = 30.0
+    speechmatics_poll_interval_per_audio_second: float = 0.02
+    speechmatics_poll_backoff_factor: float = 1.5
+    speechmatics_poll_jitter: float = 0.2
+    # Сколько временных ошибок (сеть, 429, 5xx) подряд допускается перед отказом
+    speechmatics_max_transient_retries: int = 5
+    # Общий планировщик опроса: длительность раунда и максимум проверок статуса за раунд
+    speechmatics_poll_round_interval_seconds: float = 1.0
+    speechmatics_poll_max_requests_per_round: int = 10
+
+    # Отправка задач: лимит частоты (token bucket под лимиты аккаунта) и выключатель при сбоях сервиса.
+    # После failure_threshold временных ошибок подряд отправка приостанавливается на open_seconds,
+    # затем проходит одна пробная задача; при неудаче пауза удваивается до max_open_seconds.
+    # Задача ждет в очереди не дольше submit_queue_timeout_seconds.
+    speechmatics_submit_rate_per_second: float = 1.0
+    speechmatics_submit_burst: int = 10
+    speechmatics_breaker_failure_threshold: int = 5
+    speechmatics_breaker_open_seconds: float = 30.0
+    speechmatics_breaker_max_open_seconds: float = 600.0
+    speechmatics_submit_queue_timeout_seconds: float = 1800.0
+
+    # Пул API ключей: лимит одновременных задач на ключ (0 - без лимита; у ключа может быть свой),
+    # сглаживание и начальное значение задержки ответа, карантин ключа после 401/403 и 429
+    credential_default_max_concurrent_jobs: int = 0
+    credential_latency_smoothing: float = 0.3
+    credential_default_latency_seconds: float = 1.0
+    credential_busy_recheck_seconds: float = 5.0
+    # Сколько секунд список ключей хранится в памяти (изменения из админ-панели применяются сразу)
+    credential_cache_seconds: float = 60.0
+    credential_auth_quarantine_seconds: float = 3600.0
+    credential_rate_limit_quarantine_seconds: float = 60.0
+
+    # Режим уведомлений: Speechmatics сообщает о завершении задачи POST-запросом на наш приемник.
+    # public_url - внешний адрес, по которому сервис доступен приемник (например, https://bot.example.com)
+    speechmatics_callback_enabled: bool = False
+    speechmatics_callback_public_url: str = ""
+    speechmatics_callback_host: str = "0.0.0.0"
+    speechmatics_callback_port: int = 8081
+    speechmatics_callback_path: str = "/speechmatics/callback"
+    # Общий секрет, который Speechmatics передает в заголовке Authorization; без него режим уведомлений не запускается
+    speechmatics_callback_secret: str = ""
+    # Через сколько секунд без уведомления начинать опрос статуса
+    speechmatics_callback_fallback_seconds: float = 60.0
+
+    # Формат аудио, загружаемого в API: wav, flac или opus (OGG)
+    audio_upload_codec: str = "flac"
+    # Сколько результатов ffprobe держать в памяти (повторные запросы метаданных того же файла)
+    media_probe_cache_size: int = 256
+    # Длительность и формат WAV, FLAC, OGG и MP4 читаются из заголовка файла без запуска ffprobe
+    # (ffprobe - если заголовок не удалось разобрать); False - всегда ffprobe
+    media_header_probe_enabled: bool = True
+    # Файлы в формате, который API принимает (OGG/Opus, MP3, M4A, FLAC), отправляются без перекодирования,
+    # а такая же дорожка из видео копируется (-c:a copy); False - перекодировать все файлы
+    audio_passthrough_enabled: bool = True
+    # Подготовка аудио одновременно со скачиванием из Telegram (WebM, MKV, WAV и другие контейнеры,
+    # которые FFmpeg читает из канала)
+    download_overlap_enabled: bool = True
+    # Потоковая загрузка: записи короче chunked_transcription_min_duration_seconds перекодируются
+    # прямо в тело запроса, без временного файла
+    audio_streaming_upload: bool = True
+
+    # Параллельная транскрипция длинных записей: запись режется по паузам на фрагменты,
+    # которые обрабатываются одновременно, а текст склеивается с учетом смещений
+    chunked_transcription_min_duration_seconds: int = 900
+    chunk_target_duration_seconds: int = 300
+    chunk_max_boundary_shift_seconds: int = 30
+    chunk_silence_noise_db: int = -35
+    chunk_silence_min_seconds: float = 0.5
+    chunk_max_parallel_jobs: int = 4
+    # Сколько последних символов готового текста показывать в сообщении о прогрессе
+    chunk_partial_preview_chars: int = 3000
+
+    # Движок распознавания: speechmatics или local (Vosk на CPU, без сети и поминутной оплаты API).
+    # transcription_backend_by_language - движок для отдельных языков, например {"en": "local"};
+    # у пакета минут может быть свой движок (packages.transcription_backend), он важнее обоих.
+    # Модель локального движка для языка - каталог local_asr_model_dir/<язык>; local_asr_workers=0 - по числу ядер
+    transcription_backend: str = "speechmatics"
+    transcription_backend_by_language: Dict[str, str] = Field(default={})
+    local_asr_model_dir: str = "models/vosk"
+    local_asr_workers: int = 0
+
+    # Потоковое распознавание коротких записей через websocket (Speechmatics Realtime API):
+    # записи не длиннее realtime_max_duration_seconds (0 - отключено) отправляются кадрами по мере
+    # декодирования FFmpeg, а в сообщении о прогрессе показывается промежуточный текст
+    # Адрес Realtime API для ключа из настроек и ключей пула с адресом API из настроек (ключам другого
+    # региона адрес задается в админ-панели)
+    speechmatics_realtime_url: str = "wss://eu2.rt.speechmatics.com/v2"
+    realtime_max_duration_seconds: int = 60
+    realtime_max_delay_seconds: float = 2.0
+    realtime_max_unacked_frames: int = 50
+    realtime_response_timeout_seconds: float = 20.0
+    realtime_progress_edit_interval_seconds: float = 1.0
+
+    # Оценка времени обработки по статистике (секунды на минуту аудио по группам длительностей):
+    # сглаживание EWMA, сколько последних наблюдений хранить для квантилей и с какого числа выдавать оценку.
+    # Первая проверка статуса задачи - по квантилю eta_first_poll_quantile времени задачи Speechmatics
+    # от создания до завершения (без очереди и загрузки), срок ожидания результата - не меньше квантиля eta_deadline_quantile, умноженного на eta_deadline_factor
+    eta_smoothing: float = 0.2
+    eta_samples_per_bucket: int = 200
+    eta_min_samples: int = 3
+    eta_first_poll_quantile: float = 0.1
+    eta_deadline_quantile: float = 0.9
+    eta_deadline_factor: float = 3.0
+
+    # Кэш готовых результатов по file_unique_id и хэшу аудио.
+    # Область видимости: "user" - результат переиспользуется только для того же пользователя (по умолчанию),
+    # "global" - для любого пользователя с тем же файлом (текст одного пользователя получает другой, включать явно)
+    result_cache_enabled: bool = True
+    result_cache_scope: str = "user"
+    result_cache_max_entries: int = 10000
+    result_cache_max_age_hours: int = 720
+    # Одновременные обработки одного и того же файла объединяются в одну (область видимости - как у кэша)
+    inflight_coalescing_enabled: bool = True
+
+    # Формат документа с результатом: txt, srt, vtt или json (остальные форматы доступны в истории)
+    result_delivery_format: str = "txt"
+
+    # Рабочая область временных файлов (services/workspace.py): корень (пусто - папка в /tmp или в RAM-диске
+    # /dev/shm при workspace_use_ram_disk), квота на суммарный объем файлов задач в МБ (0 - без ограничения)
+    # и очистка папок, оставшихся от прерванных задач
+    workspace_root: str = ""
+    workspace_use_ram_disk: bool = False
+    workspace_quota_mb: int = 4096
+    workspace_sweep_interval_seconds: int = 600
+    workspace_orphan_age_minutes: int = 60
+
+    # Поиск речи (VAD) по энергии и доле смен знака кадров: запись, где речи меньше vad_min_speech_seconds,
+    # отклоняется до отправки в API. Порог энергии - на vad_energy_margin_db выше фона, но не ниже vad_min_energy_db.
+    # Отключено по умолчанию: анализ - отдельный проход FFmpeg по всей записи перед отправкой
+    vad_enabled: bool = False
+    vad_min_speech_seconds: float = 0.5
+    vad_min_energy_db: float = -50.0
+    vad_energy_margin_db: float = 12.0
+    # Удаление пауз длиннее vad_min_silence_seconds (с запасом vad_padding_seconds вокруг речи), если это
+    # сокращает запись хотя бы на vad_min_trim_seconds; метки времени результата пересчитываются в исходную запись
+    vad_silence_trim_enabled: bool = False
+    vad_min_silence_seconds: float = 2.0
+    vad_padding_seconds: float = 0.3
+    vad_min_trim_seconds: float = 30.0
+
+    # Лимиты этапов обработки (services/stage_pools.py): процессы FFmpeg (0 - по числу ядер CPU),
+    # одновременные скачивания из Telegram и задачи, ожидающие результата распознавания
+    ffmpeg_workers: int = 0
+    download_concurrency: int = 32
+    provider_concurrency: int = 200
+
+    # Продолжение задач после перезапуска: через сколько минут без смены этапа задача считается зависшей
+    # и как часто запускать сверку
+    stuck_transcription_timeout_minutes: int = 60
+    transcription_reconcile_interval_seconds: int = 300
+
     @field_validator("admin_ids", mode="before")
     @classmethod
     def parse_admin_ids(cls, v: Any) -> List[int]:
@@ -32,6 +192,3 @@ class Settings(BaseSettings):
 
 
 settings = Settings()
-
-MAX_CONCURRENT_TRANSCRIPTIONS = 3
-transcription_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TRANSCRIPTIONS)
\ No newline at end of file
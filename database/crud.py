@@ -1,9 +1,10 @@
+import json
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, func, delete
+from sqlalchemy import select, and_, or_, func, delete, update
 from typing import Optional
 from datetime import datetime
 
-from database.models import User, Transcription, Package, Payment, Setting
+from database.models import User, Transcription, Package, Payment, Setting, ApiCredential
 
 #--- Асинхронные функции для User ---
 
@@ -101,17 +102,23 @@ async def deduct_minutes_from_balance(db: AsyncSession, telegram_id: int, minute
 
 #--- Асинхронные функции для Transcription ---
 
-async def create_transcription(db: AsyncSession, user_id: int, file_name: str, file_path: str, duration: float, language: str, cost: float) -> Transcription:
+async def create_transcription(db: AsyncSession, user_id: int, file_name: str, file_path: str, duration: float, language: str, cost: float,
+                               file_unique_id: Optional[str] = None, content_hash: Optional[str] = None,
+                               chat_id: Optional[int] = None, progress_message_id: Optional[int] = None,
+                               stage: Optional[str] = None, time_map: Optional[str] = None) -> Transcription:
     db_transcription = Transcription(
         user_id=user_id, file_name=file_name, file_path=file_path, duration=duration,
-        language=language, cost=cost, status='processing', created_at=datetime.utcnow()
+        language=language, cost=cost, status='processing', created_at=datetime.utcnow(),
+        file_unique_id=file_unique_id, content_hash=content_hash,
+        chat_id=chat_id, progress_message_id=progress_message_id, stage=stage, time_map=time_map
     )
     db.add(db_transcription)
     await db.commit()
     await db.refresh(db_transcription)
     return db_transcription
 
-async def update_transcription_status_and_result(db: AsyncSession, transcription_id: int, status: str, result_text: Optional[str] = None, error_message: Optional[str] = None) -> Optional[Transcription]:
+async def update_transcription_status_and_result(db: AsyncSession, transcription_id: int, status: str, result_text: Optional[str] = None, error_message: Optional[str] = None,
+                                                 transcript_data: Optional[bytes] = None) -> Optional[Transcription]:
     result = await db.execute(
         select(Transcription).filter(Transcription.id == transcription_id)
     )
@@ -122,11 +129,66 @@ async def update_transcription_status_and_result(db: AsyncSession, transcription
             db_transcription.result_text = result_text
         if error_message:
             db_transcription.error_message = error_message
+        if transcript_data:
+            db_transcription.transcript_data = transcript_data
         db_transcription.completed_at = datetime.utcnow()
         await db.commit()
         await db.refresh(db_transcription)
     return db_transcription
 
+async def update_transcription_checkpoint(db: AsyncSession, transcription_id: int, stage: str, job_ids: Optional[str] = None,
+                                          result_text: Optional[str] = None, transcript_data: Optional[bytes] = None,
+                                          result_format: Optional[str] = None, credential_id: Optional[int] = None) -> Optional[Transcription]:
+    # Сохраняет последний завершенный этап задачи, чтобы продолжить ее после перезапуска бота
+    result = await db.execute(
+        select(Transcription).filter(Transcription.id == transcription_id)
+    )
+    db_transcription = result.scalars().first()
+    if db_transcription:
+        db_transcription.stage = stage
+        if job_ids is not None:
+            db_transcription.job_ids = job_ids
+        if result_text is not None:
+            db_transcription.result_text = result_text
+        if transcript_data is not None:
+            db_transcription.transcript_data = transcript_data
+        if result_format is not None:
+            db_transcription.result_format = result_format
+        if credential_id is not None:
+            db_transcription.credential_id = credential_id
+        db_transcription.updated_at = datetime.utcnow()
+        await db.commit()
+        await db.refresh(db_transcription)
+    return db_transcription
+
+async def get_unfinished_transcriptions(db: AsyncSession, updated_before: Optional[datetime] = None) -> list[Transcription]:
+    # Транскрипции, оставшиеся в статусе processing (например, после перезапуска бота)
+    query = select(Transcription).filter(Transcription.status == 'processing')
+    if updated_before is not None:
+        query = query.filter(or_(Transcription.updated_at < updated_before, Transcription.updated_at.is_(None)))
+    result = await db.execute(query.order_by(Transcription.created_at))
+    return result.scalars().all()
+
+async def find_completed_transcription(db: AsyncSession, language: str, created_after: datetime, user_id: Optional[int] = None,
+                                       file_unique_id: Optional[str] = None, content_hash: Optional[str] = None) -> Optional[Transcription]:
+    # Поиск последней успешной транскрипции того же файла (по file_unique_id или хэшу аудио) для повторного использования
+    if not file_unique_id and not content_hash:
+        return None
+    query = select(Transcription).filter(
+        Transcription.status == 'completed',
+        Transcription.result_text.isnot(None),
+        Transcription.language == language,
+        Transcription.created_at >= created_after,
+    )
+    if file_unique_id:
+        query = query.filter(Transcription.file_unique_id == file_unique_id)
+    else:
+        query = query.filter(Transcription.content_hash == content_hash)
+    if user_id is not None:
+        query = query.filter(Transcription.user_id == user_id)
+    result = await db.execute(query.order_by(Transcription.created_at.desc()).limit(1))
+    return result.scalars().first()
+
 async def get_transcriptions_by_user_id(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 5) -> list[Transcription]:
     result = await db.execute(
         select(Transcription)
@@ -266,6 +328,17 @@ async def create_payment(db: AsyncSession, user_id: int, package_id: Optional[in
     await db.refresh(db_payment)
     return db_payment
 
+async def get_user_package_backend(db: AsyncSession, user_id: int) -> Optional[str]:
+    # Движок распознавания из последнего купленного пользователем пакета (None - пакет без своего движка)
+    result = await db.execute(
+        select(Package.transcription_backend)
+        .join(Payment, Payment.package_id == Package.id)
+        .filter(Payment.user_id == user_id, Payment.status == 'success')
+        .order_by(Payment.created_at.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
 async def get_total_payments_amount(db: AsyncSession) -> float:
     result = await db.execute(select(func.sum(Payment.amount)))
     total_amount = result.scalar()
@@ -292,4 +365,79 @@ async def update_setting(db: AsyncSession, key: str, value: str):
     else:
         setting = Setting(key=key, value=value)
         db.add(setting)
-    await db.commit()
\ No newline at end of file
+    await db.commit()
+
+#--- Асинхронные функции для ApiCredential ---
+
+async def get_api_credentials(db: AsyncSession, active_only: bool = False) -> list[ApiCredential]:
+    query = select(ApiCredential)
+    if active_only:
+        query = query.filter(ApiCredential.is_active == True)
+    result = await db.execute(query.order_by(ApiCredential.id))
+    return result.scalars().all()
+
+async def get_api_credential_by_id(db: AsyncSession, credential_id: int) -> Optional[ApiCredential]:
+    result = await db.execute(
+        select(ApiCredential).filter(ApiCredential.id == credential_id)
+    )
+    return result.scalars().first()
+
+async def create_api_credential(db: AsyncSession, api_key: str, api_url: Optional[str] = None,
+                                max_concurrent_jobs: Optional[int] = None,
+                                realtime_url: Optional[str] = None) -> ApiCredential:
+    db_credential = ApiCredential(
+        name=f"...{api_key[-4:]}", api_key=api_key, api_url=api_url, realtime_url=realtime_url,
+        max_concurrent_jobs=max_concurrent_jobs, is_active=True, created_at=datetime.utcnow()
+    )
+    db.add(db_credential)
+    await db.commit()
+    await db.refresh(db_credential)
+    return db_credential
+
+async def set_api_credential_active(db: AsyncSession, credential_id: int, is_active: bool) -> Optional[ApiCredential]:
+    db_credential = await get_api_credential_by_id(db, credential_id)
+    if db_credential:
+        db_credential.is_active = is_active
+        if is_active:
+            # Включение администратором снимает карантин
+            db_credential.quarantined_until = None
+        await db.commit()
+        await db.refresh(db_credential)
+    return db_credential
+
+async def is_api_credential_in_use(db: AsyncSession, credential_id: int) -> bool:
+    # Есть ли незавершенные транскрипции, задачи которых отправлены через этот ключ: без ключа
+    # их нельзя ни опросить, ни отменить в Speechmatics
+    for transcription in await get_unfinished_transcriptions(db):
+        if transcription.credential_id == credential_id:
+            return True
+        if transcription.job_ids and any(
+            len(job) > 2 and job[2] == credential_id for job in json.loads(transcription.job_ids)
+        ):
+            return True
+    return False
+
+async def delete_api_credential_by_id(db: AsyncSession, credential_id: int) -> bool:
+    db_credential = await get_api_credential_by_id(db, credential_id)
+    if db_credential:
+        # История транскрипций сохраняется, ссылка на удаленный ключ обнуляется
+        await db.execute(
+            update(Transcription).where(Transcription.credential_id == credential_id).values(credential_id=None)
+        )
+        await db.delete(db_credential)
+        await db.commit()
+        return True
+    return False
+
+async def record_api_credential_failure(db: AsyncSession, credential_id: int, error: str,
+                                        quarantined_until: Optional[datetime] = None) -> Optional[ApiCredential]:
+    # Учет ошибки API по ключу; quarantined_until временно исключает ключ из выбора
+    db_credential = await get_api_credential_by_id(db, credential_id)
+    if db_credential:
+        db_credential.failure_count = (db_credential.failure_count or 0) + 1
+        db_credential.last_error = error[:500]
+        if quarantined_until:
+            db_credential.quarantined_until = quarantined_until
+        await db.commit()
+        await db.refresh(db_credential)
+    return db_credential
@@ -1,7 +1,7 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from contextlib import asynccontextmanager
-from sqlalchemy import select
+from sqlalchemy import select, inspect, text
 import os
 import logging
 
@@ -72,10 +72,27 @@ async def seed_settings(db: AsyncSession):
     await db.commit()
     logger.info("База данных заполнена начальными настройками.")
 
+def add_missing_columns(sync_conn):
+    # create_all не меняет уже существующие таблицы, поэтому новые колонки моделей
+    # (и их индексы) добавляем в старые базы вручную
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info(f"В таблицу {table.name} добавлена колонка {column.name}")
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
 async def init_db():
     # Асинхронная инициализация базы данных - создание всех таблиц и заполнение начальными данными.
     async with async_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
     
     logger.info("База данных инициализирована")
     
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, ForeignKey, Text, LargeBinary
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 import os
@@ -38,12 +38,22 @@ class Transcription(Base):
     duration = Column(Float)  # Длительность аудио/видео в секундах
     language = Column(String(10), default='ru')  # Язык транскрипции
     result_text = Column(Text)  # Результат транскрипции
-    result_format = Column(String(10), default='text')  # Формат результата: text, srt, json
+    result_format = Column(String(10), default='txt')  # Формат отправленного результата: txt, srt, vtt, json
     cost = Column(Float)  # Стоимость транскрипции в минутах
-    status = Column(String(20), default='processing')  # Статус: processing, completed, failed
+    status = Column(String(20), default='processing')  # Статус: processing, completed, failed, cancelled
     error_message = Column(String(500), nullable=True)  # Сообщение об ошибке, если была ошибка
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)  # Время завершения
+    file_unique_id = Column(String(255), nullable=True, index=True)  # file_unique_id файла в Telegram (для кэша результатов)
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 обработанного аудио (для кэша результатов)
+    stage = Column(String(20), nullable=True)  # Последний завершенный этап: converted, submitted, fetched, delivered
+    job_ids = Column(Text, nullable=True)  # JSON-список [ID задачи Speechmatics, смещение фрагмента в секундах]
+    chat_id = Column(Integer, nullable=True)  # Чат для доставки результата (в том числе после перезапуска)
+    progress_message_id = Column(Integer, nullable=True)  # Сообщение о прогрессе в этом чате
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    transcript_data = Column(LargeBinary, nullable=True)  # Слова с метками времени (сжатый JSON) для выгрузки в других форматах
+    credential_id = Column(Integer, ForeignKey("api_credentials.id"), nullable=True)  # API ключ, через который отправлена задача
+    time_map = Column(Text, nullable=True)  # JSON [начало без пауз, начало в исходной, длительность], если паузы удалены
     
     # Связи
     user = relationship("User", back_populates="transcriptions")
@@ -59,6 +69,7 @@ class Package(Base):
     price = Column(Float)  # Цена в рублях
     discount = Column(Float, default=0.0)  # Скидка в процентах
     is_active = Column(Boolean, default=True)  # Активен ли пакет
+    transcription_backend = Column(String(20), nullable=True)  # Движок распознавания для покупателей пакета (пусто - общий)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -87,4 +98,21 @@ class Setting(Base):
     __tablename__ = 'settings'
 
     key = Column(String, primary_key=True, index=True)
-    value = Column(String, nullable=False)
\ No newline at end of file
+    value = Column(String, nullable=False)
+
+
+class ApiCredential(Base):
+    # API ключ Speechmatics и адрес API, через которые отправляются задачи
+    __tablename__ = 'api_credentials'
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100))  # Отображаемое имя (последние символы ключа)
+    api_key = Column(String(255), nullable=False)
+    api_url = Column(String(500), nullable=True)  # Адрес API; если не задан, используется SPEECHMATICS_API_URL
+    realtime_url = Column(String(500), nullable=True)  # Адрес Realtime API (wss://) региона этого ключа
+    max_concurrent_jobs = Column(Integer, nullable=True)  # Лимит одновременных задач аккаунта (пусто - общий лимит из настроек)
+    is_active = Column(Boolean, default=True)  # Включен ли ключ администратором
+    quarantined_until = Column(DateTime, nullable=True)  # Ключ временно исключен после ошибок 401/403/429
+    failure_count = Column(Integer, default=0)  # Количество ошибок API по этому ключу
+    last_error = Column(String(500), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
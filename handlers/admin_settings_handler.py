@@ -3,11 +3,14 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import asyncio
+import html
+from datetime import datetime
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from keyboards.admin_settings_keyboard import (
     get_admin_settings_keyboard,
     get_admin_packages_keyboard,
+    get_admin_api_keys_keyboard,
     get_cancel_keyboard,
 )
 from keyboards.admin_packages_keyboard import (
@@ -24,11 +27,19 @@ from database.crud import (
     delete_package_by_id,
     get_package_by_id,
     create_package,
+    get_api_credentials,
+    get_api_credential_by_id,
+    create_api_credential,
+    set_api_credential_active,
+    delete_api_credential_by_id,
+    is_api_credential_in_use,
 )
 from database.models import Setting
 from database.database import get_async_db
 from core.bot import bot
 from utils.validation import InputValidator
+from config.settings import settings
+from services.credential_pool import credential_pool
 
 router = Router()
 
@@ -94,12 +105,60 @@ async def admin_settings_cancel_action_callback(
 
 
 # --- API Key Handlers ---
+async def show_admin_api_keys_page(message: Message | CallbackQuery, admin_telegram_id: int):
+    # Список ключей пула с состоянием: включен/выключен, карантин, задачи в работе, число ошибок
+    async with get_async_db() as db:
+        lang = await get_user_language_from_db(db, admin_telegram_id)
+        credentials = await get_api_credentials(db)
+
+    header = get_text("admin_api_keys_header", lang)
+    if not credentials:
+        text = f"{header}\n\n{get_text('admin_api_keys_empty', lang)}"
+    else:
+        now = datetime.utcnow()
+        lines = []
+        for credential in credentials:
+            if not credential.is_active:
+                status_text = get_text("status_inactive", lang)
+            elif credential.quarantined_until and credential.quarantined_until > now:
+                status_text = get_text("admin_api_key_status_quarantined", lang).format(
+                    until=f"{credential.quarantined_until:%d.%m %H:%M} UTC"
+                )
+            else:
+                status_text = get_text("status_active", lang)
+            lines.append(get_text("admin_api_key_item_format", lang).format(
+                name=html.escape(credential.name or f"#{credential.id}"),
+                endpoint=html.escape(credential.api_url or settings.speechmatics_api_url),
+                status=status_text,
+                in_flight=credential_pool.in_flight(credential.id),
+                max_jobs=credential.max_concurrent_jobs or settings.credential_default_max_concurrent_jobs or "∞",
+                failures=credential.failure_count or 0,
+            ))
+        text = f"{header}\n\n" + "\n".join(lines)
+
+    keyboard = get_admin_api_keys_keyboard(credentials, lang)
+    if isinstance(message, CallbackQuery):
+        await message.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    else:
+        await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
 @router.callback_query(F.data == "admin_settings:api_key", AdminFilter())
 async def admin_settings_api_key_callback(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await show_admin_api_keys_page(callback, callback.from_user.id)
+    await callback.answer()
+
+
+@router.callback_query(F.data == "admin_keys:add", AdminFilter())
+async def admin_keys_add_callback(callback: CallbackQuery, state: FSMContext):
     async with get_async_db() as db:
         lang = await get_user_language_from_db(db, callback.from_user.id)
         await state.update_data(prompt_message_id=callback.message.message_id)
-        prompt_text = get_text("admin_settings_enter_api_key", lang)
+        prompt_text = get_text("admin_settings_enter_api_key", lang).format(
+            default_url=html.escape(settings.speechmatics_api_url),
+            default_realtime_url=html.escape(settings.speechmatics_realtime_url),
+        )
         await callback.message.edit_text(
             prompt_text, reply_markup=get_cancel_keyboard(lang)
         )
@@ -107,17 +166,50 @@ async def admin_settings_api_key_callback(callback: CallbackQuery, state: FSMCon
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith("admin_keys:toggle:"), AdminFilter())
+async def admin_keys_toggle_callback(callback: CallbackQuery):
+    credential_id = int(callback.data.split(":")[2])
+    async with get_async_db() as db:
+        credential = await get_api_credential_by_id(db, credential_id)
+        if credential:
+            await set_api_credential_active(db, credential_id, not credential.is_active)
+    credential_pool.invalidate()
+    await show_admin_api_keys_page(callback, callback.from_user.id)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_keys:delete:"), AdminFilter())
+async def admin_keys_delete_callback(callback: CallbackQuery):
+    credential_id = int(callback.data.split(":")[2])
+    async with get_async_db() as db:
+        lang = await get_user_language_from_db(db, callback.from_user.id)
+        # Ключ нужен, пока его задачи не завершены: ими опрашивается и отменяется задача в Speechmatics
+        if await is_api_credential_in_use(db, credential_id):
+            await callback.answer(get_text("admin_api_key_in_use", lang), show_alert=True)
+            return
+        success = await delete_api_credential_by_id(db, credential_id)
+    credential_pool.invalidate()
+    await show_admin_api_keys_page(callback, callback.from_user.id)
+    await callback.answer(
+        get_text("admin_api_key_deleted" if success else "delete_error", lang), show_alert=True
+    )
+
+
 @router.message(AdminSettingsStates.waiting_for_api_key, AdminFilter())
 async def process_new_api_key(message: Message, state: FSMContext):
     async with get_async_db() as db:
         lang = await get_user_language_from_db(db, message.from_user.id)
-        validation_result = InputValidator.validate_api_key(message.text, lang)
+        validation_result = InputValidator.validate_api_credential_input(message.text, lang)
 
         if not validation_result.is_valid:
             await message.reply(validation_result.error_message)
             return
 
-        await update_setting(db, key="api_key", value=validation_result.value)
+        api_key, api_url, max_jobs, realtime_url = validation_result.value
+        await create_api_credential(
+            db, api_key=api_key, api_url=api_url, max_concurrent_jobs=max_jobs, realtime_url=realtime_url
+        )
+        credential_pool.invalidate()
 
         await message.delete()
         data = await state.get_data()
@@ -130,7 +222,7 @@ async def process_new_api_key(message: Message, state: FSMContext):
         )
 
         if prompt_message_id:
-            await show_admin_settings_page(message, message.from_user.id)
+            await show_admin_api_keys_page(message, message.from_user.id)
             await bot.delete_message(
                 chat_id=message.chat.id, message_id=prompt_message_id
             )
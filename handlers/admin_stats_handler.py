@@ -1,5 +1,6 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
 
 from database.database import get_async_db
 from database.crud import (
@@ -10,10 +11,12 @@ from database.crud import (
     count_blocked_users,
     get_total_payments_amount
 )
-from keyboards.admin_stats_keyboard import get_admin_stats_keyboard
+from keyboards.admin_stats_keyboard import get_admin_stats_keyboard, get_admin_performance_keyboard
 from keyboards.admin_keyboard import get_admin_main_keyboard
 from filters.admin_filter import AdminFilter
 from utils.language import get_text, get_user_language_from_db
+from services.eta_estimator import eta_estimator
+from services.stage_pools import pools_snapshot
 
 router = Router()
 
@@ -42,6 +45,47 @@ async def show_admin_stats_page(message: Message | CallbackQuery, admin_telegram
         else:
             await message.answer(stats_text, reply_markup=keyboard)
 
+def _format_rate(value) -> str:
+    return f"{value:.1f}" if value is not None else "-"
+
+
+@router.callback_query(F.data == "admin_stats:performance", AdminFilter())
+async def admin_stats_performance_callback(callback: CallbackQuery):
+    # Загрузка пулов этапов и скорость обработки по этапам и группам длительностей:
+    # секунды на минуту аудио (EWMA, медиана, p90)
+    async with get_async_db() as db:
+        lang = await get_user_language_from_db(db, callback.from_user.id)
+    rows = eta_estimator.snapshot()
+    lines = [get_text("admin_performance_pools_header", lang)]
+    for stage, limit, active, waiting, max_waiting, completed, average_wait, average_busy in pools_snapshot():
+        lines.append(get_text("admin_performance_pool_row", lang).format(
+            stage=stage, active=active, limit=limit, waiting=waiting, max_waiting=max_waiting,
+            completed=completed, wait=f"{average_wait:.1f}", busy=f"{average_busy:.1f}",
+        ))
+    lines.append("")
+    lines.append(get_text("admin_performance_header", lang))
+    if not rows:
+        lines.append(get_text("admin_performance_empty", lang))
+    for stage, bucket, count, ewma, median, p90 in rows:
+        lines.append(get_text("admin_performance_row", lang).format(
+            stage=stage, bucket=bucket, count=count,
+            ewma=_format_rate(ewma), median=_format_rate(median), p90=_format_rate(p90),
+        ))
+    try:
+        await callback.message.edit_text("\n".join(lines), reply_markup=get_admin_performance_keyboard(lang))
+    except TelegramBadRequest as e:
+        # Повторное нажатие "Обновить" без новых данных
+        if "message is not modified" not in str(e):
+            raise
+    await callback.answer()
+
+
+@router.callback_query(F.data == "admin_stats:back", AdminFilter())
+async def admin_stats_back_callback(callback: CallbackQuery):
+    await show_admin_stats_page(callback, callback.from_user.id)
+    await callback.answer()
+
+
 @router.callback_query(F.data == "admin_stats:main_menu", AdminFilter())
 async def admin_stats_main_menu_callback(callback: CallbackQuery):
     async with get_async_db() as db:
@@ -24,6 +24,7 @@ from handlers.transcription_handler import TranscriptionState
 from utils.error_handler import log_exceptions
 from core.bot import bot
 from utils.error_handler import notify_admin_about_error
+from utils.transcript_format import TRANSCRIPT_FORMATS, DEFAULT_TRANSCRIPT_FORMAT, render_stored_transcript_async
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -125,7 +126,11 @@ async def history_callback_handler(callback: CallbackQuery):
                     return
                 
                 text = transcription.result_text or get_text("text_missing", lang)
-                keyboard = create_transcription_view_keyboard(transcription_id, page, lang)
+                # Субтитры и JSON строятся из сохраненных меток времени, без повторного запроса к API
+                export_formats = [
+                    fmt for fmt in TRANSCRIPT_FORMATS if fmt != DEFAULT_TRANSCRIPT_FORMAT
+                ] if transcription.transcript_data else []
+                keyboard = create_transcription_view_keyboard(transcription_id, page, lang, export_formats)
                 await callback.message.edit_text(text, reply_markup=keyboard)
 
             elif action == "download":
@@ -150,6 +155,22 @@ async def history_callback_handler(callback: CallbackQuery):
                 
                 await callback.message.answer_document(text_file)
 
+            elif action == "export":
+                transcription_id, fmt = int(params[0]), params[1]
+                transcription = await get_transcription_by_id(db, transcription_id)
+                user = await get_user_by_telegram_id(db, user_id)
+                if not transcription or not user or transcription.user_id != user.id or not transcription.transcript_data:
+                    await callback.answer(get_text("transcription_not_found", lang), show_alert=True)
+                    return
+                if fmt not in TRANSCRIPT_FORMATS:
+                    fmt = DEFAULT_TRANSCRIPT_FORMAT
+
+                file_content = await render_stored_transcript_async(transcription_id, transcription.transcript_data, fmt)
+                file_name = f"{transcription.file_name.split('.')[0]}_result.{fmt}"
+                await callback.message.answer_document(
+                    BufferedInputFile((file_content or " ").encode('utf-8'), filename=file_name)
+                )
+
             elif action == "delete":
                 transcription_id, page = int(params[0]), int(params[1])
                 keyboard = create_confirm_delete_keyboard(transcription_id, page, lang)
@@ -7,7 +7,8 @@ from aiogram.filters import StateFilter
 
 from utils.language import get_text, get_user_language_from_db
 from handlers.transcription_handler import TranscriptionState
-from keyboards.main_menu import get_main_keyboard
+from keyboards.main_menu import get_main_keyboard, CANCEL_BUTTON_TEXTS
+from services.job_cancellation import active_jobs
 from database.database import get_async_db
 
 router = Router()
@@ -28,7 +29,7 @@ async def handle_transcribe_button(message: Message, state: FSMContext):
         await message.answer(text, reply_markup=ReplyKeyboardRemove())
 
 
-@router.message(F.text.in_(["Отмена", "Cancel"]))
+@router.message(F.text.in_(CANCEL_BUTTON_TEXTS))
 async def handle_cancel_from_any_state(message: Message, state: FSMContext):
     # Обработка нажатия кнопки 'Отмена' из любого состояния
     async with get_async_db() as db:
@@ -36,10 +37,14 @@ async def handle_cancel_from_any_state(message: Message, state: FSMContext):
         
         # Сбрасываем состояние
         await state.clear()
+
+        # Отменяем выполняющиеся транскрипции пользователя: FFmpeg останавливается, задачи в API отменяются,
+        # места в очередях освобождаются, а записи помечаются как отмененные (без списания минут)
+        cancelled = active_jobs.cancel_user_jobs(message.from_user.id)
         
         # Отправляем сообщение об отмене и главное меню
         await message.answer(
-            text=get_text("transcription_canceled", lang),
+            text=get_text("transcription_job_canceled" if cancelled else "transcription_canceled", lang),
             reply_markup=get_main_keyboard(lang)
         )
 
@@ -4,10 +4,12 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardRemove
+import asyncio
 import os
-import tempfile
+import json
 import math
 import logging
+import time
 
 from core.bot import bot
 from database.crud import (
@@ -15,14 +17,24 @@ from database.crud import (
     deduct_minutes_from_balance,
     create_transcription,
     update_transcription_status_and_result,
-    get_setting
+    get_setting,
+    get_transcription_by_id
 )
 from database.database import get_async_db
-from utils.audio_processing import get_audio_duration_async, cleanup_temp_file_async, process_file_for_transcription_optimized, get_file_size, process_file_for_transcription_async
-from services.transcription_service import transcribe_audio_file_with_progress
+from utils.audio_processing import get_audio_duration_async, process_file_for_transcription_optimized, get_file_size, process_file_for_transcription_async, split_for_transcription_async, compute_file_hash_async, probe_media_async, choose_audio_preparation, remux_audio_async, can_prepare_while_downloading, prepare_audio_while_downloading_async, AUDIO_PASSTHROUGH, AUDIO_REMUX, AUDIO_TRANSCODE
+from services.transcription_service import transcribe_audio_file_with_progress, transcribe_audio_chunks_with_progress, deliver_transcription_result, show_progress_text, cancel_transcription_jobs
+from services.realtime_service import transcribe_audio_realtime_with_progress, is_realtime_eligible
+from services.transcription_backends import SPEECHMATICS_BACKEND, select_backend
+from services.result_cache import result_cache, inflight_transcriptions
+from services.eta_estimator import eta_estimator, STAGE_FFMPEG
+from services.job_recovery import active_transcription_ids
+from services.stage_pools import download_pool, ffmpeg_pool, provider_pool
+from services.workspace import workspace_manager, estimate_job_bytes
+from services.job_cancellation import active_jobs
+from utils.voice_activity import TimeMap, analyze_voice_activity_async, plan_silence_trim, trim_silence_async
 from utils.language import get_text, get_user_language_from_db
-from config.settings import settings, transcription_semaphore
-from keyboards.main_menu import get_main_keyboard
+from config.settings import settings
+from keyboards.main_menu import get_main_keyboard, CANCEL_BUTTON_TEXTS
 from utils.error_handler import log_exceptions, notify_admin_about_error
 
 router = Router()
@@ -45,12 +57,159 @@ async def start_transcription_command(message: Message, state: FSMContext):
 from aiogram.exceptions import TelegramBadRequest
 
 
-@router.message(TranscriptionState.waiting_for_file)
+async def check_balance_for_cost(message: Message, lang: str, user, cost_minutes: int) -> bool:
+    # Проверка баланса перед транскрипцией; при нехватке минут отправляет пользователю сообщение
+    if user.balance <= 0:
+        await message.answer(get_text("zero_balance", lang).format(username=(user.first_name or user.username)), reply_markup=get_main_keyboard(lang))
+        return False
+
+    if user.balance < cost_minutes:
+        await message.answer(get_text("insufficient_balance", lang).format(
+            cost_minutes=cost_minutes,
+            user_balance=int(user.balance)
+        ), reply_markup=get_main_keyboard(lang))
+        return False
+    return True
+
+
+async def check_duration_before_conversion(message: Message, lang: str, duration_seconds: float,
+                                          max_audio_duration_minutes: int) -> bool:
+    # Проверка лимита длительности и баланса по метаданным исходного файла - до конвертации,
+    # чтобы не тратить FFmpeg на файл, который все равно будет отклонен
+    if duration_seconds > max_audio_duration_minutes * 60:
+        await message.answer(get_text("audio_too_long", lang).format(
+            max_duration_min=max_audio_duration_minutes,
+            actual_duration_min=math.ceil(duration_seconds / 60)
+        ), reply_markup=get_main_keyboard(lang))
+        return False
+
+    async with get_async_db() as db:
+        user = await get_user_by_telegram_id(db, message.from_user.id)
+    if user and not await check_balance_for_cost(message, lang, user, math.ceil(duration_seconds / 60)):
+        return False
+    return True
+
+
+async def reuse_cached_transcription(message: Message, lang: str, user, cached, original_filename: str,
+                                     file_unique_id: str, content_hash: str = None, progress_msg: Message = None):
+    # Повторное использование готового результата для того же файла: без скачивания, FFmpeg и запроса к API.
+    # В истории появляется новая запись, минуты списываются как за обычную транскрипцию.
+    cost_minutes = math.ceil((cached.duration or 0) / 60)
+    if not await check_balance_for_cost(message, lang, user, cost_minutes):
+        if progress_msg:
+            await progress_msg.delete()
+        return
+
+    # Списание и доставка не прерываются отменой (см. deliver_transcription_result)
+    await active_jobs.commit_current()
+    async with get_async_db() as db:
+        db_transcription = await create_transcription(
+            db=db,
+            user_id=user.id,
+            file_name=original_filename,
+            file_path=cached.file_path,
+            duration=cached.duration,
+            language=user.language_code,
+            cost=cost_minutes,
+            file_unique_id=file_unique_id,
+            content_hash=content_hash or cached.content_hash
+        )
+        db_transcription = await update_transcription_status_and_result(
+            db=db,
+            transcription_id=db_transcription.id,
+            status='completed',
+            result_text=cached.result_text,
+            transcript_data=cached.transcript_data
+        )
+        await deduct_minutes_from_balance(db, user.telegram_id, cost_minutes)
+    result_cache.remember(db_transcription)
+    logger.info(f"Результат транскрипции {cached.id} переиспользован для пользователя {user.telegram_id}")
+
+    if progress_msg is None:
+        progress_msg = await message.answer(get_text("processing", lang))
+    await deliver_transcription_result(
+        db, bot, progress_msg, original_filename, cached.result_text, f"cache:{cached.id}", transcript_data=cached.transcript_data
+    )
+
+
+async def wait_for_inflight_transcription(message: Message, lang: str, user, flight, original_filename: str,
+                                         file_unique_id: str, content_hash: str = None, progress_msg: Message = None):
+    # Тот же файл уже обрабатывается по другому запросу: ждем его результата вместо своей обработки.
+    # Возвращает кортеж (ID переиспользованной транскрипции или None, сообщение о прогрессе);
+    # None означает, что первая обработка не удалась и файл нужно обработать самостоятельно.
+    waiting_text = get_text("transcription_waiting_same_file", lang)
+    if progress_msg is None:
+        progress_msg = await message.answer(waiting_text)
+    else:
+        await show_progress_text(bot, progress_msg, waiting_text)
+
+    transcription_id = await inflight_transcriptions.wait(flight)
+    if transcription_id is None:
+        return None, progress_msg
+    async with get_async_db() as db:
+        cached = await get_transcription_by_id(db, transcription_id)
+    if not cached or cached.status != 'completed' or not cached.result_text:
+        return None, progress_msg
+
+    await reuse_cached_transcription(
+        message, lang, user, cached, original_filename, file_unique_id, content_hash, progress_msg
+    )
+    return cached.id, progress_msg
+
+
+async def finish_cancelled_transcription(transcription_id: int = None, progress_msg: Message = None,
+                                         submitted_jobs: list = ()):
+    # Транскрипция отменена пользователем: задачи, уже отправленные в API, отменяются,
+    # запись помечается как cancelled (минуты не списываются), сообщение о прогрессе удаляется.
+    # submitted_jobs - задачи из токена отмены: среди них есть и те, что еще не успели сохраниться в базе
+    if transcription_id:
+        async with get_async_db() as db:
+            transcription = await get_transcription_by_id(db, transcription_id)
+        if transcription and transcription.status == 'processing':
+            job_ids = json.loads(transcription.job_ids) if transcription.job_ids else []
+            saved_ids = {job[0] for job in job_ids}
+            job_ids += [job for job in submitted_jobs if job[0] not in saved_ids]
+            if job_ids:
+                await cancel_transcription_jobs(job_ids)
+            async with get_async_db() as db:
+                await update_transcription_status_and_result(
+                    db=db,
+                    transcription_id=transcription_id,
+                    status='cancelled',
+                    error_message='Отменено пользователем'
+                )
+            logger.info(f"Транскрипция {transcription_id} отменена пользователем")
+    if progress_msg:
+        try:
+            await progress_msg.delete()
+        except Exception as e:
+            logger.warning(f"Не удалось удалить сообщение о прогрессе: {e}")
+
+
+async def iter_telegram_file(file_path: str):
+    # Содержимое файла с серверов Telegram блоками по мере скачивания (как в bot.download_file)
+    url = bot.session.api.file_url(bot.token, file_path)
+    async for chunk in bot.session.stream_content(url=url, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield chunk
+
+
+# "Отмена" во время ожидания файла или обработки уходит общему обработчику отмены (main_menu_handlers)
+@router.message(TranscriptionState.waiting_for_file, ~F.text.in_(CANCEL_BUTTON_TEXTS))
 @log_exceptions
 async def handle_file_for_transcription(message: Message, state: FSMContext):
+    workspace = None
     temp_file_path = None
     processed_audio_path = None
+    trimmed_audio_path = None
+    time_map = None
+    chunks = []
     db_transcription = None
+    progress_msg = None
+    # Своя обработка файла в реестре выполняющихся и ID готовой транскрипции для тех, кто ее ждет
+    flight = None
+    completed_transcription_id = None
+    # Отмена этой задачи кнопкой "Отмена" (см. handle_cancel_from_any_state)
+    cancellation = None
 
     try:
         async with get_async_db() as db:
@@ -64,6 +223,8 @@ async def handle_file_for_transcription(message: Message, state: FSMContext):
             await state.clear()
             return
 
+        cancellation = active_jobs.begin(message.from_user.id)
+
         original_filename = file.file_name if hasattr(file, 'file_name') else get_text("default_voice_filename", lang)
         file_ext = os.path.splitext(original_filename)[1].lower()
         is_video = file_ext in ['.mp4', '.avi', '.mov', '.mkv', '.webm']
@@ -73,6 +234,29 @@ async def handle_file_for_transcription(message: Message, state: FSMContext):
             await state.clear()
             return
 
+        # Этот же файл уже транскрибировался - отдаем готовый результат без скачивания
+        async with get_async_db() as db:
+            cache_user = await get_user_by_telegram_id(db, message.from_user.id)
+            cached = await result_cache.lookup(db, cache_user, file_unique_id=file.file_unique_id) if cache_user else None
+        if cached:
+            await reuse_cached_transcription(message, lang, cache_user, cached, original_filename, file.file_unique_id)
+            return
+
+        # Тот же файл прямо сейчас обрабатывается по другому запросу - ждем его результата.
+        # Если та обработка не удалась, файл обрабатывает первый из ожидавших, остальные ждут уже его.
+        if cache_user:
+            while True:
+                other_flight = inflight_transcriptions.find(cache_user, file_unique_id=file.file_unique_id)
+                if other_flight is None:
+                    break
+                reused_id, progress_msg = await wait_for_inflight_transcription(
+                    message, lang, cache_user, other_flight, original_filename, file.file_unique_id,
+                    progress_msg=progress_msg
+                )
+                if reused_id:
+                    return
+            flight = inflight_transcriptions.begin(cache_user, file.file_unique_id)
+
         async with get_async_db() as db:
             max_duration_db = await get_setting(db, "max_audio_duration_minutes")
             if max_duration_db and max_duration_db.isdigit():
@@ -92,32 +276,126 @@ async def handle_file_for_transcription(message: Message, state: FSMContext):
                 logger.error(f"TelegramBadRequest while getting file info: {e}")
                 raise e
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-            temp_file_path = temp_file.name
+        # Длительность, которую сообщает Telegram (голосовые, аудио, видео), позволяет отклонить файл
+        # еще до скачивания; окончательная проверка - по метаданным скачанного файла
+        telegram_duration = getattr(file, "duration", None) or 0
+        if telegram_duration and not await check_duration_before_conversion(
+            message, lang, telegram_duration, max_audio_duration_minutes
+        ):
+            return
 
-        await bot.download_file(file_info.file_path, temp_file_path)
-            
-        progress_msg = await message.answer(get_text("processing", lang))
-        
-        # Используем семафор для ограничения одновременных обработок
-        async with transcription_semaphore:
-            # Для видео используем оптимизированную функцию, для аудио - стандартную
-            if is_video:
-                processed_audio_path, processing_error_message = await process_file_for_transcription_optimized(
-                    temp_file_path, is_video
-                )
-            else:
-                processed_audio_path, processing_error_message = await process_file_for_transcription_async(
-                    temp_file_path, is_video
+        # Все временные файлы задачи лежат в ее папке рабочей области; место резервируется заранее,
+        # при исчерпании квоты задача ждет в очереди. Пока длительность неизвестна, резерв рассчитан
+        # на наибольшую допустимую и уточняется после чтения метаданных.
+        file_size = getattr(file, "file_size", None)
+        workspace = await workspace_manager.open_job(
+            estimate_job_bytes(file_size, telegram_duration, max_audio_duration_minutes * 60)
+        )
+        temp_file_path = workspace.new_file_path(file_ext)
+
+        # Файлы, которые все равно пойдут через FFmpeg, подаются ему по мере скачивания: сеть и CPU работают
+        # параллельно. Короткие записи не нужно готовить заранее - они перекодируются при загрузке в API.
+        prepare_while_downloading = (
+            settings.download_overlap_enabled
+            and not bot.session.api.is_local
+            and can_prepare_while_downloading(file_ext)
+            and not (
+                settings.audio_streaming_upload
+                and 0 < telegram_duration < settings.chunked_transcription_min_duration_seconds
+            )
+        )
+        overlapped_preparation = None
+        if prepare_while_downloading:
+            if progress_msg is None:
+                progress_msg = await message.answer(get_text("processing", lang))
+            # Место в пуле FFmpeg занимается после места в пуле скачиваний (всегда в этом порядке)
+            # и только пока работает процесс FFmpeg
+            async with download_pool.slot():
+                processed_audio_path, overlapped_preparation, _ = await prepare_audio_while_downloading_async(
+                    iter_telegram_file(file_info.file_path), temp_file_path, settings.audio_upload_codec, workspace.path,
+                    ffmpeg_slot=ffmpeg_pool.slot,
                 )
+        else:
+            async with download_pool.slot():
+                await bot.download_file(file_info.file_path, temp_file_path)
+
+        if progress_msg is None:
+            progress_msg = await message.answer(get_text("processing", lang))
+        else:
+            await show_progress_text(bot, progress_msg, get_text("processing", lang))
         
-        if not processed_audio_path:
-            await message.answer(processing_error_message or get_text("transcription_error", lang), reply_markup=get_main_keyboard(lang))
+        # Формат исходного файла определяет подготовку: формат, который API принимает (голосовые OGG/Opus,
+        # MP3, M4A), отправляется как есть; такая же дорожка в видео копируется без перекодирования;
+        # остальное перекодируется FFmpeg
+        media_info = await probe_media_async(temp_file_path)
+        source_duration = media_info.duration if media_info else 0.0
+        if source_duration > 0 and not await check_duration_before_conversion(
+            message, lang, source_duration, max_audio_duration_minutes
+        ):
             return
+        if source_duration > 0:
+            await workspace.resize(estimate_job_bytes(file_size, source_duration))
 
+        if overlapped_preparation:
+            preparation = overlapped_preparation
+        elif settings.audio_passthrough_enabled and source_duration > 0:
+            preparation = choose_audio_preparation(temp_file_path, media_info)
+        else:
+            preparation = AUDIO_TRANSCODE
 
-        duration_seconds = await get_audio_duration_async(processed_audio_path)
-        
+        # Записи короче порога нарезки на фрагменты не конвертируются во временный файл: исходный файл
+        # перекодируется FFmpeg прямо в тело запроса к API (или декодируется движком) во время загрузки
+        stream_upload = (
+            not overlapped_preparation
+            and preparation == AUDIO_TRANSCODE
+            and settings.audio_streaming_upload
+            and 0 < source_duration < settings.chunked_transcription_min_duration_seconds
+        )
+
+        if overlapped_preparation:
+            # Аудио подготовлено во время скачивания
+            audio_path = processed_audio_path
+            if overlapped_preparation == AUDIO_REMUX and source_duration > 0:
+                duration_seconds = source_duration
+            else:
+                duration_seconds = await get_audio_duration_async(processed_audio_path)
+        elif preparation == AUDIO_PASSTHROUGH or stream_upload:
+            audio_path = temp_file_path
+            duration_seconds = source_duration
+        elif preparation == AUDIO_REMUX:
+            async with ffmpeg_pool.slot():
+                processed_audio_path, processing_error_message = await remux_audio_async(
+                    temp_file_path, media_info.audio_codec, workspace.path
+                )
+            if not processed_audio_path:
+                await message.answer(processing_error_message or get_text("transcription_error", lang), reply_markup=get_main_keyboard(lang))
+                return
+            audio_path = processed_audio_path
+            duration_seconds = source_duration
+        else:
+            # Число одновременных процессов FFmpeg ограничено числом ядер CPU
+            async with ffmpeg_pool.slot():
+                conversion_started_at = time.monotonic()
+                # Для видео используем оптимизированную функцию, для аудио - стандартную
+                if is_video:
+                    processed_audio_path, processing_error_message = await process_file_for_transcription_optimized(
+                        temp_file_path, is_video, settings.audio_upload_codec, workspace.path
+                    )
+                else:
+                    processed_audio_path, processing_error_message = await process_file_for_transcription_async(
+                        temp_file_path, is_video, settings.audio_upload_codec, workspace.path
+                    )
+                conversion_seconds = time.monotonic() - conversion_started_at
+
+            if not processed_audio_path:
+                await message.answer(processing_error_message or get_text("transcription_error", lang), reply_markup=get_main_keyboard(lang))
+                return
+
+            audio_path = processed_audio_path
+            duration_seconds = await get_audio_duration_async(processed_audio_path)
+            eta_estimator.observe(STAGE_FFMPEG, duration_seconds, conversion_seconds)
+
+        # Повторная проверка по обработанному файлу: длительность исходного могла быть неизвестна
         if duration_seconds > max_audio_duration_minutes * 60:
             actual_duration_min = math.ceil(duration_seconds / 60)
             await message.answer(get_text("audio_too_long", lang).format(
@@ -127,52 +405,156 @@ async def handle_file_for_transcription(message: Message, state: FSMContext):
             return
 
         cost_minutes = math.ceil(duration_seconds / 60)
+        if not source_duration:
+            # Длительность стала известна только по обработанному файлу (до удаления пауз и нарезки)
+            await workspace.resize(estimate_job_bytes(file_size, duration_seconds))
+
+        # Хэш аудио (обработанного или, если файл не конвертировался, исходного) находит тот же файл,
+        # присланный заново (с другим file_unique_id)
+        content_hash = await compute_file_hash_async(audio_path)
+
+        # Тот же звук (присланный как другой файл) уже обрабатывается - ждем его результата
+        if flight is not None:
+            other_flight = inflight_transcriptions.find(cache_user, content_hash=content_hash)
+            if other_flight is not None and other_flight is not flight:
+                reused_id, progress_msg = await wait_for_inflight_transcription(
+                    message, lang, cache_user, other_flight, original_filename, file.file_unique_id,
+                    content_hash, progress_msg
+                )
+                if reused_id:
+                    completed_transcription_id = reused_id
+                    return
+            inflight_transcriptions.add_key(flight, cache_user, "hash", content_hash)
 
+        # Сессия базы открыта только на время коротких запросов: поиск речи, удаление пауз и нарезка
+        # (ожидание места в пуле FFmpeg и сам FFmpeg) идут без открытого соединения
         async with get_async_db() as db:
             user = await get_user_by_telegram_id(db, message.from_user.id)
             if not user:
                 await message.answer(get_text("user_not_found_start", lang), reply_markup=get_main_keyboard(lang))
                 return
 
-            if user.balance <= 0:
-                await message.answer(get_text("zero_balance", lang).format(username=(user.first_name or user.username)), reply_markup=get_main_keyboard(lang))
+            cached = await result_cache.lookup(db, user, content_hash=content_hash)
+            if cached:
+                await reuse_cached_transcription(
+                    message, lang, user, cached, original_filename, file.file_unique_id, content_hash, progress_msg
+                )
+                completed_transcription_id = cached.id
                 return
-            
-            if user.balance < cost_minutes:
-                await message.answer(get_text("insufficient_balance", lang).format(
-                    cost_minutes=cost_minutes,
-                    user_balance=int(user.balance)
-                ), reply_markup=get_main_keyboard(lang))
+
+            # Баланс проверяется по полной длительности: удаление пауз может только уменьшить списание
+            if not await check_balance_for_cost(message, lang, user, cost_minutes):
+                return
+
+            # Движок распознавания по пакету пользователя и языку (Speechmatics или локальный)
+            backend = await select_backend(db, user.id, user.language_code)
+
+        # Поиск речи (VAD): запись без речи отклоняется до отправки в API, а длинные паузы
+        # (если включено) вырезаются - меньше загрузка, минуты API и списание с баланса
+        if settings.vad_enabled:
+            async with ffmpeg_pool.slot():
+                voice_activity = await analyze_voice_activity_async(audio_path)
+            if voice_activity is not None and voice_activity.is_silent():
+                await message.answer(get_text("audio_no_speech", lang), reply_markup=get_main_keyboard(lang))
                 return
+            keep_segments = (
+                plan_silence_trim(voice_activity)
+                if voice_activity is not None and settings.vad_silence_trim_enabled else None
+            )
+            if keep_segments:
+                async with ffmpeg_pool.slot():
+                    trimmed_audio_path, _ = await trim_silence_async(
+                        audio_path, keep_segments, settings.audio_upload_codec, workspace.path
+                    )
+                if trimmed_audio_path:
+                    time_map = TimeMap.from_keep_segments(keep_segments)
+                    logger.info(
+                        f"Удалены паузы: {duration_seconds:.1f} с -> {time_map.processed_duration:.1f} с "
+                        f"({original_filename})"
+                    )
+                    audio_path = trimmed_audio_path
+                    duration_seconds = time_map.processed_duration
+                    cost_minutes = math.ceil(duration_seconds / 60)
+                    stream_upload = False
+
+        # Длинные записи режем по паузам на фрагменты для параллельной транскрипции
+        if not stream_upload:
+            async with ffmpeg_pool.slot():
+                chunks, _ = await split_for_transcription_async(audio_path, duration_seconds, workspace.path)
 
+        async with get_async_db() as db:
             db_transcription = await create_transcription(
                 db=db,
                 user_id=user.id,
                 file_name=original_filename,
-                file_path=processed_audio_path,
+                file_path=audio_path,
                 duration=duration_seconds,
                 language=user.language_code,
-                cost=cost_minutes
+                cost=cost_minutes,
+                file_unique_id=file.file_unique_id,
+                content_hash=content_hash,
+                chat_id=message.chat.id,
+                progress_message_id=progress_msg.message_id,
+                stage="converted",
+                time_map=time_map.to_json() if time_map else None
             )
+            active_transcription_ids.add(db_transcription.id)
 
-        transcription_text, transcription_error_message = await transcribe_audio_file_with_progress(
-            db,
-            processed_audio_path,
-            user.language_code,
-            bot,
-            progress_msg,
-            original_filename=original_filename
-        )
+        # Ожидание результата распознавания упирается в сеть и API, а не в CPU - у него свой, больший лимит
+        async with provider_pool.slot():
+            if chunks:
+                transcription_text, transcription_error_message = await transcribe_audio_chunks_with_progress(
+                    db,
+                    chunks,
+                    user.language_code,
+                    bot,
+                    progress_msg,
+                    original_filename=original_filename,
+                    audio_duration=duration_seconds,
+                    transcription_id=db_transcription.id,
+                    backend=backend,
+                    time_map=time_map
+                )
+            elif backend.name == SPEECHMATICS_BACKEND and is_realtime_eligible(duration_seconds):
+                # Короткие записи (голосовые сообщения) - потоково, с промежуточным текстом
+                transcription_text, transcription_error_message = await transcribe_audio_realtime_with_progress(
+                    db,
+                    audio_path,
+                    user.language_code,
+                    bot,
+                    progress_msg,
+                    original_filename=original_filename,
+                    audio_duration=duration_seconds,
+                    transcription_id=db_transcription.id,
+                    needs_conversion=stream_upload,
+                    time_map=time_map
+                )
+            else:
+                transcription_text, transcription_error_message = await transcribe_audio_file_with_progress(
+                    db,
+                    audio_path,
+                    user.language_code,
+                    bot,
+                    progress_msg,
+                    original_filename=original_filename,
+                    audio_duration=duration_seconds,
+                    transcription_id=db_transcription.id,
+                    backend=backend,
+                    needs_conversion=stream_upload,
+                    time_map=time_map
+                )
 
         if transcription_text:
             async with get_async_db() as db:
-                await update_transcription_status_and_result(
+                db_transcription = await update_transcription_status_and_result(
                     db=db,
                     transcription_id=db_transcription.id,
                     status='completed',
                     result_text=transcription_text
                 )
                 await deduct_minutes_from_balance(db, user.telegram_id, cost_minutes)
+            result_cache.remember(db_transcription)
+            completed_transcription_id = db_transcription.id
         elif transcription_error_message: # Only send message if there's an actual error message to display
             async with get_async_db() as db:
                 await update_transcription_status_and_result(
@@ -182,7 +564,26 @@ async def handle_file_for_transcription(message: Message, state: FSMContext):
                     error_message=transcription_error_message
                 )
             await message.answer(transcription_error_message or get_text("transcription_error", lang), reply_markup=get_main_keyboard(lang))
+        else:
+            # Текст не найден: пользователь уже получил сообщение, минуты не списываются
+            async with get_async_db() as db:
+                await update_transcription_status_and_result(
+                    db=db,
+                    transcription_id=db_transcription.id,
+                    status='failed',
+                    error_message='Текст не найден'
+                )
 
+    except asyncio.CancelledError:
+        if cancellation is None or not cancellation.cancelled:
+            # Остановка бота: отправленная задача продолжится после перезапуска (job_recovery)
+            raise
+        # Отмена пользователем: запрос отмены снят, чтобы завершить задачу (отмена задач API, статус в базе)
+        asyncio.current_task().uncancel()
+        if completed_transcription_id is None:
+            await finish_cancelled_transcription(
+                db_transcription.id if db_transcription else None, progress_msg, cancellation.submitted_jobs
+            )
     except Exception as e:
         logger.exception(get_text("transcription_handler_error", lang).format(user_id=message.from_user.id))
         # Отправить уведомление админу о критической ошибке
@@ -201,8 +602,13 @@ async def handle_file_for_transcription(message: Message, state: FSMContext):
                 lang = await get_user_language_from_db(db, message.from_user.id)
         await message.answer(get_text("transcription_error", lang), reply_markup=get_main_keyboard(lang))
     finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            await cleanup_temp_file_async(temp_file_path)
-        if processed_audio_path and os.path.exists(processed_audio_path):
-            await cleanup_temp_file_async(processed_audio_path)
+        if cancellation is not None:
+            active_jobs.finish(message.from_user.id, cancellation)
+        if flight is not None:
+            inflight_transcriptions.finish(flight, completed_transcription_id)
+        if db_transcription:
+            active_transcription_ids.discard(db_transcription.id)
+        if workspace:
+            # Папка задачи удаляется вместе со всеми файлами (исходным, обработанным, фрагментами)
+            await workspace.close()
         await state.clear()
\ No newline at end of file
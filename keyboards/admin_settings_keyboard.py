@@ -23,6 +23,19 @@ def get_admin_packages_keyboard(lang: str) -> InlineKeyboardMarkup:
     builder.row(InlineKeyboardButton(text=get_text("kb_back_to_settings_menu", lang), callback_data="admin_packages:back_to_settings"))
     return builder.as_markup()
 
+def get_admin_api_keys_keyboard(credentials: list, lang: str) -> InlineKeyboardMarkup:
+    # Создает клавиатуру для управления пулом API ключей: включение/выключение и удаление каждого ключа.
+    builder = InlineKeyboardBuilder()
+    for credential in credentials:
+        toggle_icon = "⏸" if credential.is_active else "▶️"
+        builder.row(
+            InlineKeyboardButton(text=f"{toggle_icon} {credential.name}", callback_data=f"admin_keys:toggle:{credential.id}"),
+            InlineKeyboardButton(text="🗑️", callback_data=f"admin_keys:delete:{credential.id}")
+        )
+    builder.row(InlineKeyboardButton(text=get_text("admin_api_keys_add", lang), callback_data="admin_keys:add"))
+    builder.row(InlineKeyboardButton(text=get_text("kb_back_to_settings_menu", lang), callback_data="admin_settings:cancel_action"))
+    return builder.as_markup()
+
 def get_cancel_keyboard(lang: str) -> InlineKeyboardMarkup:
     # Создает и возвращает Inline-клавиатуру с кнопкой "Отмена".
     builder = InlineKeyboardBuilder()
@@ -6,5 +6,14 @@ from utils.language import get_text
 def get_admin_stats_keyboard(lang: str) -> InlineKeyboardMarkup:
     # Создает и возвращает Inline-клавиатуру для раздела статистики админ-панели.
     builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text=get_text("admin_stats_performance", lang), callback_data="admin_stats:performance"))
     builder.row(InlineKeyboardButton(text=get_text("kb_back_to_admin_menu", lang), callback_data="admin_stats:main_menu"))
+    return builder.as_markup()
+
+
+def get_admin_performance_keyboard(lang: str) -> InlineKeyboardMarkup:
+    # Клавиатура страницы производительности: обновить и вернуться к статистике
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text=get_text("admin_performance_refresh", lang), callback_data="admin_stats:performance"))
+    builder.row(InlineKeyboardButton(text=get_text("admin_performance_back", lang), callback_data="admin_stats:back"))
     return builder.as_markup()
\ No newline at end of file
@@ -1,6 +1,6 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from typing import List
+from typing import List, Sequence
 
 from database.models import Transcription
 from utils.language import get_text
@@ -13,7 +13,7 @@ def create_history_list_keyboard(transcriptions: List[Transcription], page: int,
     for t in transcriptions:
         # Показываем первые 40 символов имени файла
         file_name_snippet = (t.file_name[:35] + '...') if len(t.file_name) > 38 else t.file_name
-        status_icon = "✅" if t.status == 'completed' else ("❌" if t.status == 'failed' else "⏳")
+        status_icon = "✅" if t.status == 'completed' else ("❌" if t.status == 'failed' else ("🚫" if t.status == 'cancelled' else "⏳"))
         button_text = f"{status_icon} {t.created_at.strftime('%d.%m.%y')} - {file_name_snippet}"
         builder.row(InlineKeyboardButton(text=button_text, callback_data=f"history:view:{t.id}:{page}"))
 
@@ -36,13 +36,19 @@ def create_history_list_keyboard(transcriptions: List[Transcription], page: int,
 
     return builder.as_markup()
 
-def create_transcription_view_keyboard(transcription_id: int, page: int, lang: str) -> InlineKeyboardMarkup:
+def create_transcription_view_keyboard(transcription_id: int, page: int, lang: str, export_formats: Sequence[str] = ()) -> InlineKeyboardMarkup:
     # Создает клавиатуру для детального просмотра транскрипции.
+    # export_formats - дополнительные форматы выгрузки (есть только у записей с метками времени).
     builder = InlineKeyboardBuilder()
     builder.row(
         InlineKeyboardButton(text=get_text("kb_delete", lang), callback_data=f"history:delete:{transcription_id}:{page}"),
         InlineKeyboardButton(text=get_text("kb_download", lang), callback_data=f"history:download:{transcription_id}")
     )
+    if export_formats:
+        builder.row(*[
+            InlineKeyboardButton(text=fmt.upper(), callback_data=f"history:export:{transcription_id}:{fmt}")
+            for fmt in export_formats
+        ])
     builder.row(
         InlineKeyboardButton(text=get_text("kb_back_to_list", lang), callback_data=f"history:page:{page}")
     )
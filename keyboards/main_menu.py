@@ -2,6 +2,9 @@ from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
 from utils.language import get_text
 
+# Тексты кнопки "Отмена": сбрасывают состояние и отменяют выполняющиеся транскрипции пользователя
+CANCEL_BUTTON_TEXTS = ["Отмена", "Cancel"]
+
 def get_main_keyboard(language_code: str = 'ru'):
     # Создает и возвращает основную клавиатуру для бота
     # Определяем текст кнопок в зависимости от языка
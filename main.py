@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import logging
 import os
 import sys
@@ -26,6 +27,13 @@ from handlers.balance_handler import router as balance_router
 from handlers.admin_handler import router as admin_router
 from database.database import init_db
 from utils.error_handler import setup_error_handlers
+from services.http_client import init_http_session, close_http_session
+from services.job_poller import job_poller
+from services.callback_server import is_callback_mode_enabled, start_callback_server, stop_callback_server
+from services.job_recovery import resume_unfinished_transcriptions, start_reconciler, stop_reconciler
+from services.transcription_backends import shutdown_backends
+from services.workspace import start_workspace_sweeper, stop_workspace_sweeper
+from utils.ffmpeg_utils import probe_ffmpeg_capabilities_async
 
 
 
@@ -42,17 +50,47 @@ dp.include_router(main_menu_router)
 
 
 async def main():
-    # Создаем папку для данных, если она не существует
-    os.makedirs("data", exist_ok=True)
-    
-    # Инициализация базы данных
-    await init_db()
-    
-    # Настройка обработки ошибок
-    setup_error_handlers(bot)
-    
-    # Запуск бота
-    await dp.start_polling(bot)
+    # Ресурсы закрываются в обратном порядке при любом выходе: и после остановки бота,
+    # и если запуск прервался на полпути (ошибка FFmpeg, базы, приемника уведомлений, продолжения задач)
+    async with contextlib.AsyncExitStack() as resources:
+        resources.callback(shutdown_backends)
+
+        # Проверка FFmpeg до запуска: без него или без нужных фильтров бот не стартует,
+        # а не падает на первом файле пользователя
+        await probe_ffmpeg_capabilities_async()
+
+        # Создаем папку для данных, если она не существует
+        os.makedirs("data", exist_ok=True)
+
+        # Инициализация базы данных
+        await init_db()
+
+        # Настройка обработки ошибок
+        setup_error_handlers(bot)
+
+        # Общий HTTP-клиент для Speechmatics (keep-alive, кэш DNS, лимиты соединений)
+        await init_http_session()
+        resources.push_async_callback(close_http_session)
+        # Единый планировщик опроса статусов задач транскрипции
+        job_poller.start()
+        resources.push_async_callback(job_poller.stop)
+
+        # Приемник уведомлений о завершении задач (если включен режим уведомлений)
+        if is_callback_mode_enabled():
+            callback_runner = await start_callback_server()
+            resources.push_async_callback(stop_callback_server, callback_runner)
+
+        # Рабочая область временных файлов: удаление папок, оставшихся от прерванных задач, и периодическая очистка
+        await start_workspace_sweeper()
+        resources.push_async_callback(stop_workspace_sweeper)
+
+        # Продолжение транскрипций, прерванных перезапуском, и периодическая сверка зависших задач
+        resources.push_async_callback(stop_reconciler)
+        await resume_unfinished_transcriptions(bot)
+        start_reconciler(bot)
+
+        # Запуск бота
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
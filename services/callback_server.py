@@ -0,0 +1,91 @@
+import hmac
+import logging
+from typing import Optional
+
+from aiohttp import web
+
+from config.settings import settings
+from services.job_poller import job_poller
+
+logger = logging.getLogger(__name__)
+
+
+def is_callback_mode_enabled() -> bool:
+    # Режим уведомлений включен, только если задан публичный адрес приемника
+    return settings.speechmatics_callback_enabled and bool(settings.speechmatics_callback_public_url)
+
+
+def get_notification_config() -> list:
+    # Блок notification_config для конфигурации задачи Speechmatics:
+    # по завершении задачи сервис отправит POST на наш приемник
+    url = settings.speechmatics_callback_public_url.rstrip("/") + settings.speechmatics_callback_path
+    return [{
+        "url": url,
+        "contents": ["jobinfo"],
+        "auth_headers": [f"Authorization: Bearer {settings.speechmatics_callback_secret}"],
+    }]
+
+
+def _is_authorized(request: web.Request) -> bool:
+    # Проверка общего секрета только из заголовка Authorization (в параметрах URL он попал бы в логи доступа)
+    secret = settings.speechmatics_callback_secret
+    if not secret:
+        return False
+    auth_header = request.headers.get("Authorization", "")
+    token = auth_header[len("Bearer "):] if auth_header.startswith("Bearer ") else ""
+    return hmac.compare_digest(token.encode(), secret.encode())
+
+
+async def handle_speechmatics_callback(request: web.Request) -> web.Response:
+    # Прием уведомления о завершении задачи: Speechmatics добавляет к URL параметры id и status.
+    # Статусу из запроса не доверяем: уведомление только запускает немедленную проверку задачи через API
+    if not _is_authorized(request):
+        logger.warning(f"Отклонено уведомление Speechmatics без корректного секрета от {request.remote}")
+        return web.Response(status=401)
+
+    job_id: Optional[str] = request.query.get("id")
+    status: Optional[str] = request.query.get("status")
+    if not job_id:
+        try:
+            payload = await request.json()
+            job_info = payload.get("job", {})
+            job_id = job_info.get("id")
+            status = status or ("success" if job_info.get("status") == "done" else job_info.get("status"))
+        except Exception:
+            pass
+
+    if not job_id:
+        return web.Response(status=400, text="missing job id")
+
+    logger.info(f"Получено уведомление Speechmatics: задача {job_id}, статус {status}")
+    job_poller.notify(job_id)
+    # Отвечаем 200 даже для неизвестных задач, иначе сервис будет повторять отправку
+    return web.Response(text="ok")
+
+
+def create_callback_app() -> web.Application:
+    app = web.Application()
+    app.router.add_post(settings.speechmatics_callback_path, handle_speechmatics_callback)
+    return app
+
+
+async def start_callback_server() -> web.AppRunner:
+    # Запуск веб-приемника уведомлений рядом с опросом Telegram. Без секрета приемник принимал бы
+    # уведомления от кого угодно, поэтому в этом случае бот не запускается
+    if not settings.speechmatics_callback_secret:
+        raise RuntimeError("Режим уведомлений Speechmatics включен, но SPEECHMATICS_CALLBACK_SECRET не задан")
+    runner = web.AppRunner(create_callback_app())
+    await runner.setup()
+    site = web.TCPSite(runner, settings.speechmatics_callback_host, settings.speechmatics_callback_port)
+    await site.start()
+    logger.info(
+        f"Приемник уведомлений Speechmatics запущен на "
+        f"{settings.speechmatics_callback_host}:{settings.speechmatics_callback_port}{settings.speechmatics_callback_path}"
+    )
+    return runner
+
+
+async def stop_callback_server(runner: Optional[web.AppRunner]):
+    if runner is not None:
+        await runner.cleanup()
+        logger.info("Приемник уведомлений Speechmatics остановлен")
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from config.settings import settings
+from database.crud import get_api_credential_by_id, get_api_credentials, get_setting, record_api_credential_failure
+from database.database import get_async_db
+
+logger = logging.getLogger(__name__)
+
+# Ключ из настроек (api_key), который используется, пока в пуле нет ни одного ключа
+LEGACY_CREDENTIAL_ID = None
+
+
+def _realtime_url(credential) -> Optional[str]:
+    # Адрес Realtime API ключа: заданный администратором или адрес из настроек, если ключ использует
+    # адрес API из настроек (тот же регион). Ключ другого региона без своего адреса в потоковом режиме не используется.
+    if credential.realtime_url:
+        return credential.realtime_url
+    if not credential.api_url or credential.api_url.rstrip("/") == settings.speechmatics_api_url.rstrip("/"):
+        return settings.speechmatics_realtime_url
+    return None
+
+
+class CredentialState:
+    # Нагрузка на один ключ в этом процессе: задачи в работе и средняя задержка ответа API
+    def __init__(self, credential_id: Optional[int]):
+        self.credential_id = credential_id
+        self.in_flight = 0
+        self.latency = None
+        # Карантин ключа из настроек хранится только в памяти (у ключей пула - в базе)
+        self.quarantined_until: Optional[datetime] = None
+
+    def observe_latency(self, seconds: float):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            alpha = settings.credential_latency_smoothing
+            self.latency = alpha * seconds + (1 - alpha) * self.latency
+
+    def score(self) -> float:
+        # Чем меньше, тем предпочтительнее ключ: задачи в работе, взвешенные средней задержкой
+        latency = self.latency if self.latency is not None else settings.credential_default_latency_seconds
+        return (self.in_flight + 1) * latency
+
+
+class CredentialLease:
+    # Ключ, выданный одной задаче Speechmatics на все время ее выполнения
+    def __init__(
+        self, pool: "CredentialPool", state: CredentialState, api_key: str, api_url: str, name: str,
+        realtime_url: Optional[str] = None,
+    ):
+        self._pool = pool
+        self._state = state
+        self.credential_id = state.credential_id
+        self.api_key = api_key
+        self.api_url = api_url
+        self.name = name
+        # Адрес Realtime API того же аккаунта и региона; None - ключ не используется для потокового режима
+        self.realtime_url = realtime_url
+        self._released = False
+
+    def observe_latency(self, seconds: float):
+        self._state.observe_latency(seconds)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._state)
+
+    async def quarantine(self, http_status: int, error: str, retry_after: Optional[float] = None) -> Optional[datetime]:
+        # Исключает ключ из выбора после 401/403/429; возвращает время окончания карантина
+        if http_status == 429:
+            seconds = retry_after or settings.credential_rate_limit_quarantine_seconds
+        else:
+            seconds = settings.credential_auth_quarantine_seconds
+        until = datetime.utcnow() + timedelta(seconds=seconds)
+        await self._pool.record_failure(self._state, f"HTTP {http_status}: {error}", until)
+        logger.warning(f"API ключ {self.name} в карантине до {until:%H:%M:%S} UTC (HTTP {http_status})")
+        return until
+
+    async def record_failure(self, error: str):
+        # Ошибка без карантина (5xx, сеть) - только учитывается в статистике ключа
+        await self._pool.record_failure(self._state, error, None)
+
+
+class CredentialPool:
+    # Пул API ключей и адресов Speechmatics. Задачи распределяются по ключам с учетом
+    # числа задач в работе и средней задержки ответа; ключи с ошибками 401/403/429 временно исключаются.
+    # Лимит одновременных задач аккаунта (max_concurrent_jobs) соблюдается: при его достижении задача ждет.
+
+    def __init__(self):
+        self._states: Dict[Optional[int], CredentialState] = {}
+        self._released = asyncio.Event()
+        # Ключи из базы (или ключ из настроек), чтобы не читать базу при каждой выдаче ключа:
+        # (ID, ключ, адрес, имя, лимит задач, окончание карантина, адрес Realtime API) и время загрузки
+        self._rows: Optional[List[tuple]] = None
+        self._rows_loaded_at = 0.0
+
+    def _state(self, credential_id: Optional[int]) -> CredentialState:
+        state = self._states.get(credential_id)
+        if state is None:
+            state = self._states[credential_id] = CredentialState(credential_id)
+        return state
+
+    def in_flight(self, credential_id: Optional[int]) -> int:
+        state = self._states.get(credential_id)
+        return state.in_flight if state else 0
+
+    def _release(self, state: CredentialState):
+        state.in_flight = max(0, state.in_flight - 1)
+        self._released.set()
+        self._released = asyncio.Event()
+
+    def invalidate(self):
+        # Сброс кэша ключей: вызывается после изменений в админ-панели и после карантина ключа
+        self._rows = None
+
+    async def _load_rows(self) -> List[tuple]:
+        now = asyncio.get_running_loop().time()
+        if self._rows is not None and now - self._rows_loaded_at < settings.credential_cache_seconds:
+            return self._rows
+        async with get_async_db() as db:
+            credentials = await get_api_credentials(db, active_only=True)
+            legacy_key = None if credentials else await get_setting(db, "api_key")
+        if credentials:
+            rows = [
+                (
+                    credential.id,
+                    credential.api_key,
+                    credential.api_url or settings.speechmatics_api_url,
+                    credential.name or f"#{credential.id}",
+                    credential.max_concurrent_jobs or settings.credential_default_max_concurrent_jobs,
+                    credential.quarantined_until,
+                    _realtime_url(credential),
+                )
+                for credential in credentials
+            ]
+        elif legacy_key:
+            rows = [(
+                LEGACY_CREDENTIAL_ID, legacy_key, settings.speechmatics_api_url, "api_key",
+                settings.credential_default_max_concurrent_jobs, None, settings.speechmatics_realtime_url,
+            )]
+        else:
+            rows = []
+        self._rows = rows
+        self._rows_loaded_at = now
+        return rows
+
+    async def _candidates(self) -> List[tuple]:
+        # Кортежи (состояние, ключ, адрес, имя, лимит задач, окончание карантина, адрес Realtime API) из кэша ключей
+        candidates = []
+        for credential_id, api_key, api_url, name, max_jobs, quarantined_until, realtime_url in await self._load_rows():
+            state = self._state(credential_id)
+            if credential_id is LEGACY_CREDENTIAL_ID:
+                # Карантин ключа из настроек хранится только в памяти
+                quarantined_until = state.quarantined_until
+            candidates.append((state, api_key, api_url, name, max_jobs, quarantined_until, realtime_url))
+        return candidates
+
+    async def acquire(self, deadline: Optional[float] = None, realtime: bool = False) -> Optional[CredentialLease]:
+        # Выбор наименее нагруженного доступного ключа. Если все ключи заняты или в карантине,
+        # ждет освобождения до deadline (время цикла событий). None - доступных ключей нет.
+        # realtime - только ключи с известным адресом Realtime API
+        loop = asyncio.get_running_loop()
+        while True:
+            candidates = await self._candidates()
+            if realtime:
+                candidates = [candidate for candidate in candidates if candidate[6]]
+            if not candidates:
+                if not realtime:
+                    logger.error("Нет ни одного активного API ключа Speechmatics")
+                return None
+
+            now = datetime.utcnow()
+            best = None
+            wait = None
+            busy = False
+            for state, api_key, api_url, name, max_jobs, quarantined_until, realtime_url in candidates:
+                if quarantined_until and quarantined_until > now:
+                    remaining = (quarantined_until - now).total_seconds()
+                    wait = remaining if wait is None else min(wait, remaining)
+                    continue
+                if max_jobs and state.in_flight >= max_jobs:
+                    busy = True
+                    continue
+                if best is None or state.score() < best[0].score():
+                    best = (state, api_key, api_url, name, realtime_url)
+
+            if best is not None:
+                state = best[0]
+                state.in_flight += 1
+                return CredentialLease(self, *best)
+
+            # Все ключи заняты или в карантине: ждем освобождения задачи или окончания карантина
+            if busy:
+                recheck = settings.credential_busy_recheck_seconds
+                timeout = recheck if wait is None else min(wait, recheck)
+            else:
+                timeout = wait
+            if deadline is not None:
+                if loop.time() >= deadline or (not busy and loop.time() + timeout > deadline):
+                    # Ни один ключ не освободится до истечения срока - не держим задачу в очереди зря
+                    return None
+                timeout = min(timeout, deadline - loop.time())
+            try:
+                await asyncio.wait_for(self._released.wait(), timeout=max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    async def lease_for(self, credential_id: Optional[int]) -> Optional[CredentialLease]:
+        # Ключ, через который уже отправлена задача (опрос после перезапуска, отмена); карантин и отключение
+        # не учитываются. Задача видна только аккаунту, который ее создал, поэтому другой ключ не подставляется:
+        # None - ключ удален, задачу нельзя ни опросить, ни отменить.
+        async with get_async_db() as db:
+            if credential_id is LEGACY_CREDENTIAL_ID:
+                credential = None
+                legacy_key = await get_setting(db, "api_key")
+            else:
+                credential = await get_api_credential_by_id(db, credential_id)
+                legacy_key = None
+        if credential:
+            state = self._state(credential.id)
+            state.in_flight += 1
+            return CredentialLease(
+                self, state, credential.api_key, credential.api_url or settings.speechmatics_api_url,
+                credential.name or f"#{credential.id}", _realtime_url(credential),
+            )
+        if legacy_key:
+            # Задача отправлена через ключ из настроек (до появления ключей в пуле)
+            state = self._state(LEGACY_CREDENTIAL_ID)
+            state.in_flight += 1
+            return CredentialLease(
+                self, state, legacy_key, settings.speechmatics_api_url, "api_key", settings.speechmatics_realtime_url
+            )
+        logger.error(f"API ключ {credential_id if credential_id is not None else 'api_key'} задачи не найден")
+        return None
+
+    async def record_failure(self, state: CredentialState, error: str, quarantined_until: Optional[datetime]):
+        if state.credential_id is LEGACY_CREDENTIAL_ID:
+            if quarantined_until:
+                state.quarantined_until = quarantined_until
+            return
+        try:
+            async with get_async_db() as db:
+                await record_api_credential_failure(db, state.credential_id, error, quarantined_until)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить ошибку API ключа {state.credential_id}: {e}")
+        if quarantined_until:
+            # Ключ в карантине не должен выдаваться из кэша
+            self.invalidate()
+
+
+# Единый пул ключей для всего приложения
+credential_pool = CredentialPool()
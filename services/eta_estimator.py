@@ -0,0 +1,120 @@
+import bisect
+import logging
+import math
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Этап конвертации: FFmpeg (извлечение звука и перекодирование)
+STAGE_FFMPEG = "ffmpeg"
+# Этап распознавания называется по движку: speechmatics, local, realtime - полное время от начала отправки
+# до результата (очередь регулятора и пула ключей, загрузка, перекодирование), по нему считается срок для пользователя
+# Время задачи Speechmatics от создания до завершения (без очереди и загрузки): по нему выбираются
+# момент первой проверки статуса и срок ожидания результата
+STAGE_SPEECHMATICS_JOB = "speechmatics_job"
+
+# Границы групп по длительности записи, в секундах: до 30 с, до 2 мин, до 10 мин, до 30 мин и длиннее.
+# Скорость обработки короткой и многочасовой записи различается в разы (фиксированные накладные расходы,
+# параллельные фрагменты), поэтому модели считаются отдельно для каждой группы.
+DURATION_BUCKET_EDGES = (30, 120, 600, 1800)
+
+
+class RateModel:
+    # Модель скорости одного этапа в одной группе длительностей: секунды обработки на минуту аудио.
+    # EWMA дает текущую оценку, последние наблюдения - квантили (разброс, "плохой случай").
+
+    def __init__(self):
+        self.ewma: Optional[float] = None
+        self.samples: Deque[float] = deque(maxlen=settings.eta_samples_per_bucket)
+        self.count = 0
+
+    def observe(self, seconds_per_minute: float):
+        alpha = settings.eta_smoothing
+        self.ewma = seconds_per_minute if self.ewma is None else alpha * seconds_per_minute + (1 - alpha) * self.ewma
+        self.samples.append(seconds_per_minute)
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+    def is_ready(self) -> bool:
+        return self.count >= settings.eta_min_samples
+
+
+def _bucket_index(audio_seconds: float) -> int:
+    return bisect.bisect_left(DURATION_BUCKET_EDGES, audio_seconds or 0.0)
+
+
+def bucket_label(index: int) -> str:
+    # Подпись группы для отчета администратора: "0-30s", "30-120s", ..., "1800s+"
+    if index == 0:
+        return f"0-{DURATION_BUCKET_EDGES[0]}s"
+    if index >= len(DURATION_BUCKET_EDGES):
+        return f"{DURATION_BUCKET_EDGES[-1]}s+"
+    return f"{DURATION_BUCKET_EDGES[index - 1]}-{DURATION_BUCKET_EDGES[index]}s"
+
+
+class EtaEstimator:
+    # Оценка времени обработки по живой статистике: сколько секунд FFmpeg и движок распознавания
+    # тратят на минуту аудио в каждой группе длительностей.
+    # Используется для срока в сообщении о прогрессе, момента первой проверки статуса задачи
+    # и срока ожидания результата; пока наблюдений мало, оценка не выдается (None).
+
+    def __init__(self):
+        self._models: Dict[Tuple[str, int], RateModel] = {}
+
+    def observe(self, stage: str, audio_seconds: float, elapsed_seconds: float):
+        # Наблюдение: этап stage обработал audio_seconds аудио за elapsed_seconds
+        if not audio_seconds or audio_seconds <= 0 or elapsed_seconds < 0:
+            return
+        key = (stage, _bucket_index(audio_seconds))
+        model = self._models.get(key)
+        if model is None:
+            model = self._models[key] = RateModel()
+        model.observe(elapsed_seconds / (audio_seconds / 60))
+
+    def _model_for(self, stage: str, audio_seconds: float) -> Optional[RateModel]:
+        # Модель группы записи; если в ней мало наблюдений - ближайшей группы с достаточной статистикой
+        index = _bucket_index(audio_seconds)
+        for distance in range(len(DURATION_BUCKET_EDGES) + 1):
+            for candidate in (index - distance, index + distance):
+                model = self._models.get((stage, candidate))
+                if model is not None and model.is_ready():
+                    return model
+        return None
+
+    def estimate(self, stage: str, audio_seconds: float, quantile: Optional[float] = None) -> Optional[float]:
+        # Ожидаемое время этапа в секундах: по EWMA или по квантилю (например, 0.9 - "почти наверняка успеет")
+        model = self._model_for(stage, audio_seconds)
+        if model is None:
+            return None
+        rate = model.ewma if quantile is None else model.quantile(quantile)
+        return rate * (audio_seconds / 60) if rate is not None else None
+
+    def estimate_total(self, audio_seconds: float, backend_name: str, include_ffmpeg: bool = False,
+                       quantile: Optional[float] = None) -> Optional[float]:
+        # Полное ожидаемое время задачи: распознавание и, при необходимости, конвертация
+        total = self.estimate(backend_name, audio_seconds, quantile)
+        if total is None:
+            return None
+        if include_ffmpeg:
+            total += self.estimate(STAGE_FFMPEG, audio_seconds, quantile) or 0.0
+        return total
+
+    def snapshot(self) -> List[Tuple[str, str, int, Optional[float], Optional[float], Optional[float]]]:
+        # Статистика для администратора: (этап, группа, наблюдений, EWMA, медиана, 90-й перцентиль) в с/мин
+        return [
+            (stage, bucket_label(index), model.count, model.ewma, model.quantile(0.5), model.quantile(0.9))
+            for (stage, index), model in sorted(self._models.items())
+        ]
+
+
+# Единая оценка времени обработки для всего приложения
+eta_estimator = EtaEstimator()
@@ -0,0 +1,54 @@
+import logging
+from typing import Optional
+
+import aiohttp
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Единая сессия на все приложение: соединения с API переиспользуются между задачами
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    # Создает HTTP-сессию с пулом keep-alive соединений, кэшем DNS и таймаутами из настроек
+    connector = aiohttp.TCPConnector(
+        limit=settings.speechmatics_connection_limit,
+        limit_per_host=settings.speechmatics_connection_limit_per_host,
+        ttl_dns_cache=settings.speechmatics_dns_cache_ttl_seconds,
+        keepalive_timeout=settings.speechmatics_keepalive_timeout_seconds,
+    )
+    # Общий таймаут не задаем: загрузка больших файлов может идти долго,
+    # ограничиваем только установку соединения и паузы при чтении ответа
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=settings.speechmatics_connect_timeout_seconds,
+        sock_read=settings.speechmatics_read_timeout_seconds,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def init_http_session() -> aiohttp.ClientSession:
+    # Создает общую HTTP-сессию при запуске бота (повторный вызов возвращает существующую)
+    global _session
+    if _session is None or _session.closed:
+        _session = create_http_session()
+        logger.info("HTTP-сессия для Speechmatics создана")
+    return _session
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    # Возвращает общую HTTP-сессию, созданную при запуске бота
+    if _session is None or _session.closed:
+        raise RuntimeError("HTTP-сессия не инициализирована: вызовите init_http_session() при запуске")
+    return _session
+
+
+async def close_http_session():
+    # Закрывает общую HTTP-сессию при остановке бота
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("HTTP-сессия для Speechmatics закрыта")
+    _session = None
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class CancellationToken:
+    # Отмена одной выполняющейся транскрипции. Задача-обработчик отменяется средствами asyncio:
+    # отмена доходит до места, где задача ждет (FFmpeg, загрузка, ожидание результата API), процессы FFmpeg
+    # завершаются, а места в пулах, ключи API и рабочая область освобождаются блоками finally.
+    # cancelled отличает отмену пользователем от остановки бота (тогда задача продолжится после перезапуска).
+    # После commit (результат доставляется и минуты списываются) отмена не принимается: иначе пользователь
+    # получил бы результат без списания или списание без результата.
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.cancelled = False
+        self.committed = False
+        # Задачи, созданные в API: [ID задачи, смещение, ID ключа] (как job_ids в базе). Запоминаются сразу
+        # после ответа API, до сохранения в базе, чтобы отмена в этот момент не оставила задачу в сервисе
+        self.submitted_jobs: List[list] = []
+
+    def cancel(self) -> bool:
+        # False - задача уже завершилась или доставляет результат
+        if self.task.done() or self.committed:
+            return False
+        self.cancelled = True
+        self.task.cancel()
+        return True
+
+    def commit(self) -> bool:
+        # False - отмена уже запрошена
+        if self.cancelled:
+            return False
+        self.committed = True
+        return True
+
+
+# Токен отмены транскрипции, которую выполняет текущая задача (для сервисов, которые доставляют результат)
+_current_token: ContextVar[Optional[CancellationToken]] = ContextVar("current_cancellation_token", default=None)
+
+
+class ActiveJobs:
+    # Выполняющиеся транскрипции по пользователям Telegram: кнопка "Отмена" отменяет все задачи пользователя
+
+    def __init__(self):
+        self._tokens: Dict[int, Set[CancellationToken]] = {}
+
+    def begin(self, telegram_id: int) -> CancellationToken:
+        # Регистрация текущей задачи (вызывается из обработчика, который выполняет транскрипцию)
+        token = CancellationToken(asyncio.current_task())
+        self._tokens.setdefault(telegram_id, set()).add(token)
+        _current_token.set(token)
+        return token
+
+    def finish(self, telegram_id: int, token: CancellationToken):
+        tokens = self._tokens.get(telegram_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[telegram_id]
+
+    async def commit_current(self):
+        # Начало доставки результата и списания минут в текущей задаче: дальше кнопка "Отмена" ее не прерывает.
+        # Если отмена уже запрошена, она срабатывает здесь - до доставки и списания.
+        token = _current_token.get()
+        if token is not None and not token.commit():
+            await asyncio.sleep(0)
+
+    def track_submitted_job(self, job_id: str, credential_id: Optional[int]):
+        # Задача создана в API по запросу текущей транскрипции (вызывается до любого ожидания после ответа API)
+        token = _current_token.get()
+        if token is not None:
+            token.submitted_jobs.append([job_id, 0.0, credential_id])
+
+    def cancel_user_jobs(self, telegram_id: int) -> int:
+        # Отмена всех задач пользователя; возвращает число отмененных задач
+        cancelled = sum(1 for token in list(self._tokens.get(telegram_id, ())) if token.cancel())
+        if cancelled:
+            logger.info(f"Пользователь {telegram_id} отменил выполняющихся транскрипций: {cancelled}")
+        return cancelled
+
+
+# Общий реестр выполняющихся транскрипций для отмены
+active_jobs = ActiveJobs()
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Optional, Set
+
+import aiohttp
+
+from config.settings import settings
+from services.http_client import get_http_session
+from utils.backoff import (
+    apply_jitter,
+    compute_initial_poll_interval,
+    next_poll_interval,
+    parse_retry_after,
+)
+
+logger = logging.getLogger(__name__)
+
+# HTTP-статусы, при которых проверку статуса имеет смысл повторить в следующих раундах
+TRANSIENT_HTTP_STATUSES = {429, 500, 502, 503, 504}
+
+# Конечные статусы задачи Speechmatics, кроме успешного "done"
+FAILED_JOB_STATUSES = {"rejected", "deleted", "expired"}
+
+
+class JobPollError(Exception):
+    # Ошибка при ожидании задачи: http_status равен None для сетевых ошибок,
+    # transient - исчерпаны повторы временных ошибок (сама задача в Speechmatics может быть еще жива)
+    def __init__(self, message: str, http_status: Optional[int] = None, transient: bool = False):
+        super().__init__(message)
+        self.http_status = http_status
+        self.transient = transient
+
+
+class PolledJob:
+    # Состояние одной отслеживаемой задачи
+    def __init__(
+        self,
+        job_id: str,
+        api_key: str,
+        api_url: str,
+        audio_duration: float,
+        future: asyncio.Future,
+        first_check_delay: Optional[float] = None,
+    ):
+        self.job_id = job_id
+        self.api_key = api_key
+        self.api_url = api_url
+        self.future = future
+        self.poll_interval = compute_initial_poll_interval(audio_duration)
+        if first_check_delay is None:
+            first_check_delay = apply_jitter(self.poll_interval)
+        self.next_check_at = asyncio.get_running_loop().time() + first_check_delay
+        self.transient_errors = 0
+        self.in_flight = False
+
+
+class JobPoller:
+    # Единый планировщик опроса статусов всех задач Speechmatics.
+    # Вместо отдельного цикла ожидания на каждую задачу проверки выполняются раундами
+    # через общую HTTP-сессию, равномерно распределяясь внутри раунда,
+    # а число запросов за раунд ограничено настройками.
+
+    def __init__(self):
+        self._jobs: Dict[str, PolledJob] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._paused_until = 0.0
+        # Ссылки на выполняющиеся проверки, чтобы их не удалил сборщик мусора
+        self._check_tasks: Set[asyncio.Task] = set()
+
+    def start(self):
+        # Запускает фоновый цикл опроса (вызывается при старте бота)
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="speechmatics-job-poller")
+            logger.info("Планировщик опроса задач Speechmatics запущен")
+
+    async def stop(self):
+        # Останавливает цикл опроса и отменяет ожидание всех задач
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._check_tasks):
+            task.cancel()
+        for job in self._jobs.values():
+            if not job.future.done():
+                job.future.cancel()
+        self._jobs.clear()
+        logger.info("Планировщик опроса задач Speechmatics остановлен")
+
+    def register(
+        self,
+        job_id: str,
+        api_key: str,
+        api_url: str,
+        audio_duration: float = 0.0,
+        first_check_delay: Optional[float] = None,
+    ) -> asyncio.Future:
+        # Добавляет задачу в опрос и возвращает future, который завершится с данными задачи
+        # (словарь "job" из ответа API) или исключением JobPollError.
+        # first_check_delay откладывает первую проверку - например, пока ждем уведомления от сервиса.
+        if job_id in self._jobs:
+            return self._jobs[job_id].future
+        future = asyncio.get_running_loop().create_future()
+        self._jobs[job_id] = PolledJob(job_id, api_key, api_url, audio_duration, future, first_check_delay)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return future
+
+    def notify(self, job_id: str):
+        # Уведомление о завершении задачи (push от Speechmatics) - только подсказка "проверь сейчас":
+        # статус задачи всегда берется из API, чтобы поддельное уведомление не могло завершить чужую задачу
+        job = self._jobs.get(job_id)
+        if job is None:
+            logger.info(f"Уведомление для неизвестной или уже завершенной задачи {job_id}")
+            return
+        job.next_check_at = asyncio.get_running_loop().time()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def unregister(self, job_id: str):
+        # Убирает задачу из опроса (например, после таймаута ожидания)
+        job = self._jobs.pop(job_id, None)
+        if job and not job.future.done():
+            job.future.cancel()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._jobs)
+
+    async def _run(self):
+        round_interval = settings.speechmatics_poll_round_interval_seconds
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if not self._jobs:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                now = loop.time()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                due_jobs = sorted(
+                    (job for job in self._jobs.values() if job.next_check_at <= now and not job.in_flight),
+                    key=lambda job: job.next_check_at,
+                )[: settings.speechmatics_poll_max_requests_per_round]
+
+                # Распределяем проверки внутри раунда, чтобы не отправлять их одной пачкой
+                spacing = round_interval / len(due_jobs) if due_jobs else 0
+                for index, job in enumerate(due_jobs):
+                    if index:
+                        await asyncio.sleep(spacing)
+                    job.in_flight = True
+                    check_task = asyncio.create_task(self._check(job))
+                    self._check_tasks.add(check_task)
+                    check_task.add_done_callback(self._check_tasks.discard)
+
+                await asyncio.sleep(max(0.0, round_interval - spacing * len(due_jobs)) if due_jobs else round_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Ошибка в цикле опроса задач Speechmatics: {e}")
+                await asyncio.sleep(round_interval)
+
+    async def _check(self, job: PolledJob):
+        loop = asyncio.get_running_loop()
+        url = f"{job.api_url.rstrip('/')}/{job.job_id}"
+        headers = {"Authorization": f"Bearer {job.api_key}"}
+        retry_after = None
+        try:
+            try:
+                async with get_http_session().get(url, headers=headers) as response:
+                    response_status = response.status
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    body = await response.read()
+                error_text = f"HTTP {response_status}" if response_status in TRANSIENT_HTTP_STATUSES else None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                response_status, body = None, None
+                error_text = str(e) or type(e).__name__
+
+            if error_text:
+                job.transient_errors += 1
+                if job.transient_errors > settings.speechmatics_max_transient_retries:
+                    message = f"Ошибка сети при ожидании результата транскрипции: {error_text}"
+                    self._finish(job, exception=JobPollError(message, response_status, transient=True))
+                    return
+                if response_status == 429 and retry_after:
+                    # Лимит запросов действует на весь аккаунт - приостанавливаем все проверки
+                    self._paused_until = max(self._paused_until, loop.time() + retry_after)
+                logger.warning(
+                    f"Временная ошибка при проверке задачи {job.job_id} ({error_text}), попытка {job.transient_errors}"
+                )
+                self._schedule_next(job, retry_after)
+                return
+
+            if response_status != 200:
+                message = f"Ошибка при получении статуса задачи: {response_status}, {body.decode(errors='replace')}"
+                self._finish(job, exception=JobPollError(message, response_status))
+                return
+
+            job.transient_errors = 0
+            job_info = json.loads(body).get("job", {})
+            job_status = job_info.get("status")
+            if job_status == "done":
+                self._finish(job, result=job_info)
+            elif job_status in FAILED_JOB_STATUSES:
+                message = f"Задача транскрипции {job.job_id} завершилась со статусом {job_status}: {job_info.get('errors', '')}"
+                self._finish(job, exception=JobPollError(message, response_status))
+            else:
+                logger.info(f"Transcription not ready for job {job.job_id}. Status: {job_status}.")
+                self._schedule_next(job, retry_after)
+        except json.JSONDecodeError as e:
+            self._finish(job, exception=JobPollError(f"Ошибка при обработке JSON-ответа от Speechmatics: {e}"))
+        except Exception as e:
+            logger.exception(f"Неизвестная ошибка при проверке задачи {job.job_id}: {e}")
+            self._finish(job, exception=JobPollError(f"Неизвестная ошибка при проверке статуса задачи: {e}"))
+        finally:
+            job.in_flight = False
+
+    def _schedule_next(self, job: PolledJob, retry_after: Optional[float] = None):
+        delay = retry_after if retry_after is not None else apply_jitter(job.poll_interval)
+        job.next_check_at = asyncio.get_running_loop().time() + delay
+        job.poll_interval = next_poll_interval(job.poll_interval)
+
+    def _finish(self, job: PolledJob, result: Optional[dict] = None, exception: Optional[Exception] = None):
+        # Проверка могла завершиться после повторной регистрации того же job_id (продолжение после перезапуска,
+        # повторное ожидание) - новая регистрация остается в опросе
+        if self._jobs.get(job.job_id) is job:
+            del self._jobs[job.job_id]
+        if job.future.done():
+            return
+        if exception is not None:
+            job.future.set_exception(exception)
+        else:
+            job.future.set_result(result)
+
+
+# Общий экземпляр планировщика для всего приложения
+job_poller = JobPoller()
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Set
+
+from aiogram import Bot
+
+from config.settings import settings
+from database.crud import (
+    deduct_minutes_from_balance,
+    get_transcription_by_id,
+    get_unfinished_transcriptions,
+    get_user_by_id,
+    update_transcription_checkpoint,
+    update_transcription_status_and_result,
+)
+from database.database import get_async_db
+from keyboards.main_menu import get_main_keyboard
+from services.transcription_service import collect_transcription_results, get_delivery_format, send_transcription_result
+from utils.language import get_text
+from utils.transcript_format import pack_transcript_async
+from utils.voice_activity import TimeMap
+
+logger = logging.getLogger(__name__)
+
+# ID транскрипций, которые сейчас обрабатывает этот процесс: сверка зависших задач их не трогает
+active_transcription_ids: Set[int] = set()
+
+# Ссылки на фоновые задачи, чтобы их не удалил сборщик мусора
+_background_tasks: Set[asyncio.Task] = set()
+_reconciler_task: Optional[asyncio.Task] = None
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _fail_transcription(bot: Bot, transcription, lang: str, message_key: str, error_message: str):
+    # Помечает транскрипцию как неудачную и сообщает об этом пользователю (минуты не списываются)
+    async with get_async_db() as db:
+        await update_transcription_status_and_result(
+            db=db,
+            transcription_id=transcription.id,
+            status='failed',
+            error_message=error_message
+        )
+    logger.warning(f"Транскрипция {transcription.id} помечена как неудачная: {error_message}")
+    if transcription.chat_id:
+        try:
+            await bot.send_message(
+                chat_id=transcription.chat_id,
+                text=get_text(message_key, lang).format(file_name=transcription.file_name),
+                reply_markup=get_main_keyboard(lang),
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить пользователя о транскрипции {transcription.id}: {e}")
+
+
+async def _resume_transcription(bot: Bot, transcription_id: int):
+    # Продолжение задачи с последнего сохраненного этапа
+    active_transcription_ids.add(transcription_id)
+    try:
+        async with get_async_db() as db:
+            transcription = await get_transcription_by_id(db, transcription_id)
+            user = await get_user_by_id(db, transcription.user_id) if transcription else None
+        if not transcription or not user:
+            return
+        lang = user.language_code or "ru"
+        stage = transcription.stage
+        result_text = transcription.result_text
+        transcript_data = transcription.transcript_data
+        logger.info(f"Продолжение транскрипции {transcription_id} с этапа {stage}")
+
+        if stage == "submitted" and transcription.job_ids:
+            transcript, error_msg = await collect_transcription_results(
+                json.loads(transcription.job_ids), bot, transcription.language, transcription.duration or 0.0
+            )
+            if transcript is None:
+                await _fail_transcription(
+                    bot, transcription, lang, "transcription_interrupted", error_msg or "Пустой результат после перезапуска"
+                )
+                return
+            result_text, transcript_data = await pack_transcript_async(
+                transcript, TimeMap.from_json(transcription.time_map)
+            )
+            async with get_async_db() as db:
+                await update_transcription_checkpoint(
+                    db, transcription_id, "fetched", result_text=result_text, transcript_data=transcript_data
+                )
+            stage = "fetched"
+
+        if stage == "fetched":
+            if transcription.chat_id:
+                await send_transcription_result(
+                    bot,
+                    transcription.chat_id,
+                    transcription.progress_message_id,
+                    lang,
+                    transcription.file_name,
+                    result_text or "",
+                    f"resume:{transcription_id}",
+                    transcript_data,
+                )
+            async with get_async_db() as db:
+                await update_transcription_checkpoint(
+                    db, transcription_id, "delivered", result_format=get_delivery_format(transcript_data)
+                )
+            stage = "delivered"
+
+        if stage == "delivered":
+            if not result_text:
+                await _fail_transcription(bot, transcription, lang, "transcription_no_text_found", "Текст не найден")
+                return
+            async with get_async_db() as db:
+                await update_transcription_status_and_result(
+                    db=db,
+                    transcription_id=transcription_id,
+                    status='completed',
+                    result_text=result_text
+                )
+                await deduct_minutes_from_balance(db, user.telegram_id, transcription.cost or 0)
+            logger.info(f"Транскрипция {transcription_id} завершена после перезапуска")
+            return
+
+        # Задача не успела дойти до отправки в API: временные файлы после перезапуска уже недоступны
+        await _fail_transcription(
+            bot, transcription, lang, "transcription_interrupted", f"Прервано перезапуском на этапе {stage}"
+        )
+    except Exception as e:
+        logger.exception(f"Ошибка при продолжении транскрипции {transcription_id}: {e}")
+    finally:
+        active_transcription_ids.discard(transcription_id)
+
+
+async def resume_unfinished_transcriptions(bot: Bot):
+    # При запуске бота продолжает все транскрипции, оставшиеся в статусе processing
+    async with get_async_db() as db:
+        unfinished = await get_unfinished_transcriptions(db)
+    for transcription in unfinished:
+        if transcription.id not in active_transcription_ids:
+            _spawn(_resume_transcription(bot, transcription.id))
+    if unfinished:
+        logger.info(f"Продолжается незавершенных транскрипций: {len(unfinished)}")
+
+
+async def reconcile_stuck_transcriptions(bot: Bot):
+    # Завершает с ошибкой транскрипции, которые слишком долго не меняли этап и не обрабатываются этим процессом
+    updated_before = datetime.utcnow() - timedelta(minutes=settings.stuck_transcription_timeout_minutes)
+    async with get_async_db() as db:
+        stuck = await get_unfinished_transcriptions(db, updated_before=updated_before)
+    for transcription in stuck:
+        if transcription.id in active_transcription_ids:
+            continue
+        async with get_async_db() as db:
+            user = await get_user_by_id(db, transcription.user_id)
+        lang = user.language_code if user and user.language_code else "ru"
+        await _fail_transcription(
+            bot, transcription, lang, "transcription_timed_out", f"Превышено время выполнения на этапе {transcription.stage}"
+        )
+
+
+async def _reconcile_periodically(bot: Bot):
+    while True:
+        await asyncio.sleep(settings.transcription_reconcile_interval_seconds)
+        try:
+            await reconcile_stuck_transcriptions(bot)
+        except Exception as e:
+            logger.exception(f"Ошибка при сверке зависших транскрипций: {e}")
+
+
+def start_reconciler(bot: Bot):
+    # Запуск периодической сверки зависших транскрипций
+    global _reconciler_task
+    if _reconciler_task is None or _reconciler_task.done():
+        _reconciler_task = asyncio.create_task(_reconcile_periodically(bot))
+
+
+async def stop_reconciler():
+    global _reconciler_task
+    if _reconciler_task is not None:
+        _reconciler_task.cancel()
+        try:
+            await _reconciler_task
+        except asyncio.CancelledError:
+            pass
+        _reconciler_task = None
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from typing import Optional
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Состояния автоматического выключателя
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class TokenBucket:
+    # Ограничение частоты запросов: rate токенов в секунду, не больше capacity подряд
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at: Optional[float] = None
+
+    def _refill(self, now: float):
+        if self._updated_at is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def time_until_token(self, now: float) -> float:
+        # Сколько секунд ждать до появления токена (0 - токен есть)
+        self._refill(now)
+        if self._tokens >= 1.0:
+            return 0.0
+        return (1.0 - self._tokens) / self.rate if self.rate > 0 else 1.0
+
+    def take(self, now: float):
+        self._refill(now)
+        self._tokens -= 1.0
+
+
+class SubmissionGovernor:
+    # Общий регулятор отправки задач в Speechmatics: token bucket под лимиты аккаунта
+    # и автоматический выключатель (circuit breaker).
+    # При серии ошибок 429/5xx выключатель размыкается: новые отправки не падают, а ждут в очереди.
+    # После паузы пропускается одна пробная отправка (half-open); при успехе поток восстанавливается,
+    # при неудаче пауза удваивается (до максимума).
+
+    def __init__(self):
+        self._bucket: Optional[TokenBucket] = None
+        self.state = CIRCUIT_CLOSED
+        self._consecutive_failures = 0
+        self._open_seconds = 0.0
+        self._reopen_at = 0.0
+        self._paused_until = 0.0
+        self._probe_in_flight = False
+        self._wakeup = asyncio.Event()
+        self.waiting = 0
+
+    @property
+    def bucket(self) -> TokenBucket:
+        if self._bucket is None:
+            self._bucket = TokenBucket(
+                settings.speechmatics_submit_rate_per_second, settings.speechmatics_submit_burst
+            )
+        return self._bucket
+
+    def _notify_waiters(self):
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    def _time_until_allowed(self, now: float) -> float:
+        # Сколько ждать по состоянию выключателя и паузе Retry-After (0 - можно отправлять)
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.state == CIRCUIT_OPEN:
+            if now < self._reopen_at:
+                return self._reopen_at - now
+            self.state = CIRCUIT_HALF_OPEN
+            logger.info("Выключатель Speechmatics: пробная отправка (half-open)")
+        if self.state == CIRCUIT_HALF_OPEN and self._probe_in_flight:
+            # Ждем результата пробной отправки (проверяем и по таймеру, на случай потерянного результата)
+            return settings.speechmatics_breaker_open_seconds
+        return 0.0
+
+    async def acquire(self, deadline: Optional[float] = None) -> bool:
+        # Ожидание разрешения на отправку задачи. False - не дождались до deadline (время цикла событий).
+        loop = asyncio.get_running_loop()
+        self.waiting += 1
+        try:
+            while True:
+                now = loop.time()
+                wait = self._time_until_allowed(now)
+                if wait <= 0:
+                    wait = self.bucket.time_until_token(now)
+                    if wait <= 0:
+                        self.bucket.take(now)
+                        if self.state == CIRCUIT_HALF_OPEN:
+                            self._probe_in_flight = True
+                        return True
+                if deadline is not None and now + wait > deadline:
+                    return False
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.waiting -= 1
+
+    def record_success(self) -> bool:
+        # Успешный ответ сервиса. True - выключатель только что замкнулся (сервис восстановился).
+        self._consecutive_failures = 0
+        self._probe_in_flight = False
+        if self.state == CIRCUIT_HALF_OPEN:
+            self.state = CIRCUIT_CLOSED
+            self._open_seconds = 0.0
+            logger.info("Выключатель Speechmatics замкнут: сервис снова доступен")
+            self._notify_waiters()
+            return True
+        return False
+
+    def record_failure(self, retry_after: Optional[float] = None) -> bool:
+        # Временная ошибка сервиса (429, 5xx, сеть). True - выключатель только что разомкнулся.
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._probe_in_flight = False
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+        if self.state == CIRCUIT_HALF_OPEN:
+            # Пробная отправка не удалась - пауза удваивается
+            self._open_seconds = min(self._open_seconds * 2, settings.speechmatics_breaker_max_open_seconds)
+            self._open(now)
+            return False
+
+        self._consecutive_failures += 1
+        if self.state == CIRCUIT_CLOSED and self._consecutive_failures >= settings.speechmatics_breaker_failure_threshold:
+            self._open_seconds = settings.speechmatics_breaker_open_seconds
+            self._open(now)
+            return True
+        return False
+
+    def release(self):
+        # Отправка завершилась без ответа сервиса (отмена, ошибка запроса): освобождаем пробный слот
+        if self._probe_in_flight:
+            self._probe_in_flight = False
+            self._notify_waiters()
+
+    def _open(self, now: float):
+        self.state = CIRCUIT_OPEN
+        self._reopen_at = max(now + self._open_seconds, self._paused_until)
+        logger.warning(
+            f"Выключатель Speechmatics разомкнут на {self._reopen_at - now:.0f} с, новые задачи ждут в очереди"
+        )
+
+
+# Единый регулятор отправки задач для всего приложения
+speechmatics_governor = SubmissionGovernor()
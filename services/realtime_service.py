@@ -0,0 +1,283 @@
+import asyncio
+import html
+import json
+import logging
+from typing import Optional, Tuple
+
+import aiohttp
+from aiogram import Bot
+from aiogram.types import Message
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import settings
+from services.http_client import get_http_session
+from services.credential_pool import credential_pool, CredentialLease
+from services.eta_estimator import eta_estimator
+from services.job_poller import TRANSIENT_HTTP_STATUSES
+from services.rate_governor import speechmatics_governor
+from services.transcription_service import (
+    _notify_admins,
+    deliver_transcription_result,
+    show_progress_text,
+    transcribe_audio_file_with_progress,
+)
+from utils.audio_processing import PCM_BYTES_PER_SECOND, PCM_SAMPLE_RATE, start_pcm_decoder_async
+from utils.error_handler import log_exceptions
+from utils.language import get_text, get_user_language_from_db
+from utils.transcript_format import Transcript, pack_transcript_async
+
+logger = logging.getLogger(__name__)
+
+# Длительность одного аудиокадра, отправляемого в websocket
+REALTIME_FRAME_SECONDS = 0.1
+
+# Этап потокового распознавания в статистике времени обработки
+REALTIME_STAGE = "realtime"
+
+
+class RealtimeSessionError(Exception):
+    # Потоковая сессия не завершилась результатом; http_status задан, если сервис отклонил подключение
+    def __init__(self, message: str, http_status: Optional[int] = None):
+        super().__init__(message)
+        self.http_status = http_status
+
+
+def is_realtime_eligible(audio_duration: float) -> bool:
+    # Короткие записи распознаются потоково (0 в настройке отключает потоковый режим)
+    return 0 < audio_duration <= settings.realtime_max_duration_seconds
+
+
+class _RealtimeSession:
+    # Одна сессия Speechmatics Realtime API: PCM из FFmpeg отправляется кадрами по мере декодирования,
+    # окончательные фрагменты (AddTranscript) собираются в Transcript, промежуточные (AddPartialTranscript)
+    # показываются в сообщении о прогрессе.
+
+    def __init__(self, ws: aiohttp.ClientWebSocketResponse, file_path: str):
+        self.ws = ws
+        self.file_path = file_path
+        self.transcript = Transcript()
+        self.final_text = ""
+        self.partial_text = ""
+        self.revision = 0
+        self._sent_seq_no = 0
+        self._acked_seq_no = 0
+        self._acked = asyncio.Event()
+
+    async def start(self, language: str):
+        await self.ws.send_json({
+            "message": "StartRecognition",
+            "audio_format": {"type": "raw", "encoding": "pcm_s16le", "sample_rate": PCM_SAMPLE_RATE},
+            "transcription_config": {
+                "language": language,
+                "enable_partials": True,
+                "max_delay": settings.realtime_max_delay_seconds,
+            },
+        })
+        message = await self._receive_json()
+        if message.get("message") != "RecognitionStarted":
+            raise RealtimeSessionError(f"Неожиданный ответ на StartRecognition: {message}")
+
+    async def send_audio(self):
+        # Отправка кадров PCM; не больше realtime_max_unacked_frames кадров без подтверждения AudioAdded
+        process = await start_pcm_decoder_async(self.file_path)
+        frame_bytes = int(PCM_BYTES_PER_SECOND * REALTIME_FRAME_SECONDS)
+        try:
+            while True:
+                frame = await process.stdout.read(frame_bytes)
+                if not frame:
+                    break
+                while self._sent_seq_no - self._acked_seq_no >= settings.realtime_max_unacked_frames:
+                    await self._acked.wait()
+                await self.ws.send_bytes(frame)
+                self._sent_seq_no += 1
+
+            stderr = await process.stderr.read()
+            if await process.wait() != 0:
+                raise RealtimeSessionError(f"FFmpeg не смог декодировать аудио: {stderr.decode(errors='replace')}")
+            await self.ws.send_json({"message": "EndOfStream", "last_seq_no": self._sent_seq_no})
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+    async def _receive_json(self) -> dict:
+        message = await self.ws.receive(timeout=settings.realtime_response_timeout_seconds)
+        if message.type != aiohttp.WSMsgType.TEXT:
+            raise RealtimeSessionError(f"Соединение закрыто до окончания распознавания ({message.type.name})")
+        return json.loads(message.data)
+
+    async def receive_results(self):
+        # Чтение сообщений сервиса до EndOfTranscript
+        while True:
+            message = await self._receive_json()
+            message_type = message.get("message")
+            if message_type == "AudioAdded":
+                self._acked_seq_no = max(self._acked_seq_no, message.get("seq_no", 0))
+                self._acked.set()
+                self._acked = asyncio.Event()
+            elif message_type == "AddPartialTranscript":
+                self.partial_text = message.get("metadata", {}).get("transcript", "")
+                self.revision += 1
+            elif message_type == "AddTranscript":
+                self.transcript.extend(Transcript.from_speechmatics(message))
+                self.final_text = self.transcript.to_text()
+                self.partial_text = ""
+                self.revision += 1
+            elif message_type == "EndOfTranscript":
+                return
+            elif message_type == "Error":
+                raise RealtimeSessionError(f"{message.get('type')}: {message.get('reason')}")
+            elif message_type == "Warning":
+                logger.warning(f"Speechmatics Realtime: {message.get('type')}: {message.get('reason')}")
+
+    def preview(self) -> str:
+        return f"{self.final_text} {self.partial_text}".strip()
+
+
+def _format_realtime_progress(text: str, lang: str) -> str:
+    # Промежуточный текст потокового распознавания (хвост, в пределах лимита Telegram)
+    header = get_text("transcription_realtime_progress", lang)
+    limit = settings.chunk_partial_preview_chars
+    preview = text if len(text) <= limit else "…" + text[-limit:]
+    return f"{header}\n\n{html.escape(preview)}"
+
+
+async def _show_partials(session: _RealtimeSession, bot: Bot, progress_message: Message, lang: str):
+    # Обновление сообщения о прогрессе не чаще realtime_progress_edit_interval_seconds,
+    # чтобы не упереться в лимиты Telegram на редактирование
+    shown_revision = 0
+    while True:
+        await asyncio.sleep(settings.realtime_progress_edit_interval_seconds)
+        if session.revision != shown_revision:
+            shown_revision = session.revision
+            text = session.preview()
+            if text:
+                await show_progress_text(bot, progress_message, _format_realtime_progress(text, lang))
+
+
+async def _run_realtime_session(
+    http_session: aiohttp.ClientSession,
+    credential: CredentialLease,
+    file_path: str,
+    language: str,
+    bot: Bot,
+    progress_message: Message,
+    lang: str,
+) -> Transcript:
+    headers = {"Authorization": f"Bearer {credential.api_key}"}
+    try:
+        ws = await http_session.ws_connect(credential.realtime_url, headers=headers)
+    except aiohttp.WSServerHandshakeError as e:
+        raise RealtimeSessionError(f"Подключение отклонено: {e.status} {e.message}", e.status)
+
+    async with ws:
+        session = _RealtimeSession(ws, file_path)
+        await session.start(language)
+        sender = asyncio.create_task(session.send_audio())
+        progress = (
+            asyncio.create_task(_show_partials(session, bot, progress_message, lang))
+            if bot and progress_message else None
+        )
+        receiver = asyncio.create_task(session.receive_results())
+        try:
+            done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_EXCEPTION)
+            if sender in done and sender.exception():
+                receiver.cancel()
+                raise sender.exception()
+            await receiver
+        finally:
+            tasks = [task for task in (sender, receiver, progress) if task]
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # FFmpeg отправителя останавливается до выхода (в том числе при отмене транскрипции пользователем)
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return session.transcript
+
+
+@log_exceptions
+async def transcribe_audio_realtime_with_progress(
+    db: AsyncSession,
+    file_path: str,
+    language: str = "ru",
+    bot: Bot = None,
+    progress_message: Message = None,
+    original_filename: str = "audio.wav",
+    session: Optional[aiohttp.ClientSession] = None,
+    audio_duration: float = 0.0,
+    transcription_id: Optional[int] = None,
+    needs_conversion: bool = False,
+    time_map=None,
+) -> Tuple[Optional[str], Optional[str]]:
+    # Потоковая транскрипция короткой записи через websocket Speechmatics Realtime API:
+    # без загрузки файла и опроса статуса, с промежуточным текстом в сообщении о прогрессе.
+    # Если потоковая сессия не удалась (нет свободного ключа, ошибка подключения или сервиса),
+    # запись отправляется обычной задачей через transcribe_audio_file_with_progress.
+    # FFmpeg декодирует любой исходный формат, поэтому needs_conversion нужен только для обычной задачи.
+    # Возвращает кортеж: (текст транскрипции, сообщение об ошибке) или (None, сообщение об ошибке).
+    session = session or get_http_session()
+    loop = asyncio.get_running_loop()
+    lang = await get_user_language_from_db(db, progress_message.from_user.id) if progress_message else language
+
+    # Сессия открывается через тот же ограничитель, что и обычные задачи (лимит частоты и выключатель),
+    # и только если разрешение и ключ с адресом Realtime API доступны сейчас: ждать в очереди лучше обычной задачей
+    credential = None
+    if await speechmatics_governor.acquire(loop.time()):
+        credential = await credential_pool.acquire(loop.time(), realtime=True)
+        if credential is None:
+            speechmatics_governor.release()
+    transcript = None
+    if credential is not None:
+        started_at = loop.time()
+        try:
+            transcript = await _run_realtime_session(
+                session, credential, file_path, language, bot, progress_message, lang
+            )
+            elapsed = loop.time() - started_at
+            eta_estimator.observe(REALTIME_STAGE, audio_duration, elapsed)
+            logger.info(
+                f"Потоковое распознавание {audio_duration:.1f} с аудио заняло {elapsed:.1f} с "
+                f"(ключ {credential.name})"
+            )
+            if speechmatics_governor.record_success():
+                await _notify_admins(bot, "admin_speechmatics_circuit_closed", language)
+        except (RealtimeSessionError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"Потоковое распознавание не удалось ({e}), запись отправляется обычной задачей")
+            http_status = e.http_status if isinstance(e, RealtimeSessionError) else None
+            if http_status in TRANSIENT_HTTP_STATUSES or isinstance(
+                e, (aiohttp.ClientError, asyncio.TimeoutError)
+            ):
+                # Ошибка сервиса учитывается выключателем так же, как при отправке обычной задачи
+                if speechmatics_governor.record_failure():
+                    await _notify_admins(
+                        bot, "admin_speechmatics_circuit_open", language, status=http_status or str(e)
+                    )
+            else:
+                speechmatics_governor.release()
+            if http_status in [401, 403, 429]:
+                await credential.quarantine(http_status, str(e))
+        except BaseException:
+            # Отмена: пробный слот выключателя не должен зависнуть
+            speechmatics_governor.release()
+            raise
+        finally:
+            credential.release()
+
+    if transcript is not None:
+        plain_text, transcript_data = await pack_transcript_async(transcript, time_map)
+        return await deliver_transcription_result(
+            db, bot, progress_message, original_filename, plain_text, "realtime", transcription_id, transcript_data
+        )
+
+    return await transcribe_audio_file_with_progress(
+        db,
+        file_path,
+        language,
+        bot,
+        progress_message,
+        original_filename=original_filename,
+        audio_duration=audio_duration,
+        transcription_id=transcription_id,
+        needs_conversion=needs_conversion,
+        time_map=time_map,
+    )
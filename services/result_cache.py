@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import settings
+from database.crud import find_completed_transcription, get_transcription_by_id
+from database.models import Transcription, User
+
+logger = logging.getLogger(__name__)
+
+
+def _is_user_scoped() -> bool:
+    # Общий для всех пользователей кэш включается только явным значением "global"
+    return settings.result_cache_scope != "global"
+
+
+def _make_key(kind: str, value: str, language: str, user_id: int) -> Tuple:
+    # Ключ результата: при области видимости "user" в него входит владелец
+    owner = user_id if _is_user_scoped() else None
+    return (kind, value, language, owner)
+
+
+class ResultCache:
+    # Кэш готовых результатов транскрипции по file_unique_id из Telegram и хэшу обработанного аудио.
+    # Источник данных - таблица transcriptions, в памяти хранится только LRU-индекс
+    # "ключ -> ID записи" с ограничением по размеру и возрасту.
+    # При области видимости "user" результат переиспользуется только для того же пользователя.
+
+    def __init__(self):
+        self._entries: "OrderedDict[Tuple, Tuple[int, float]]" = OrderedDict()
+
+    def _is_fresh(self, transcription: Transcription) -> bool:
+        return (
+            transcription is not None
+            and transcription.status == "completed"
+            and bool(transcription.result_text)
+            and transcription.created_at >= datetime.utcnow() - timedelta(hours=settings.result_cache_max_age_hours)
+        )
+
+    def _put(self, key: Tuple, transcription_id: int):
+        self._entries[key] = (transcription_id, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > settings.result_cache_max_entries:
+            self._entries.popitem(last=False)
+
+    def remember(self, transcription: Transcription):
+        # Добавляет успешную транскрипцию в индекс кэша
+        if not settings.result_cache_enabled or not self._is_fresh(transcription):
+            return
+        for kind, value in (("file", transcription.file_unique_id), ("hash", transcription.content_hash)):
+            if value:
+                self._put(_make_key(kind, value, transcription.language, transcription.user_id), transcription.id)
+
+    async def lookup(
+        self,
+        db: AsyncSession,
+        user: User,
+        file_unique_id: Optional[str] = None,
+        content_hash: Optional[str] = None,
+    ) -> Optional[Transcription]:
+        # Поиск готового результата для того же файла; возвращает запись транскрипции или None
+        if not settings.result_cache_enabled:
+            return None
+
+        max_age_seconds = settings.result_cache_max_age_hours * 3600
+        for kind, value in (("file", file_unique_id), ("hash", content_hash)):
+            if not value:
+                continue
+            key = _make_key(kind, value, user.language_code, user.id)
+            entry = self._entries.get(key)
+            if entry is not None:
+                transcription_id, added_at = entry
+                if time.monotonic() - added_at <= max_age_seconds:
+                    transcription = await get_transcription_by_id(db, transcription_id)
+                    if self._is_fresh(transcription):
+                        self._entries.move_to_end(key)
+                        logger.info(f"Кэш результатов: найдено в памяти ({kind}) - транскрипция {transcription_id}")
+                        return transcription
+                # Запись устарела или была удалена пользователем
+                self._entries.pop(key, None)
+
+            transcription = await find_completed_transcription(
+                db,
+                language=user.language_code,
+                created_after=datetime.utcnow() - timedelta(hours=settings.result_cache_max_age_hours),
+                user_id=user.id if _is_user_scoped() else None,
+                file_unique_id=value if kind == "file" else None,
+                content_hash=value if kind == "hash" else None,
+            )
+            if transcription is not None:
+                self._put(key, transcription.id)
+                logger.info(f"Кэш результатов: найдено в базе ({kind}) - транскрипция {transcription.id}")
+                return transcription
+        return None
+
+
+class InFlightTranscriptions:
+    # Транскрипции, которые выполняются прямо сейчас, по file_unique_id и хэшу аудио (single-flight).
+    # Если один и тот же файл присылают почти одновременно (тот же пользователь, а при области видимости
+    # "global" - и разные), он скачивается, конвертируется и отправляется в API один раз: остальные ждут
+    # результата первой обработки и получают его как из кэша - каждому своя запись в истории и свое списание минут.
+    # Дополняет ResultCache: кэш находит готовые результаты, этот реестр - еще не готовые.
+
+    def __init__(self):
+        self._flights: Dict[Tuple, asyncio.Future] = {}
+
+    def find(self, user: User, file_unique_id: Optional[str] = None, content_hash: Optional[str] = None) -> Optional[asyncio.Future]:
+        # Выполняющаяся обработка того же файла (None - такой нет)
+        if not settings.inflight_coalescing_enabled:
+            return None
+        for kind, value in (("file", file_unique_id), ("hash", content_hash)):
+            if value:
+                flight = self._flights.get(_make_key(kind, value, user.language_code, user.id))
+                if flight is not None and not flight.done():
+                    return flight
+        return None
+
+    def begin(self, user: User, file_unique_id: Optional[str] = None) -> asyncio.Future:
+        # Регистрация новой обработки; результат - ID готовой транскрипции (или None при неудаче)
+        flight = asyncio.get_running_loop().create_future()
+        self.add_key(flight, user, "file", file_unique_id)
+        return flight
+
+    def add_key(self, flight: asyncio.Future, user: User, kind: str, value: Optional[str]):
+        # Дополнительный ключ обработки, например хэш аудио, когда он стал известен
+        if settings.inflight_coalescing_enabled and value and not flight.done():
+            self._flights.setdefault(_make_key(kind, value, user.language_code, user.id), flight)
+
+    async def wait(self, flight: asyncio.Future) -> Optional[int]:
+        # Ожидание результата чужой обработки; отмена ожидающего не отменяет саму обработку
+        return await asyncio.shield(flight)
+
+    def finish(self, flight: asyncio.Future, transcription_id: Optional[int]):
+        # Завершение обработки: ожидающие получают ID транскрипции (None - обработать файл самостоятельно)
+        if not flight.done():
+            flight.set_result(transcription_id)
+        for key in [key for key, value in self._flights.items() if value is flight]:
+            del self._flights[key]
+
+
+# Общий экземпляр кэша результатов для всего приложения
+result_cache = ResultCache()
+
+# Общий реестр выполняющихся транскрипций
+inflight_transcriptions = InFlightTranscriptions()
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import List, Tuple
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Этапы обработки файла с собственными лимитами одновременной работы
+STAGE_DOWNLOAD = "download"
+STAGE_FFMPEG = "ffmpeg"
+STAGE_PROVIDER = "provider"
+
+
+class StagePool:
+    # Ограничение одновременной работы одного этапа с очередью ожидающих (FIFO) и статистикой:
+    # сколько задач выполняется и ждет, сколько ждали в очереди и сколько работали.
+    # FFmpeg нагружает CPU, поэтому его пул равен числу ядер; скачивание и ожидание результата API
+    # упираются в сеть и получают свои, намного большие лимиты - этапы не отнимают мощность друг у друга.
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.total_wait_seconds = 0.0
+        self.total_busy_seconds = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        # Место в пуле на время блока async with; пока мест нет - ожидание в очереди
+        loop = asyncio.get_running_loop()
+        queued_at = loop.time()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started_at = loop.time()
+        self.total_wait_seconds += started_at - queued_at
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self.total_busy_seconds += loop.time() - started_at
+            self._semaphore.release()
+
+    def average_wait(self) -> float:
+        return self.total_wait_seconds / self.completed if self.completed else 0.0
+
+    def average_busy(self) -> float:
+        return self.total_busy_seconds / self.completed if self.completed else 0.0
+
+
+def _ffmpeg_workers() -> int:
+    # 0 в настройке - по числу доступных процессу ядер
+    if settings.ffmpeg_workers:
+        return settings.ffmpeg_workers
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Нет sched_getaffinity (Windows, macOS)
+        return os.cpu_count() or 1
+
+
+download_pool = StagePool(STAGE_DOWNLOAD, settings.download_concurrency)
+ffmpeg_pool = StagePool(STAGE_FFMPEG, _ffmpeg_workers())
+provider_pool = StagePool(STAGE_PROVIDER, settings.provider_concurrency)
+
+
+def pools_snapshot() -> List[Tuple[str, int, int, int, int, int, float, float]]:
+    # Статистика для администратора: (этап, лимит, в работе, в очереди, макс. очередь, завершено,
+    # среднее ожидание, средняя работа в секундах)
+    return [
+        (
+            pool.name, pool.limit, pool.active, pool.waiting, pool.max_waiting, pool.completed,
+            pool.average_wait(), pool.average_busy(),
+        )
+        for pool in (download_pool, ffmpeg_pool, provider_pool)
+    ]
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import settings
+from database.crud import get_user_package_backend
+from utils.audio_processing import PCM_BYTES_PER_SECOND, PCM_SAMPLE_RATE
+from utils.ffmpeg_utils import get_ffmpeg_path
+from utils.transcript_format import Transcript
+
+try:
+    import vosk
+except ImportError:  # Локальный движок необязателен: без пакета vosk он просто недоступен
+    vosk = None
+
+logger = logging.getLogger(__name__)
+
+SPEECHMATICS_BACKEND = "speechmatics"
+LOCAL_BACKEND = "local"
+
+# Вызывается удаленным движком сразу после создания задачи: (ID задачи, ключ API)
+SubmittedCallback = Callable[[str, object], Awaitable[None]]
+
+
+class TranscriptionBackend:
+    # Движок распознавания: получает подготовленный аудиофайл и возвращает Transcript.
+    # Не отправляет сообщений в Telegram - прогресс и доставка результата остаются
+    # в services/transcription_service.py и одинаковы для всех движков.
+    name = ""
+    # True - задачи уходят по сети и оплачиваются поминутно (их имеет смысл сохранять для продолжения)
+    remote = True
+
+    def is_available(self, language: str) -> bool:
+        return True
+
+    async def transcribe(
+        self,
+        file_path: str,
+        language: str,
+        audio_duration: float = 0.0,
+        offset: float = 0.0,
+        bot=None,
+        user_id: Optional[int] = None,
+        on_submitted: Optional[SubmittedCallback] = None,
+        needs_conversion: bool = False,
+    ) -> Tuple[Optional[Transcript], Optional[str]]:
+        # offset - начало фрагмента в исходной записи, на него сдвигаются метки времени.
+        # needs_conversion - file_path указывает на исходный файл (любой формат, который понимает FFmpeg),
+        # а не на подготовленный моно 16 кГц; движок конвертирует его сам.
+        # Возвращает кортеж: (результат транскрипции, сообщение об ошибке).
+        raise NotImplementedError
+
+    def shutdown(self):
+        # Освобождение ресурсов движка при завершении бота
+        pass
+
+
+# Модели Vosk, загруженные в процессе-исполнителе (загрузка модели занимает секунды, держим ее между задачами)
+_worker_models: Dict[str, object] = {}
+
+
+def _load_vosk_model(model_path: str):
+    model = _worker_models.get(model_path)
+    if model is None:
+        vosk.SetLogLevel(-1)
+        model = _worker_models[model_path] = vosk.Model(model_path)
+    return model
+
+
+def _transcribe_with_vosk(model_path: str, file_path: str, offset_ms: int) -> list:
+    # Выполняется в отдельном процессе: FFmpeg декодирует файл в PCM, Vosk распознает его по мере чтения.
+    # Возвращает элементы Transcript (начало, конец, слово, признаки присоединения).
+    recognizer = vosk.KaldiRecognizer(_load_vosk_model(model_path), PCM_SAMPLE_RATE)
+    recognizer.SetWords(True)
+    items = []
+
+    def collect(result_json: str):
+        for word in json.loads(result_json).get("result", []):
+            items.append((
+                int(round(word["start"] * 1000)) + offset_ms,
+                int(round(word["end"] * 1000)) + offset_ms,
+                word["word"],
+                0,
+            ))
+
+    process = subprocess.Popen(
+        [
+            get_ffmpeg_path(), '-nostdin', '-loglevel', 'error',
+            '-i', file_path, '-vn', '-ac', '1', '-ar', str(PCM_SAMPLE_RATE),
+            '-f', 's16le', '-acodec', 'pcm_s16le', 'pipe:1',
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        while True:
+            data = process.stdout.read(PCM_BYTES_PER_SECOND)
+            if not data:
+                break
+            if recognizer.AcceptWaveform(data):
+                collect(recognizer.Result())
+        collect(recognizer.FinalResult())
+        stderr = process.stderr.read()
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"FFmpeg не смог декодировать аудио: {stderr.decode(errors='replace')}")
+    return items
+
+
+class LocalBackend(TranscriptionBackend):
+    # Локальное распознавание на CPU (Vosk) в пуле процессов: без сети и поминутной оплаты API.
+    # Модель для языка ищется в local_asr_model_dir/<язык> (например, models/vosk/ru).
+    name = LOCAL_BACKEND
+    remote = False
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _model_path(self, language: str) -> str:
+        return os.path.join(settings.local_asr_model_dir, language)
+
+    def is_available(self, language: str) -> bool:
+        return vosk is not None and os.path.isdir(self._model_path(language))
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения цикла событий бота
+            self._executor = ProcessPoolExecutor(
+                max_workers=settings.local_asr_workers or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def transcribe(
+        self,
+        file_path: str,
+        language: str,
+        audio_duration: float = 0.0,
+        offset: float = 0.0,
+        bot=None,
+        user_id: Optional[int] = None,
+        on_submitted: Optional[SubmittedCallback] = None,
+        needs_conversion: bool = False,
+    ) -> Tuple[Optional[Transcript], Optional[str]]:
+        # Файл в любом случае декодируется FFmpeg в PCM, поэтому needs_conversion не важен
+        if not self.is_available(language):
+            error_msg = f"Локальная модель распознавания для языка '{language}' недоступна"
+            logger.error(error_msg)
+            return None, error_msg
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        try:
+            items = await loop.run_in_executor(
+                self._get_executor(), _transcribe_with_vosk,
+                self._model_path(language), file_path, int(round(offset * 1000)),
+            )
+        except Exception as e:
+            error_msg = f"Ошибка локального распознавания: {e}"
+            logger.exception(error_msg)
+            return None, error_msg
+        logger.info(f"Локальное распознавание {audio_duration:.1f} с аудио заняло {loop.time() - started_at:.1f} с")
+        return Transcript(items), None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_backends: Dict[str, TranscriptionBackend] = {}
+
+
+def register_backend(backend: TranscriptionBackend):
+    _backends[backend.name] = backend
+
+
+def get_backend(name: str) -> Optional[TranscriptionBackend]:
+    return _backends.get(name)
+
+
+async def select_backend(db: AsyncSession, user_id: int, language: str) -> TranscriptionBackend:
+    # Выбор движка: движок пакета пользователя, затем движок для языка, затем движок по умолчанию.
+    # Недоступный движок (нет модели или пакета vosk) пропускается; в крайнем случае - Speechmatics.
+    candidates = [
+        await get_user_package_backend(db, user_id),
+        settings.transcription_backend_by_language.get(language),
+        settings.transcription_backend,
+    ]
+    for name in candidates:
+        backend = _backends.get(name) if name else None
+        if backend and backend.is_available(language):
+            return backend
+        if name and backend is None:
+            logger.warning(f"Неизвестный движок распознавания '{name}'")
+    return _backends[SPEECHMATICS_BACKEND]
+
+
+def shutdown_backends():
+    # Остановка движков (пулов процессов локального распознавания) при завершении бота
+    for backend in _backends.values():
+        backend.shutdown()
+
+
+register_backend(LocalBackend())
@@ -1,25 +1,61 @@
 import os
 import aiohttp
+from aiohttp.payload import AsyncIterablePayload
 import json
+import html
 import logging
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from aiogram import Bot
 from aiogram.types import Message, BufferedInputFile
 import asyncio
+import contextlib
 import io
+import math
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from config.settings import settings
-from database.crud import get_setting
+from database.crud import update_transcription_checkpoint
 from utils.error_handler import log_exceptions
 from database.database import get_async_db
 from keyboards.main_menu import get_main_keyboard
-from utils.language import get_text
+from utils.language import get_text, get_user_language_from_db
+from services.http_client import get_http_session
+from services.job_poller import job_poller, JobPollError, TRANSIENT_HTTP_STATUSES
+from services.rate_governor import speechmatics_governor
+from services.credential_pool import credential_pool, CredentialLease
+from services.job_cancellation import active_jobs
+from services.eta_estimator import eta_estimator, STAGE_SPEECHMATICS_JOB
+from services.stage_pools import ffmpeg_pool
+from services.callback_server import is_callback_mode_enabled, get_notification_config
+from services.transcription_backends import (
+    SPEECHMATICS_BACKEND,
+    SubmittedCallback,
+    TranscriptionBackend,
+    get_backend,
+    register_backend,
+)
+from utils.audio_processing import (
+    AudioTranscodeError,
+    TranscodeStatus,
+    get_upload_codec,
+    get_upload_content_type,
+    iter_file_chunks_async,
+    iter_transcoded_audio_async,
+)
+from utils.transcript_format import (
+    TRANSCRIPT_FORMATS,
+    DEFAULT_TRANSCRIPT_FORMAT,
+    Transcript,
+    pack_transcript_async,
+    parse_speechmatics_response_async,
+    render_packed_transcript_async,
+    render_transcript_async,
+)
+from utils.backoff import apply_jitter, next_poll_interval, parse_retry_after
 
 # Получаем логгер
 logger = logging.getLogger(__name__)
 
-
 async def _notify_admins(bot: Bot, message_key: str, language: str = "ru", **kwargs):
     """Sends a message to all configured admin IDs."""
     admin_message = get_text(message_key, language).format(**kwargs)
@@ -30,6 +66,188 @@ async def _notify_admins(bot: Bot, message_key: str, language: str = "ru", **kwa
             logger.error(f"Failed to send admin notification to {admin_id}: {e}")
 
 
+async def _post_transcription_job(
+    session: aiohttp.ClientSession,
+    credential: CredentialLease,
+    file_path: str,
+    config: dict,
+    needs_conversion: bool = False,
+) -> Tuple[int, str, Optional[float]]:
+    # Один POST-запрос создания задачи. Возвращает кортеж: (HTTP-статус, тело ответа, Retry-After).
+    # Тело запроса передается потоком (chunked): файл читается блоками через aiofiles, а исходный файл,
+    # требующий конвертации (needs_conversion), перекодируется FFmpeg прямо в тело запроса.
+    # Поток одноразовый, поэтому при каждой повторной отправке он создается заново.
+    # Ошибка перекодирования выдается исключением AudioTranscodeError независимо от того, как HTTP-клиент
+    # обработал исключение потока (завернул в ошибку клиента или отправил обрезанное тело)
+    headers = {"Authorization": f"Bearer {credential.api_key}"}
+    transcode_status = TranscodeStatus()
+    if needs_conversion:
+        upload_codec = get_upload_codec(settings.audio_upload_codec)
+        audio_stream = iter_transcoded_audio_async(file_path, settings.audio_upload_codec, status=transcode_status)
+        filename = os.path.splitext(os.path.basename(file_path))[0] + upload_codec["extension"]
+        content_type = upload_codec["content_type"]
+    else:
+        audio_stream = iter_file_chunks_async(file_path)
+        filename = os.path.basename(file_path)
+        content_type = get_upload_content_type(file_path)
+
+    with aiohttp.MultipartWriter("form-data") as data:
+        audio_part = data.append_payload(AsyncIterablePayload(audio_stream, content_type=content_type))
+        audio_part.set_content_disposition("form-data", name="data_file", filename=filename)
+        config_part = data.append_json(config)
+        config_part.set_content_disposition("form-data", name="config")
+
+        # Перекодирование во время загрузки - это процесс FFmpeg, он занимает место в пуле FFmpeg.
+        # aclosing: при обрыве или отмене загрузки поток закрывается сразу, и FFmpeg останавливается
+        try:
+            async with ffmpeg_pool.slot() if needs_conversion else contextlib.nullcontext(), contextlib.aclosing(audio_stream):
+                async with session.post(
+                    credential.api_url, headers=headers, data=data
+                ) as response:
+                    result = (
+                        response.status,
+                        await response.text(),
+                        parse_retry_after(response.headers.get("Retry-After")),
+                    )
+        except Exception:
+            if transcode_status.error is not None:
+                raise AudioTranscodeError(transcode_status.error) from None
+            raise
+    if transcode_status.error is not None:
+        raise AudioTranscodeError(transcode_status.error)
+    return result
+
+
+async def _queue_timeout_error(
+    bot: Bot, response_status: Optional[int], language: str, user_id: Optional[int]
+) -> str:
+    # Сообщение пользователю, если задача так и не дождалась восстановления сервиса
+    logger.error(f"Задача пользователя {user_id} не дождалась восстановления Speechmatics (последний статус: {response_status})")
+    return await _handle_api_error_status(bot, response_status or 500, language, user_id)
+
+
+async def _submit_transcription_job(
+    session: aiohttp.ClientSession,
+    file_path: str,
+    language: str,
+    bot: Bot,
+    user_id: Optional[int],
+    needs_conversion: bool = False,
+) -> Tuple[Optional[str], Optional[CredentialLease], Optional[str]]:
+    # Отправка файла в Speechmatics через наименее нагруженный ключ из пула.
+    # Возвращает кортеж: (ID задачи, ключ задачи, сообщение об ошибке). Ключ остается занят задачей,
+    # вызывающий код освобождает его (release) после получения результата.
+    config = {
+        "type": "transcription",
+        "transcription_config": {"language": language},
+    }
+    if is_callback_mode_enabled():
+        # Speechmatics сам сообщит о завершении задачи, опрос нужен только как запасной вариант
+        config["notification_config"] = get_notification_config()
+
+    # Отправка проходит через общий регулятор: лимит частоты и выключатель при сбоях сервиса.
+    # Временные ошибки (429, 5xx, сеть) не прерывают задачу - она ждет в очереди, пока сервис не восстановится.
+    # Ключ с ошибкой 401/403/429 уходит в карантин, и задача отправляется через другой ключ.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.speechmatics_submit_queue_timeout_seconds
+    retry_interval = settings.speechmatics_poll_min_interval_seconds
+    response_status = None
+    while True:
+        # Сначала разрешение регулятора, затем ключ: ключ не простаивает зарезервированным, пока задача ждет в очереди
+        if not await speechmatics_governor.acquire(deadline):
+            return None, None, await _queue_timeout_error(bot, response_status, language, user_id)
+        credential = await credential_pool.acquire(deadline)
+        if credential is None:
+            speechmatics_governor.release()
+            if response_status in [401, 403]:
+                # Сервис отклонил все ключи пула
+                return None, None, await _handle_api_error_status(bot, response_status, language, user_id)
+            if response_status is None:
+                logger.error("Нет доступных API ключей Speechmatics для отправки задачи")
+                return None, None, get_text("transcription_error", language)
+            return None, None, await _queue_timeout_error(bot, response_status, language, user_id)
+        started_at = loop.time()
+        try:
+            response_status, response_text, retry_after = await _post_transcription_job(
+                session, credential, file_path, config, needs_conversion
+            )
+        except AudioTranscodeError as e:
+            # FFmpeg не смог перекодировать файл в тело запроса: повтор не поможет, сервис ни при чем
+            speechmatics_governor.release()
+            credential.release()
+            logger.error(f"Ошибка конвертации при потоковой загрузке: {e}")
+            return None, None, get_text("transcription_error", language)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            response_status, response_text, retry_after = None, str(e) or type(e).__name__, None
+        except BaseException:
+            # Отмена или ошибка до ответа сервиса: пробный слот выключателя и ключ не должны зависнуть
+            speechmatics_governor.release()
+            credential.release()
+            raise
+
+        logger.info(f"Speechmatics POST response status: {response_status} (ключ {credential.name})")
+        if response_status in [401, 403, 429]:
+            # Проблема конкретного ключа, а не сервиса: ключ в карантин, задача - на другой ключ.
+            # 429 учитывается и выключателем: если лимит исчерпан на всех ключах, отправка приостанавливается
+            # (Retry-After действует только на этот ключ через его карантин)
+            if response_status == 429:
+                if speechmatics_governor.record_failure():
+                    await _notify_admins(bot, "admin_speechmatics_circuit_open", language, status=response_status)
+            else:
+                speechmatics_governor.release()
+            until = await credential.quarantine(response_status, response_text, retry_after)
+            credential.release()
+            if response_status in [401, 403]:
+                await _notify_admins(
+                    bot, "admin_api_credential_quarantined", language,
+                    name=credential.name, status=response_status, until=f"{until:%d.%m %H:%M} UTC",
+                )
+            continue
+
+        if response_status is None or response_status in TRANSIENT_HTTP_STATUSES:
+            await credential.record_failure(f"HTTP {response_status}: {response_text}" if response_status else response_text)
+            credential.release()
+            if speechmatics_governor.record_failure(retry_after):
+                await _notify_admins(
+                    bot, "admin_speechmatics_circuit_open", language, status=response_status or response_text
+                )
+            delay = retry_after if retry_after is not None else apply_jitter(retry_interval)
+            if loop.time() + delay >= deadline:
+                return None, None, await _queue_timeout_error(bot, response_status, language, user_id)
+            logger.warning(
+                f"Временная ошибка при отправке задачи ({response_status or response_text}), повтор через {delay:.1f} с"
+            )
+            await asyncio.sleep(delay)
+            retry_interval = next_poll_interval(retry_interval)
+            continue
+
+        credential.observe_latency(loop.time() - started_at)
+        job_id = json.loads(response_text).get("id") if response_status in [200, 201] else None
+        if job_id:
+            # Задача в Speechmatics уже создана: ее ID нужен отмене еще до сохранения в базе
+            active_jobs.track_submitted_job(job_id, credential.credential_id)
+        if speechmatics_governor.record_success():
+            await _notify_admins(bot, "admin_speechmatics_circuit_closed", language)
+        break
+
+    if response_status not in [200, 201]:
+        credential.release()
+        error_msg = f"Ошибка при отправке файла на транскрипцию: {response_status}, {response_text}"
+        logger.error(error_msg)
+        return None, None, error_msg
+
+    if not job_id:
+        credential.release()
+        error_msg = (
+            "Не удалось получить ID задачи из ответа Speechmatics."
+        )
+        logger.error(error_msg)
+        return None, None, error_msg
+
+    logger.info(f"Transcription job created with ID: {job_id} (ключ {credential.name})")
+    return job_id, credential, None
+
+
 @log_exceptions
 async def transcribe_audio_file_with_progress(
     db: AsyncSession,
@@ -39,76 +257,45 @@ async def transcribe_audio_file_with_progress(
     progress_message: Message = None,
     original_filename: str = "audio.wav",
     target_format: str = "text",
+    audio_duration: float = 0.0,
+    transcription_id: Optional[int] = None,
+    backend: Optional[TranscriptionBackend] = None,
+    needs_conversion: bool = False,
+    time_map=None,
 ) -> Tuple[Optional[str], Optional[str]]:
-    # Отправка аудиофайла на транскрипцию через Speechmatics API с отображением прогресса.
+    # Транскрипция аудиофайла выбранным движком (по умолчанию Speechmatics) с отображением прогресса.
     # Возвращает кортеж: (текст транскрипции, сообщение об ошибке) или (None, сообщение об ошибке).
+    # audio_duration - длительность записи в секундах, от нее зависит начальный интервал опроса.
+    # transcription_id - запись в базе, в которой сохраняются ID задачи и пройденные этапы.
+    # time_map - запись без пауз: метки времени результата переводятся в исходную запись.
+    # needs_conversion - передан исходный файл: движок сам перекодирует его (для Speechmatics - прямо в загрузку).
     try:
-        api_key = await get_setting(db, "api_key")
-        if not api_key:
-            error_msg = get_text("transcription_error", language)
-            logger.error(error_msg)
+        backend = backend or get_backend(SPEECHMATICS_BACKEND)
+        user_id = progress_message.from_user.id if progress_message else None
+
+        async def on_submitted(job_id: str, credential: CredentialLease):
+            await _checkpoint(
+                transcription_id, "submitted", job_ids=[[job_id, 0.0, credential.credential_id]],
+                credential_id=credential.credential_id,
+            )
+            await _show_transcription_progress(db, bot, progress_message, audio_duration, backend.name)
+
+        if not backend.remote:
+            await _show_transcription_progress(db, bot, progress_message, audio_duration, backend.name)
+        started_at = asyncio.get_running_loop().time()
+        transcript, error_msg = await backend.transcribe(
+            file_path, language, audio_duration, bot=bot, user_id=user_id, on_submitted=on_submitted,
+            needs_conversion=needs_conversion,
+        )
+        if transcript is None:
             return None, error_msg
+        eta_estimator.observe(backend.name, audio_duration, asyncio.get_running_loop().time() - started_at)
 
-        headers = {"Authorization": f"Bearer {api_key}"}
-        config = {
-            "type": "transcription",
-            "transcription_config": {"language": language},
-        }
-
-        # Асинхронная отправка файла на транскрипцию
-        async with aiohttp.ClientSession() as session:
-            with open(file_path, "rb") as audio_file:
-                data = aiohttp.FormData()
-                data.add_field(
-                    "data_file",
-                    audio_file,
-                    filename=os.path.basename(file_path),
-                    content_type="audio/wav",
-                )
-                data.add_field(
-                    "config", json.dumps(config), content_type="application/json"
-                )
-
-                async with session.post(
-                    settings.speechmatics_api_url, headers=headers, data=data
-                ) as response:
-                    response_status = response.status
-                    response_text = await response.text()
-
-                    logger.info(f"Speechmatics POST response status: {response_status}")
-                    if response_status in [401, 403, 429, 500]:
-                        admin_message_key = "admin_api_key_invalid" if response_status in [401, 403] else (
-                            "admin_rate_limited_notification" if response_status == 429 else "admin_internal_server_error_notification"
-                        )
-                        user_message_key = "user_transcription_failed_generic" if response_status in [401, 403] else (
-                            "user_rate_limited_generic" if response_status == 429 else "user_internal_server_error_generic"
-                        )
-                        await _notify_admins(bot, admin_message_key, language)
-                        user_error_msg = get_text(user_message_key, language)
-                        logger.error(f"Speechmatics API error ({response_status}). Admin notified. User: {progress_message.from_user.id}")
-                        return None, user_error_msg
-                    elif response_status not in [200, 201]:
-                        error_msg = f"Ошибка при отправке файла на транскрипцию: {response_status}, {response_text}"
-                        logger.error(error_msg)
-                        return None, error_msg
-
-                    response_json = await response.json()
-                    job_id = response_json.get("id")
-                    if not job_id:
-                        error_msg = (
-                            "Не удалось получить ID задачи из ответа Speechmatics."
-                        )
-                        logger.error(error_msg)
-                        return None, error_msg
-
-        logger.info(f"Transcription job created with ID: {job_id}")
-
-        plain_text, error_msg = await wait_for_transcription_with_progress(
-            db, job_id, api_key, bot, progress_message, original_filename, language
+        plain_text, transcript_data = await pack_transcript_async(transcript, time_map)
+        return await deliver_transcription_result(
+            db, bot, progress_message, original_filename, plain_text, backend.name, transcription_id, transcript_data
         )
 
-        return plain_text, error_msg
-
     except aiohttp.ClientError as e:
         error_msg = f"Ошибка сети при транскрипции аудио: {e}"
         logger.exception(error_msg)
@@ -121,178 +308,553 @@ async def transcribe_audio_file_with_progress(
         error_msg = f"Неизвестная ошибка при транскрипции аудио: {e}"
         logger.exception(error_msg)
         return None, error_msg
-    finally:
-        pass
 
 
-@log_exceptions
-async def wait_for_transcription_with_progress(
-    db: AsyncSession,
+async def _get_with_retries(
+    session: aiohttp.ClientSession,
+    url: str,
+    headers: dict,
+    deadline: float,
+) -> Tuple[Optional[int], Optional[bytes], Optional[float], Optional[str]]:
+    # GET-запрос к Speechmatics с повтором временных ошибок (сеть, 429, 5xx) в пределах бюджета.
+    # Возвращает кортеж: (HTTP-статус, тело ответа, Retry-After, описание последней временной ошибки).
+    # Если бюджет повторов исчерпан, тело равно None, а статус - последний полученный (или None при ошибке сети).
+    loop = asyncio.get_running_loop()
+    retry_interval = settings.speechmatics_poll_min_interval_seconds
+    attempt = 0
+
+    while True:
+        try:
+            async with session.get(url, headers=headers) as response:
+                response_status = response.status
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                body = await response.read()
+            if response_status not in TRANSIENT_HTTP_STATUSES:
+                return response_status, body, retry_after, None
+            error_text = f"HTTP {response_status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            response_status, retry_after = None, None
+            error_text = str(e) or type(e).__name__
+
+        attempt += 1
+        delay = retry_after if retry_after is not None else apply_jitter(retry_interval)
+        if attempt > settings.speechmatics_max_transient_retries or loop.time() + delay >= deadline:
+            return response_status, None, retry_after, error_text
+
+        logger.warning(
+            f"Временная ошибка при запросе {url} ({error_text}), попытка {attempt}, повтор через {delay:.1f} с"
+        )
+        await asyncio.sleep(delay)
+        retry_interval = next_poll_interval(retry_interval)
+
+
+async def _handle_api_error_status(
+    bot: Bot, response_status: int, language: str, user_id: Optional[int]
+) -> str:
+    # Возвращает текст ошибки API для пользователя. Админы уведомляются сразу только о проблеме с ключом:
+    # о лимитах и сбоях сервиса сообщает выключатель при смене состояния, а не каждая задача.
+    user_message_key = "user_transcription_failed_generic" if response_status in [401, 403] else (
+        "user_rate_limited_generic" if response_status == 429 else "user_internal_server_error_generic"
+    )
+    if response_status in [401, 403]:
+        await _notify_admins(bot, "admin_api_key_invalid", language)
+        logger.error(f"Speechmatics API error ({response_status}). Admin notified. User: {user_id}")
+    else:
+        logger.error(f"Speechmatics API error ({response_status}). User: {user_id}")
+    return get_text(user_message_key, language)
+
+
+async def _wait_for_job_result(
+    session: aiohttp.ClientSession,
     job_id: str,
-    api_key: str,
+    credential: CredentialLease,
+    bot: Bot,
+    language: str,
+    user_id: Optional[int],
+    audio_duration: float = 0.0,
+    offset: float = 0.0,
+    submitted_at: Optional[float] = None,
+) -> Tuple[Optional[Transcript], Optional[str]]:
+    # Ожидание завершения задачи через общий планировщик опроса и загрузка результата.
+    # credential - ключ и адрес API, через которые отправлена задача.
+    # offset - начало фрагмента в исходной записи, на него сдвигаются метки времени.
+    # submitted_at - время создания задачи (время цикла событий): время до ее завершения учитывается в статистике;
+    # не задано при продолжении задачи после перезапуска.
+    # Возвращает кортеж: (результат транскрипции, сообщение об ошибке).
+    headers = {"Authorization": f"Bearer {credential.api_key}"}
+    result_url = f"{credential.api_url.rstrip('/')}/{job_id}/transcript?format=json-v2"
+
+    loop = asyncio.get_running_loop()
+    # Срок ожидания не меньше настройки, но и не меньше "плохого случая" по статистике похожих записей
+    max_wait = settings.speechmatics_max_wait_time_seconds
+    expected_worst = eta_estimator.estimate(STAGE_SPEECHMATICS_JOB, audio_duration, settings.eta_deadline_quantile)
+    if expected_worst:
+        max_wait = max(max_wait, expected_worst * settings.eta_deadline_factor)
+    deadline = loop.time() + max_wait
+
+    # В режиме уведомлений первая проверка откладывается: опрос включится, только если уведомление не пришло.
+    # При опросе первая проверка - незадолго до ожидаемого завершения (по статистике похожих записей)
+    if is_callback_mode_enabled():
+        first_check_delay = settings.speechmatics_callback_fallback_seconds
+    else:
+        expected_early = eta_estimator.estimate(STAGE_SPEECHMATICS_JOB, audio_duration, settings.eta_first_poll_quantile)
+        first_check_delay = apply_jitter(expected_early) if expected_early else None
+    while True:
+        job_future = job_poller.register(
+            job_id, credential.api_key, credential.api_url, audio_duration, first_check_delay
+        )
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(job_future), timeout=max(0.0, deadline - loop.time())
+            )
+            break
+        except asyncio.TimeoutError:
+            job_poller.unregister(job_id)
+            error_msg = "Превышено время ожидания результата транскрипции."
+            logger.error(error_msg)
+            return None, error_msg
+        except asyncio.CancelledError:
+            job_poller.unregister(job_id)
+            raise
+        except JobPollError as e:
+            if e.transient and loop.time() < deadline:
+                # Сервис временно недоступен, но задача в Speechmatics жива: продолжаем ждать ее, а не отменяем
+                if speechmatics_governor.record_failure():
+                    await _notify_admins(
+                        bot, "admin_speechmatics_circuit_open", language, status=e.http_status or str(e)
+                    )
+                logger.warning(f"Ожидание задачи {job_id} продолжается после временной ошибки: {e}")
+                first_check_delay = settings.speechmatics_poll_max_interval_seconds
+                continue
+            if e.http_status in [401, 403]:
+                await credential.quarantine(e.http_status, str(e))
+            if e.http_status in [401, 403] or e.http_status in TRANSIENT_HTTP_STATUSES:
+                return None, await _handle_api_error_status(bot, e.http_status, language, user_id)
+            error_msg = str(e)
+            logger.error(error_msg)
+            return None, error_msg
+
+    logger.info(f"Speechmatics job {job_id} is done - fetching transcript.")
+    if submitted_at is not None:
+        eta_estimator.observe(STAGE_SPEECHMATICS_JOB, audio_duration, loop.time() - submitted_at)
+
+    response_status, response_body, _, transient_error = await _get_with_retries(
+        session, result_url, headers, deadline + settings.speechmatics_poll_max_interval_seconds
+    )
+    if response_status in [401, 403]:
+        await credential.quarantine(response_status, response_body.decode(errors='replace'))
+    if response_status in [401, 403] or (transient_error and response_status is not None):
+        return None, await _handle_api_error_status(bot, response_status, language, user_id)
+    elif transient_error:
+        error_msg = f"Ошибка сети при получении результата транскрипции: {transient_error}"
+        logger.error(error_msg)
+        return None, error_msg
+    elif response_status != 200:
+        error_msg = f"Ошибка при получении результата: {response_status}, {response_body.decode(errors='replace')}"
+        logger.error(error_msg)
+        return None, error_msg
+
+    return await parse_speechmatics_response_async(response_body, offset), None
+
+
+class SpeechmaticsBackend(TranscriptionBackend):
+    # Пакетный API Speechmatics: отправка файла через пул ключей и общий регулятор,
+    # ожидание задачи (опрос или уведомление) и разбор результата
+    name = SPEECHMATICS_BACKEND
+    remote = True
+
+    async def transcribe(
+        self,
+        file_path: str,
+        language: str,
+        audio_duration: float = 0.0,
+        offset: float = 0.0,
+        bot: Bot = None,
+        user_id: Optional[int] = None,
+        on_submitted: Optional[SubmittedCallback] = None,
+        needs_conversion: bool = False,
+    ) -> Tuple[Optional[Transcript], Optional[str]]:
+        session = get_http_session()
+        job_id, credential, error_msg = await _submit_transcription_job(
+            session, file_path, language, bot, user_id, needs_conversion
+        )
+        if not job_id:
+            return None, error_msg
+        submitted_at = asyncio.get_running_loop().time()
+        try:
+            if on_submitted:
+                await on_submitted(job_id, credential)
+            return await _wait_for_job_result(
+                session, job_id, credential, bot, language, user_id, audio_duration, offset, submitted_at
+            )
+        finally:
+            credential.release()
+
+
+register_backend(SpeechmaticsBackend())
+
+
+def get_delivery_format(transcript_data: Optional[bytes]) -> str:
+    # Формат документа с результатом: субтитры и JSON возможны только при сохраненных метках времени
+    fmt = settings.result_delivery_format.lower()
+    if transcript_data and fmt in TRANSCRIPT_FORMATS:
+        return fmt
+    return DEFAULT_TRANSCRIPT_FORMAT
+
+
+async def show_progress_text(bot: Bot, progress_message: Message, text: str):
+    # Обновляет сообщение о прогрессе, игнорируя ошибку "message is not modified"
+    try:
+        await bot.edit_message_text(
+            chat_id=progress_message.chat.id,
+            message_id=progress_message.message_id,
+            text=text,
+        )
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            logger.warning(
+                f"Не удалось обновить сообщение о прогрессе: {e}"
+            )
+
+
+async def send_transcription_result(
+    bot: Bot,
+    chat_id: int,
+    progress_message_id: Optional[int],
+    lang: str,
+    original_filename: str,
+    plain_text: str,
+    job_id: str,
+    transcript_data: Optional[bytes] = None,
+) -> Tuple[Optional[str], Optional[str]]:
+    # Отправка результата в чат: документ с текстом или сообщение о том, что текст не найден.
+    # Не зависит от объекта Message, поэтому используется и при доставке после перезапуска бота.
+    # Возвращает кортеж (текст, None); (None, None) означает, что пользователь уже получил сообщение.
+    main_keyboard = get_main_keyboard(lang)
+
+    # Пытаемся удалить сообщение "Обработка..."
+    if progress_message_id:
+        try:
+            await bot.delete_message(
+                chat_id=chat_id,
+                message_id=progress_message_id,
+            )
+        except Exception as e:
+            logger.warning(
+                f"Не удалось удалить сообщение о прогрессе: {e}"
+            )
+
+    if not plain_text:
+        await bot.send_message( # Send new message with error and keyboard
+            chat_id=chat_id,
+            text=get_text("transcription_no_text_found", lang),
+            reply_markup=main_keyboard,
+        )
+        logger.warning(f"No text found in transcription for job {job_id}. Chat: {chat_id}")
+        return None, None # Return None for error_message to indicate user message was sent
+
+    # Создаем файл с результатом в памяти (субтитры и JSON строятся из сохраненных меток времени)
+    fmt = get_delivery_format(transcript_data)
+    if fmt == DEFAULT_TRANSCRIPT_FORMAT:
+        file_content = plain_text or " "
+    else:
+        file_content = await render_packed_transcript_async(transcript_data, fmt)
+    file_name = f"{os.path.splitext(original_filename)[0]}_result.{fmt}"
+
+    buffered_file = io.BytesIO(file_content.encode("utf-8"))
+    text_file = BufferedInputFile(
+        buffered_file.read(), filename=file_name
+    )
+
+    # Отправляем результат в виде документа
+    await bot.send_document(
+        chat_id=chat_id,
+        document=text_file,
+        caption=get_text("transcription_complete", lang),
+        reply_markup=main_keyboard,
+    )
+    return plain_text, None
+
+
+async def deliver_transcription_result(
+    db: AsyncSession,
     bot: Bot,
     progress_message: Message,
     original_filename: str,
+    plain_text: str,
+    job_id: str,
+    transcription_id: Optional[int] = None,
+    transcript_data: Optional[bytes] = None,
+) -> Tuple[Optional[str], Optional[str]]:
+    # Отправка результата пользователю, который ждет его в чате с сообщением о прогрессе.
+    # Если передан transcription_id, этапы "fetched" и "delivered" сохраняются в базе
+    # вместе со сжатыми метками времени (transcript_data) для повторной выгрузки в других форматах.
+    # Возвращает кортеж (текст, None); (None, None) означает, что пользователь уже получил сообщение.
+    # С этого момента отмена пользователем не принимается: результат доставляется, а минуты списываются.
+    await active_jobs.commit_current()
+    await _checkpoint(transcription_id, "fetched", result_text=plain_text or None, transcript_data=transcript_data)
+
+    if not (bot and progress_message):
+        if not plain_text:
+            logger.warning(f"No text found in transcription for job {job_id}.")
+            return None, None
+        return plain_text, None
+
+    lang = await get_user_language_from_db(db, progress_message.from_user.id)
+    result = await send_transcription_result(
+        bot,
+        progress_message.chat.id,
+        progress_message.message_id,
+        lang,
+        original_filename,
+        plain_text,
+        job_id,
+        transcript_data,
+    )
+    await _checkpoint(transcription_id, "delivered", result_format=get_delivery_format(transcript_data))
+    return result
+
+
+async def _checkpoint(transcription_id: Optional[int], stage: str, job_ids: Optional[list] = None, result_text: Optional[str] = None,
+                      transcript_data: Optional[bytes] = None, result_format: Optional[str] = None,
+                      credential_id: Optional[int] = None):
+    # Сохранение этапа задачи в базе (ошибка записи не должна прерывать саму транскрипцию)
+    if not transcription_id:
+        return
+    try:
+        async with get_async_db() as db:
+            await update_transcription_checkpoint(
+                db,
+                transcription_id,
+                stage,
+                job_ids=json.dumps(job_ids) if job_ids is not None else None,
+                result_text=result_text,
+                transcript_data=transcript_data,
+                result_format=result_format,
+                credential_id=credential_id,
+            )
+    except Exception as e:
+        logger.error(f"Не удалось сохранить этап {stage} транскрипции {transcription_id}: {e}")
+
+
+def format_eta(seconds: float, lang: str) -> str:
+    # Ожидаемое время для пользователя: секунды с шагом 5 с, дальше - минуты с округлением вверх
+    if seconds < 60:
+        return get_text("eta_seconds", lang).format(seconds=max(5, math.ceil(seconds / 5) * 5))
+    return get_text("eta_minutes", lang).format(minutes=math.ceil(seconds / 60))
+
+
+async def _show_transcription_progress(db: AsyncSession, bot: Bot, progress_message: Message,
+                                       audio_duration: float = 0.0, backend_name: str = SPEECHMATICS_BACKEND):
+    # Сообщение "Идет транскрибация..." после отправки задачи (или перед локальным распознаванием)
+    # с ожидаемым временем по статистике похожих записей, если она уже накоплена
+    if not (bot and progress_message):
+        return
+    lang = await get_user_language_from_db(db, progress_message.from_user.id)
+    progress_text = get_text("transcription_progress", lang)
+    eta = eta_estimator.estimate(backend_name, audio_duration)
+    if eta:
+        progress_text += "\n" + get_text("transcription_eta", lang).format(eta=format_eta(eta, lang))
+    if progress_message.text != progress_text:
+        await show_progress_text(bot, progress_message, progress_text)
+
+
+def _format_partial_progress(text: str, done: int, total: int, lang: str) -> str:
+    # Текст промежуточного прогресса: уже готовая часть транскрипции (хвост, в пределах лимита Telegram)
+    header = get_text("transcription_partial_progress", lang).format(done=done, total=total)
+    limit = settings.chunk_partial_preview_chars
+    preview = text if len(text) <= limit else "…" + text[-limit:]
+    return f"{header}\n\n{html.escape(preview)}"
+
+
+@log_exceptions
+async def transcribe_audio_chunks_with_progress(
+    db: AsyncSession,
+    chunks: List[Tuple[str, float]],
     language: str = "ru",
+    bot: Bot = None,
+    progress_message: Message = None,
+    original_filename: str = "audio.wav",
+    audio_duration: float = 0.0,
+    transcription_id: Optional[int] = None,
+    backend: Optional[TranscriptionBackend] = None,
+    time_map=None,
 ) -> Tuple[Optional[str], Optional[str]]:
-    # Ожидание завершения транскрипции с обновлением прогресса.
+    # Параллельная транскрипция длинной записи, разрезанной на фрагменты (путь, смещение в секундах).
+    # Фрагменты отправляются одновременно (не больше chunk_max_parallel_jobs), результаты склеиваются
+    # по порядку со сдвигом меток времени, а пользователь видит текст по мере готовности начальных фрагментов.
     # Возвращает кортеж: (текст транскрипции, сообщение об ошибке) или (None, сообщение об ошибке).
     try:
-        headers = {"Authorization": f"Bearer {api_key}"}
-        result_url = f"{settings.speechmatics_api_url.rstrip('/')}/{job_id}/transcript"
-
-        max_wait_time = settings.speechmatics_max_wait_time_seconds
-        wait_interval = 5
-        elapsed_time = 0
-
-        async with aiohttp.ClientSession() as session:
-            while elapsed_time < max_wait_time:
-                try:
-                    async with session.get(result_url, headers=headers) as response:
-                        response_status = response.status
-                        response_text = await response.text()
-
-                        if response_status == 200:
-                            logger.info(
-                                f"Speechmatics GET response status for job {job_id}: 200 - Transcription ready."
-                            )
-                            result_data = await response.json()
-
-                            plain_text = " ".join(
-                                item.get("alternatives", [{}])[0].get("content", "")
-                                for item in result_data.get("results", [])
-                            ).strip()
-
-                            if not plain_text:
-                                if bot and progress_message:
-                                    from utils.language import get_user_language_from_db
-                                    lang = await get_user_language_from_db(db, progress_message.from_user.id)
-                                    no_text_message = get_text("transcription_no_text_found", lang)
-                                    main_keyboard = get_main_keyboard(lang) # Get keyboard here
-
-                                    try:
-                                        await bot.delete_message( # Delete the progress message
-                                            chat_id=progress_message.chat.id,
-                                            message_id=progress_message.message_id,
-                                        )
-                                    except Exception as e:
-                                        logger.warning(f"Не удалось удалить сообщение о прогрессе: {e}")
-
-                                    await bot.send_message( # Send new message with error and keyboard
-                                        chat_id=progress_message.chat.id,
-                                        text=no_text_message,
-                                        reply_markup=main_keyboard,
-                                    )
-                                logger.warning(f"No text found in transcription for job {job_id}. User: {progress_message.from_user.id}")
-                                return None, None # Return None for error_message to indicate user message was sent
-
-                            if bot and progress_message:
-                                from utils.language import (
-                                    get_text,
-                                    get_user_language_from_db,
-                                )
-
-                                lang = await get_user_language_from_db(
-                                    db, progress_message.from_user.id
-                                )
-                                success_text = get_text("transcription_complete", lang)
-                                main_keyboard = get_main_keyboard(lang)
-
-                                # Создаем текстовый файл в памяти
-                                file_content = plain_text or " "
-                                file_name = f"{os.path.splitext(original_filename)[0]}_result.txt"
-
-                                buffered_file = io.BytesIO(file_content.encode("utf-8"))
-                                text_file = BufferedInputFile(
-                                    buffered_file.read(), filename=file_name
-                                )
-
-                                # Пытаемся удалить сообщение "Обработка..."
-                                try:
-                                    await bot.delete_message(
-                                        chat_id=progress_message.chat.id,
-                                        message_id=progress_message.message_id,
-                                    )
-                                except Exception as e:
-                                    logger.warning(
-                                        f"Не удалось удалить сообщение о прогрессе: {e}"
-                                    )
-
-                                # Отправляем результат в виде документа
-                                await bot.send_document(
-                                    chat_id=progress_message.chat.id,
-                                    document=text_file,
-                                    caption=success_text,
-                                    reply_markup=main_keyboard,
-                                )
-
-                            return plain_text, None
-
-                        elif response_status in [401, 403, 429, 500]:
-                            admin_message_key = "admin_api_key_invalid" if response_status in [401, 403] else (
-                                "admin_rate_limited_notification" if response_status == 429 else "admin_internal_server_error_notification"
-                            )
-                            user_message_key = "user_transcription_failed_generic" if response_status in [401, 403] else (
-                                "user_rate_limited_generic" if response_status == 429 else "user_internal_server_error_generic"
-                            )
-                            await _notify_admins(bot, admin_message_key, language)
-                            user_error_msg = get_text(user_message_key, language)
-                            logger.error(f"Speechmatics API error ({response_status}) during status check. Admin notified. User: {progress_message.from_user.id}")
-                            return None, user_error_msg
-                        elif response_status == 404:
-                            logger.info(
-                                f"Transcription not ready for job {job_id}. Status: running."
-                            )
-                            if bot and progress_message:
-                                from utils.language import (
-                                    get_text,
-                                    get_user_language_from_db,
-                                )
-
-                                lang = await get_user_language_from_db(
-                                    db, progress_message.from_user.id
-                                )
-                                progress_text = get_text("transcription_progress", lang)
-
-                                if progress_message.text != progress_text:
-                                    try:
-                                        await bot.edit_message_text(
-                                            chat_id=progress_message.chat.id,
-                                            message_id=progress_message.message_id,
-                                            text=progress_text,
-                                        )
-                                    except Exception as e:
-                                        if "message is not modified" not in str(e):
-                                            logger.warning(
-                                                f"Не удалось обновить сообщение о прогрессе: {e}"
-                                            )
-
-                            await asyncio.sleep(wait_interval)
-                            elapsed_time += wait_interval
-                            continue
-                        else:
-                            error_msg = f"Ошибка при получении результата: {response_status}, {response_text}"
-                            logger.error(error_msg)
-                            return None, error_msg
-
-                except aiohttp.ClientError as e:
-                    error_msg = f"Ошибка сети при ожидании результата транскрипции: {e}"
-                    logger.exception(error_msg)
-                    return None, error_msg
-                except json.JSONDecodeError as e:
-                    error_msg = f"Ошибка при обработке JSON-ответа от Speechmatics: {e}"
-                    logger.exception(error_msg)
-                    return None, error_msg
-                except Exception as e:
-                    error_msg = (
-                        f"Неизвестная ошибка при ожидании результата транскрипции: {e}"
-                    )
-                    logger.exception(error_msg)
+        backend = backend or get_backend(SPEECHMATICS_BACKEND)
+        user_id = progress_message.from_user.id if progress_message else None
+        lang = await get_user_language_from_db(db, user_id) if progress_message else language
+        semaphore = asyncio.Semaphore(settings.chunk_max_parallel_jobs)
+        total = len(chunks)
+        submitted_jobs: List[list] = []
+        checkpoint_lock = asyncio.Lock()
+
+        async def on_submitted(offset: float, job_id: str, credential: CredentialLease):
+            async with checkpoint_lock:
+                submitted_jobs.append([job_id, offset, credential.credential_id])
+                await _checkpoint(
+                    transcription_id, "submitted", job_ids=sorted(submitted_jobs, key=lambda job: job[1]),
+                    credential_id=credential.credential_id if len(submitted_jobs) == 1 else None,
+                )
+
+        async def transcribe_chunk(index: int) -> Tuple[Optional[Transcript], Optional[str]]:
+            chunk_path, offset = chunks[index]
+            next_offset = chunks[index + 1][1] if index + 1 < total else audio_duration
+            # Семафор ограничивает одновременную отправку фрагментов удаленному движку (слот освобождается,
+            # как только задача создана) или одновременное распознавание локальным движком
+            await semaphore.acquire()
+            slot_held = True
+
+            def release_slot():
+                nonlocal slot_held
+                if slot_held:
+                    slot_held = False
+                    semaphore.release()
+
+            async def chunk_submitted(job_id: str, credential: CredentialLease):
+                release_slot()
+                await on_submitted(offset, job_id, credential)
+
+            try:
+                return await backend.transcribe(
+                    chunk_path, language, max(0.0, next_offset - offset), offset, bot, user_id,
+                    on_submitted=chunk_submitted,
+                )
+            finally:
+                release_slot()
+
+        await _show_transcription_progress(db, bot, progress_message, audio_duration, backend.name)
+        started_at = asyncio.get_running_loop().time()
+        tasks = [asyncio.create_task(transcribe_chunk(index)) for index in range(total)]
+        delivered = 0
+        merged = Transcript()
+
+        try:
+            for finished in asyncio.as_completed(tasks):
+                transcript, error_msg = await finished
+                if transcript is None:
+                    # Ошибка любого фрагмента прерывает всю задачу, остальные фрагменты отменяются
                     return None, error_msg
+                # Показываем текст всех готовых фрагментов от начала записи без пропусков
+                while delivered < total and tasks[delivered].done():
+                    transcript, error_msg = tasks[delivered].result()
+                    if transcript is None:
+                        # Фрагмент, завершившийся одновременно с этим, вернул ошибку
+                        return None, error_msg
+                    merged.extend(transcript)
+                    delivered += 1
+                    if bot and progress_message and delivered < total:
+                        partial_text = await render_transcript_async(merged)
+                        if partial_text:
+                            await show_progress_text(
+                                bot, progress_message, _format_partial_progress(partial_text, delivered, total, lang)
+                            )
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # Дожидаемся отмененных фрагментов: их FFmpeg, ключи API и места в пулах освобождаются
+            # до того, как вызывающий код удалит временные файлы
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        eta_estimator.observe(backend.name, audio_duration, asyncio.get_running_loop().time() - started_at)
+        plain_text, transcript_data = await pack_transcript_async(merged, time_map)
+        return await deliver_transcription_result(
+            db, bot, progress_message, original_filename, plain_text, f"{backend.name}: {total} chunks", transcription_id, transcript_data
+        )
 
-        error_msg = "Превышено время ожидания результата транскрипции."
-        logger.error(error_msg)
+    except json.JSONDecodeError as e:
+        error_msg = f"Ошибка при обработке JSON-ответа от Speechmatics: {e}"
+        logger.exception(error_msg)
         return None, error_msg
+    except Exception as e:
+        error_msg = f"Неизвестная ошибка при транскрипции аудио по фрагментам: {e}"
+        logger.exception(error_msg)
+        return None, error_msg
+
 
-    finally:
-        pass
\ No newline at end of file
+async def collect_transcription_results(
+    job_ids: List[list],
+    bot: Bot,
+    language: str,
+    audio_duration: float = 0.0,
+    session: Optional[aiohttp.ClientSession] = None,
+) -> Tuple[Optional[Transcript], Optional[str]]:
+    # Ожидание уже отправленных задач [ID, смещение фрагмента, ID ключа] и склейка результатов по порядку.
+    # Используется для продолжения задач после перезапуска бота.
+    # Возвращает кортеж: (результат транскрипции, сообщение об ошибке).
+    try:
+        session = session or get_http_session()
+        ordered_jobs = sorted(job_ids, key=lambda job: job[1])
+
+        async def wait_for_job(index: int) -> Tuple[Optional[Transcript], Optional[str]]:
+            job_id, offset = ordered_jobs[index][:2]
+            # Записи, сохраненные до появления пула ключей, не содержат ID ключа
+            credential_id = ordered_jobs[index][2] if len(ordered_jobs[index]) > 2 else None
+            next_offset = ordered_jobs[index + 1][1] if index + 1 < len(ordered_jobs) else audio_duration
+            credential = await credential_pool.lease_for(credential_id)
+            if credential is None:
+                logger.error(f"Нет API ключа для продолжения задачи {job_id}")
+                return None, get_text("transcription_error", language)
+            try:
+                return await _wait_for_job_result(
+                    session, job_id, credential, bot, language, None, max(0.0, next_offset - offset), offset
+                )
+            finally:
+                credential.release()
+
+        results = await asyncio.gather(*[wait_for_job(index) for index in range(len(ordered_jobs))])
+
+        merged = Transcript()
+        for transcript, error_msg in results:
+            if transcript is None:
+                return None, error_msg
+            merged.extend(transcript)
+        return merged, None
+
+    except json.JSONDecodeError as e:
+        error_msg = f"Ошибка при обработке JSON-ответа от Speechmatics: {e}"
+        logger.exception(error_msg)
+        return None, error_msg
+    except Exception as e:
+        error_msg = f"Неизвестная ошибка при ожидании результата транскрипции: {e}"
+        logger.exception(error_msg)
+        return None, error_msg
+
+
+async def cancel_transcription_jobs(
+    job_ids: List[list],
+    session: Optional[aiohttp.ClientSession] = None,
+):
+    # Отмена уже отправленных задач [ID, смещение фрагмента, ID ключа] в Speechmatics (DELETE с force=true),
+    # когда пользователь отменил транскрипцию: сервис прекращает их обработку и не тратит минуты API.
+    # Ошибки только записываются в лог - задача в боте отменена в любом случае.
+    session = session or get_http_session()
+
+    async def cancel_job(job: list):
+        job_id = job[0]
+        credential = await credential_pool.lease_for(job[2] if len(job) > 2 else None)
+        if credential is None:
+            logger.warning(f"Нет API ключа для отмены задачи {job_id}")
+            return
+        try:
+            async with session.delete(
+                f"{credential.api_url.rstrip('/')}/{job_id}",
+                params={"force": "true"},
+                headers={"Authorization": f"Bearer {credential.api_key}"},
+            ) as response:
+                # 404 - задача уже удалена или завершилась и была удалена сервисом
+                if response.status in [200, 404]:
+                    logger.info(f"Задача Speechmatics {job_id} отменена (HTTP {response.status})")
+                else:
+                    logger.warning(f"Не удалось отменить задачу {job_id}: {response.status}, {await response.text()}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Ошибка сети при отмене задачи {job_id}: {e}")
+        finally:
+            credential.release()
+
+    await asyncio.gather(*[cancel_job(job) for job in job_ids])
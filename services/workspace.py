@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Optional, Set
+
+from config.settings import settings
+from utils.audio_processing import PCM_BYTES_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+# Папки задач в корне рабочей области: job-<uuid>
+JOB_DIR_PREFIX = "job-"
+# Папка рабочей области в /tmp или в RAM-диске (/dev/shm)
+WORKSPACE_DIR_NAME = "transcriber-bot"
+RAM_DISK_PATH = "/dev/shm"
+
+# Сколько копий аудио может лежать в папке задачи одновременно: обработанный файл, фрагменты, запись без пауз
+AUDIO_COPIES_PER_JOB = 3
+
+
+def estimate_job_bytes(file_size: Optional[int], duration: Optional[float], max_duration: Optional[float] = None) -> int:
+    # Оценка места для задачи: исходный файл и промежуточные копии аудио (не больше несжатого PCM 16 кГц).
+    # Если длительность неизвестна, копии оцениваются по наибольшей допустимой длительности max_duration:
+    # по размеру сжатого файла оценивать нельзя - несжатый PCM бывает во много раз больше.
+    file_size = file_size or 0
+    duration = duration or max_duration
+    audio_bytes = int(duration * PCM_BYTES_PER_SECOND) if duration else file_size
+    return file_size + AUDIO_COPIES_PER_JOB * audio_bytes
+
+
+class JobWorkspace:
+    # Папка одной задачи: все временные файлы задачи создаются в ней и удаляются вместе с ней
+    def __init__(self, manager: "WorkspaceManager", path: str, reserved_bytes: int):
+        self._manager = manager
+        self.path = path
+        self.reserved_bytes = reserved_bytes
+        self._closed = False
+
+    def new_file_path(self, suffix: str = "") -> str:
+        # Путь для нового временного файла в папке задачи (файл создается пустым, как NamedTemporaryFile)
+        with tempfile.NamedTemporaryFile(dir=self.path, suffix=suffix, delete=False) as temp_file:
+            return temp_file.name
+
+    async def resize(self, reserve_bytes: int):
+        # Уточнение резерва, когда стала известна длительность записи: лишнее место сразу возвращается,
+        # недостающее - ожидается так же, как при открытии задачи
+        await self._manager._resize(self, reserve_bytes)
+
+    async def close(self):
+        # Удаление папки задачи и возврат зарезервированного места
+        if self._closed:
+            return
+        self._closed = True
+        await self._manager._release(self)
+
+
+class WorkspaceManager:
+    # Рабочая область для временных файлов: папка на задачу в настраиваемом корне (по желанию - в RAM-диске),
+    # квота на суммарный объем (задачи резервируют место заранее и ждут в очереди, пока его не хватает)
+    # и удаление папок, оставшихся от аварийно завершенных задач.
+
+    def __init__(self):
+        self._root: Optional[str] = None
+        self._active: Set[str] = set()
+        # Задачи, которые ждут увеличения резерва
+        self._growing: Set[str] = set()
+        self.reserved_bytes = 0
+        self.waiting = 0
+        self._released = asyncio.Event()
+
+    @property
+    def root(self) -> str:
+        if self._root is None:
+            if settings.workspace_root:
+                root = settings.workspace_root
+            elif settings.workspace_use_ram_disk and os.path.isdir(RAM_DISK_PATH):
+                root = os.path.join(RAM_DISK_PATH, WORKSPACE_DIR_NAME)
+            else:
+                root = os.path.join(tempfile.gettempdir(), WORKSPACE_DIR_NAME)
+            os.makedirs(root, exist_ok=True)
+            self._root = root
+        return self._root
+
+    @property
+    def quota_bytes(self) -> int:
+        return settings.workspace_quota_mb * 1024 * 1024
+
+    def _fits(self, reserve_bytes: int) -> bool:
+        # Задача, которая больше всей квоты, запускается, когда рабочая область пуста (иначе она ждала бы вечно)
+        return not self.quota_bytes or not self._active or self.reserved_bytes + reserve_bytes <= self.quota_bytes
+
+    def _fits_growth(self, workspace: JobWorkspace, extra_bytes: int) -> bool:
+        # Если все задачи ждут увеличения резерва, одна из них продолжает работу (иначе они ждали бы друг друга)
+        return (
+            not self.quota_bytes
+            or self.reserved_bytes + extra_bytes <= self.quota_bytes
+            or self._active <= self._growing | {workspace.path}
+        )
+
+    async def _resize(self, workspace: JobWorkspace, reserve_bytes: int):
+        extra_bytes = reserve_bytes - workspace.reserved_bytes
+        if extra_bytes > 0 and not self._fits_growth(workspace, extra_bytes):
+            logger.info(
+                f"Рабочая область заполнена ({self.reserved_bytes / 2**20:.0f} из {settings.workspace_quota_mb} МБ), "
+                f"задача ждет еще {extra_bytes / 2**20:.0f} МБ"
+            )
+            self._growing.add(workspace.path)
+            self.waiting += 1
+            try:
+                while not self._fits_growth(workspace, extra_bytes):
+                    await self._released.wait()
+            finally:
+                self.waiting -= 1
+                self._growing.discard(workspace.path)
+        self.reserved_bytes = max(0, self.reserved_bytes + extra_bytes)
+        workspace.reserved_bytes = reserve_bytes
+        if extra_bytes < 0:
+            self._notify_released()
+
+    def _notify_released(self):
+        self._released.set()
+        self._released = asyncio.Event()
+
+    async def open_job(self, reserve_bytes: int) -> JobWorkspace:
+        # Папка для новой задачи; если квота исчерпана - ожидание, пока другие задачи не освободят место
+        if not self._fits(reserve_bytes):
+            logger.info(
+                f"Рабочая область заполнена ({self.reserved_bytes / 2**20:.0f} из {settings.workspace_quota_mb} МБ), "
+                f"задача ждет {reserve_bytes / 2**20:.0f} МБ"
+            )
+            self.waiting += 1
+            try:
+                while not self._fits(reserve_bytes):
+                    await self._released.wait()
+            finally:
+                self.waiting -= 1
+
+        path = os.path.join(self.root, f"{JOB_DIR_PREFIX}{uuid.uuid4().hex}")
+        os.makedirs(path)
+        self._active.add(path)
+        self.reserved_bytes += reserve_bytes
+        return JobWorkspace(self, path, reserve_bytes)
+
+    async def _release(self, workspace: JobWorkspace):
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, shutil.rmtree, workspace.path, True)
+        finally:
+            self._active.discard(workspace.path)
+            self.reserved_bytes = max(0, self.reserved_bytes - workspace.reserved_bytes)
+            self._notify_released()
+
+    def _sweep(self, max_age_seconds: float) -> int:
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.startswith(JOB_DIR_PREFIX) or path in self._active:
+                continue
+            try:
+                if now - os.path.getmtime(path) < max_age_seconds:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        return removed
+
+    async def sweep_orphans(self, max_age_seconds: float = 0.0) -> int:
+        # Удаление папок задач, которые не выполняются этим процессом (остались после сбоя или перезапуска).
+        # Возвращает число удаленных папок.
+        loop = asyncio.get_running_loop()
+        removed = await loop.run_in_executor(None, self._sweep, max_age_seconds)
+        if removed:
+            logger.info(f"Удалено брошенных папок задач: {removed}")
+        return removed
+
+
+# Единая рабочая область для всего приложения
+workspace_manager = WorkspaceManager()
+
+_sweeper_task: Optional[asyncio.Task] = None
+
+
+async def _sweep_periodically():
+    while True:
+        await asyncio.sleep(settings.workspace_sweep_interval_seconds)
+        try:
+            await workspace_manager.sweep_orphans(settings.workspace_orphan_age_minutes * 60)
+        except Exception as e:
+            logger.exception(f"Ошибка при очистке рабочей области: {e}")
+
+
+async def start_workspace_sweeper():
+    # При запуске удаляются все папки задач (их задачи прерваны перезапуском), затем очистка идет периодически
+    global _sweeper_task
+    await workspace_manager.sweep_orphans()
+    if _sweeper_task is None or _sweeper_task.done():
+        _sweeper_task = asyncio.create_task(_sweep_periodically())
+
+
+async def stop_workspace_sweeper():
+    global _sweeper_task
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+        try:
+            await _sweeper_task
+        except asyncio.CancelledError:
+            pass
+        _sweeper_task = None
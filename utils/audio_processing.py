@@ -1,52 +1,362 @@
 import os
+import csv
+import hashlib
+import json
+import aiofiles
+import re
+import shutil
 import subprocess
 import tempfile
 import asyncio
+import contextlib
 import logging
-from typing import Optional, Tuple
+from typing import AsyncContextManager, AsyncIterator, Callable, List, Optional, Tuple
 
-from utils.ffmpeg_utils import get_ffmpeg_path, get_ffprobe_path
+from async_lru import alru_cache
+
+from config.settings import settings
+from utils.ffmpeg_utils import communicate_or_kill, get_ffmpeg_capabilities, get_ffmpeg_path, get_ffprobe_path, get_resample_filter
+from utils.media_headers import read_header_duration, read_media_header
 
 logger = logging.getLogger(__name__)
 
+# Форматы аудио для загрузки в API: расширение файла, MIME-тип и параметры кодека FFmpeg.
+# WAV (PCM) занимает ~1.9 МБ на минуту, FLAC - примерно вдвое меньше без потерь,
+# Opus в контейнере OGG - в 5-10 раз меньше при качестве, достаточном для распознавания речи.
+# ffmpeg_format - контейнер для записи в канал (pipe) при потоковой загрузке без временного файла,
+# encoder - кодировщик, который должен быть в сборке FFmpeg (иначе используется следующий формат из UPLOAD_CODEC_FALLBACK).
+UPLOAD_CODECS = {
+    "wav": {"extension": ".wav", "content_type": "audio/wav", "ffmpeg_args": ["-c:a", "pcm_s16le"], "ffmpeg_format": "wav", "encoder": "pcm_s16le"},
+    "flac": {"extension": ".flac", "content_type": "audio/flac", "ffmpeg_args": ["-c:a", "flac", "-compression_level", "5"], "ffmpeg_format": "flac", "encoder": "flac"},
+    "opus": {"extension": ".ogg", "content_type": "audio/ogg", "ffmpeg_args": ["-c:a", "libopus", "-b:a", "32k", "-application", "voip"], "ffmpeg_format": "ogg", "encoder": "libopus"},
+}
+DEFAULT_UPLOAD_CODEC = "wav"
+# Замена формата загрузки, если в сборке FFmpeg нет его кодировщика: сначала FLAC, затем WAV (есть всегда)
+UPLOAD_CODEC_FALLBACK = ["flac", "wav"]
 
+# Сжатые форматы, которые API принимает без конвертации, по аудиокодеку (codec_name в ffprobe):
+# containers - имена контейнера в ffprobe (format_name), extensions - допустимые расширения файла,
+# ffmpeg_format/extension - контейнер, в который дорожка копируется без перекодирования (-c:a copy).
+# Несжатый PCM (WAV) сюда не входит: его выгоднее сжать в FLAC, чем загружать как есть.
+PASSTHROUGH_FORMATS = {
+    "opus": {"containers": ["ogg"], "extensions": [".ogg", ".oga", ".opus"], "ffmpeg_format": "ogg", "extension": ".ogg", "content_type": "audio/ogg"},
+    "vorbis": {"containers": ["ogg"], "extensions": [".ogg", ".oga"], "ffmpeg_format": "ogg", "extension": ".ogg", "content_type": "audio/ogg"},
+    "mp3": {"containers": ["mp3"], "extensions": [".mp3"], "ffmpeg_format": "mp3", "extension": ".mp3", "content_type": "audio/mpeg"},
+    "aac": {"containers": ["mov", "mp4", "m4a"], "extensions": [".m4a", ".mp4"], "ffmpeg_format": "ipod", "extension": ".m4a", "content_type": "audio/mp4"},
+    "flac": {"containers": ["flac"], "extensions": [".flac"], "ffmpeg_format": "flac", "extension": ".flac", "content_type": "audio/flac"},
+}
 
+# Способы подготовки файла к распознаванию: как есть, копирование дорожки в другой контейнер, перекодирование
+AUDIO_PASSTHROUGH = "passthrough"
+AUDIO_REMUX = "remux"
+AUDIO_TRANSCODE = "transcode"
 
+# Контейнеры, которые FFmpeg читает из канала (pipe) по мере скачивания, без перемотки назад.
+# У MP4/MOV/M4A индекс (moov) часто записан в конце файла, поэтому они сначала скачиваются целиком.
+STREAMABLE_INPUT_EXTENSIONS = ['.webm', '.mkv', '.ogg', '.oga', '.opus', '.mp3', '.flac', '.wav', '.aac']
+# Сколько байт скачать, прежде чем определять кодек по началу файла и запускать FFmpeg
+DOWNLOAD_PROBE_HEAD_BYTES = 256 * 1024
 
+# Размер блока при потоковом чтении файлов и вывода FFmpeg
+STREAM_CHUNK_BYTES = 64 * 1024
 
-async def get_audio_duration_async(input_file_path: str) -> float:
-    # Асинхронное получение длительности аудио/видео файла с оптимизацией использования памяти
+
+class AudioTranscodeError(Exception):
+    # FFmpeg не смог перекодировать аудио при потоковой загрузке
+    pass
+
+
+class TranscodeStatus:
+    # Итог перекодирования в поток: error задан, если FFmpeg завершился с ошибкой. Потребитель потока
+    # (загрузка в API) проверяет его сам - исключение генератора может дойти до него обернутым в ошибку клиента
+    def __init__(self):
+        self.error: Optional[str] = None
+
+
+def get_upload_codec(codec: Optional[str]) -> dict:
+    # Параметры формата загрузки; неизвестное значение заменяется на WAV
+    if codec not in UPLOAD_CODECS:
+        if codec:
+            logger.warning(f"Неизвестный формат загрузки '{codec}', используется {DEFAULT_UPLOAD_CODEC}")
+        codec = DEFAULT_UPLOAD_CODEC
+    capabilities = get_ffmpeg_capabilities()
+    if capabilities is not None and not capabilities.has_encoder(UPLOAD_CODECS[codec]["encoder"]):
+        # Сборка FFmpeg без нужного кодировщика (например, без libopus): берется первый доступный запасной формат
+        codec = next(
+            (name for name in UPLOAD_CODEC_FALLBACK if capabilities.has_encoder(UPLOAD_CODECS[name]["encoder"])),
+            DEFAULT_UPLOAD_CODEC,
+        )
+    return UPLOAD_CODECS[codec]
+
+
+def get_upload_content_type(file_path: str) -> str:
+    # MIME-тип загружаемого файла по его расширению
+    extension = os.path.splitext(file_path)[1].lower()
+    for codec in UPLOAD_CODECS.values():
+        if codec["extension"] == extension:
+            return codec["content_type"]
+    for audio_format in PASSTHROUGH_FORMATS.values():
+        if extension in audio_format["extensions"]:
+            return audio_format["content_type"]
+    return "application/octet-stream"
+
+
+class MediaInfo:
+    # Метаданные файла по одному запуску ffprobe (-print_format json) или по заголовку (utils.media_headers
+    # возвращает словарь того же вида): длительность, контейнер и дорожки.
+    # Используются и для проверки лимитов до конвертации, и для выбора способа подготовки файла.
+
+    def __init__(self, probe: dict):
+        probe_format = probe.get("format", {})
+        self.format_names: List[str] = (probe_format.get("format_name") or "").split(",")
+        self.duration = _parse_probe_float(probe_format.get("duration"))
+        self.bit_rate = int(_parse_probe_float(probe_format.get("bit_rate")))
+        self.streams: List[dict] = probe.get("streams", [])
+        self.audio_streams = [stream for stream in self.streams if stream.get("codec_type") == "audio"]
+        # Обложка альбома (attached_pic) в MP3/M4A видеодорожкой не считается
+        self.has_video = any(
+            stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic")
+            for stream in self.streams
+        )
+        first_audio = self.audio_streams[0] if self.audio_streams else {}
+        self.audio_codec: Optional[str] = first_audio.get("codec_name")
+        self.channels = int(first_audio.get("channels") or 0)
+        self.sample_rate = int(_parse_probe_float(first_audio.get("sample_rate")))
+        if not self.duration:
+            # У некоторых контейнеров длительность есть только у дорожки
+            self.duration = _parse_probe_float(first_audio.get("duration"))
+
+    @property
+    def has_audio(self) -> bool:
+        return bool(self.audio_streams)
+
+
+def _parse_probe_float(value) -> float:
+    # Числа в выводе ffprobe - строки, отсутствующее значение - "N/A"
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+@alru_cache(maxsize=settings.media_probe_cache_size)
+async def _probe_media_cached(input_file_path: str, size: int, mtime_ns: int) -> Optional[MediaInfo]:
+    # Размер и время изменения входят в ключ кэша: перезаписанный файл с тем же именем пробуется заново.
+    # WAV, FLAC и OGG разбираются по заголовку без запуска процесса, остальное - через ffprobe
+    if settings.media_header_probe_enabled:
+        loop = asyncio.get_running_loop()
+        probe = await loop.run_in_executor(None, read_media_header, input_file_path)
+        if probe is not None:
+            return MediaInfo(probe)
     try:
         process = await asyncio.create_subprocess_exec(
             get_ffprobe_path(),
-            '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'csv=p=0', input_file_path,
+            '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams',
+            input_file_path,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.DEVNULL  # Не загружаем stderr в память, так как он не используется
         )
-        
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode == 0:
-            result = stdout.decode().strip()
-            if result and result != 'N/A':
-                return float(result)
-            else:
-                logger.warning(f"Не удалось получить длительность файла {file_path}: результат не определен")
-                return 0.0
-        else:
-            logger.error(f"FFprobe duration error for file {file_path}")
-            return 0.0
+        stdout, _ = await communicate_or_kill(process)
+        if process.returncode != 0:
+            logger.error(f"FFprobe error for file {input_file_path}")
+            return None
+        return MediaInfo(json.loads(stdout.decode() or "{}"))
     except (ValueError, FileNotFoundError) as e:
-        logger.error(f"Ошибка при определении длительности файла: {e}")
-        return 0.0
+        logger.error(f"Ошибка при чтении метаданных файла {input_file_path}: {e}")
+        return None
     except Exception as e:
-        logger.error(f"Неизвестная ошибка при определении длительности файла: {e}")
-        return 0.0
+        logger.error(f"Неизвестная ошибка при чтении метаданных файла {input_file_path}: {e}")
+        return None
+
+
+async def probe_media_async(input_file_path: str) -> Optional[MediaInfo]:
+    # Метаданные аудио/видео файла (кэшируются, повторный запрос для того же файла не читает его заново).
+    # None - файл не найден или ffprobe его не распознал
+    try:
+        stat = os.stat(input_file_path)
+    except OSError as e:
+        logger.error(f"Файл {input_file_path} недоступен: {e}")
+        return None
+    return await _probe_media_cached(input_file_path, stat.st_size, stat.st_mtime_ns)
+
+
+def choose_audio_preparation(input_file_path: str, media_info: Optional[MediaInfo]) -> str:
+    # Выбор способа подготовки по таблице PASSTHROUGH_FORMATS:
+    # файл в поддерживаемом формате отправляется как есть, поддерживаемая дорожка из видео или
+    # "чужого" контейнера копируется без перекодирования, все остальное перекодируется
+    if not media_info or not media_info.has_audio:
+        return AUDIO_TRANSCODE
+    supported = PASSTHROUGH_FORMATS.get(media_info.audio_codec)
+    if supported is None:
+        return AUDIO_TRANSCODE
+    extension = os.path.splitext(input_file_path)[1].lower()
+    if (
+        not media_info.has_video
+        and len(media_info.audio_streams) == 1
+        and extension in supported["extensions"]
+        and set(media_info.format_names) & set(supported["containers"])
+    ):
+        return AUDIO_PASSTHROUGH
+    return AUDIO_REMUX
 
 
+async def remux_audio_async(input_file_path: str, audio_codec: str, work_dir: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    # Копирование первой аудиодорожки в поддерживаемый контейнер без перекодирования (-c:a copy):
+    # только чтение и запись, без декодирования. Возвращает кортеж: (путь к новому файлу, сообщение об ошибке)
+    target = PASSTHROUGH_FORMATS[audio_codec]
+    with tempfile.NamedTemporaryFile(suffix=target["extension"], dir=work_dir, delete=False) as temp_audio_file:
+        output_file_path = temp_audio_file.name
+    try:
+        process = await asyncio.create_subprocess_exec(
+            get_ffmpeg_path(),
+            '-nostdin', '-loglevel', 'error',
+            '-i', input_file_path, '-map', '0:a:0', '-c:a', 'copy',
+            '-f', target["ffmpeg_format"], output_file_path, '-y',
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await communicate_or_kill(process)
+        if process.returncode == 0:
+            return output_file_path, None
+        error_msg = stderr.decode(errors='replace') if stderr else "FFmpeg remux failed"
+        logger.error(f"FFmpeg remux error: {error_msg}")
+    except FileNotFoundError:
+        error_msg = f"FFmpeg не найден по пути: {get_ffmpeg_path()}."
+        logger.error(error_msg)
+    except Exception as e:
+        error_msg = f"Ошибка при копировании аудиодорожки: {str(e)}"
+        logger.error(error_msg)
+    await cleanup_temp_file_async(output_file_path)
+    return None, error_msg
+
+
+def can_prepare_while_downloading(extension: str) -> bool:
+    # Файл можно подавать FFmpeg по мере скачивания: контейнер читается из канала,
+    # а сам файл не будет отправлен в API как есть (иначе FFmpeg для него не нужен)
+    if extension not in STREAMABLE_INPUT_EXTENSIONS:
+        return False
+    if settings.audio_passthrough_enabled:
+        return not any(extension in audio_format["extensions"] for audio_format in PASSTHROUGH_FORMATS.values())
+    return True
+
+
+async def _feed_ffmpeg(process: asyncio.subprocess.Process, chunk: bytes) -> bool:
+    # Передача блока FFmpeg; False - FFmpeg уже завершился и вход больше не читает
+    try:
+        process.stdin.write(chunk)
+        await process.stdin.drain()
+        return True
+    except (BrokenPipeError, ConnectionResetError):
+        return False
+
+
+async def prepare_audio_while_downloading_async(
+    chunks: AsyncIterator[bytes], download_path: str, codec: str = DEFAULT_UPLOAD_CODEC, work_dir: Optional[str] = None,
+    ffmpeg_slot: Optional[Callable[[], AsyncContextManager]] = None,
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    # Подготовка аудио одновременно со скачиванием: блоки пишутся в download_path и тут же подаются FFmpeg (pipe:0).
+    # Когда скачано DOWNLOAD_PROBE_HEAD_BYTES, кодек определяется по началу файла: поддерживаемая дорожка
+    # копируется без перекодирования (-c:a copy), остальное перекодируется в формат загрузки.
+    # Файл скачивается целиком в любом случае. Возвращает кортеж: (путь к подготовленному аудио,
+    # способ подготовки, сообщение об ошибке); (None, None, None) - файл слишком мал или формат не подошел,
+    # его нужно подготовить обычным способом после скачивания.
+    # ffmpeg_slot - место в пуле FFmpeg: занимается только на время работы процесса FFmpeg,
+    # а не всего скачивания (при копировании файла как есть FFmpeg не запускается вовсе).
+    slot_stack = contextlib.AsyncExitStack()
+    process = None
+    stderr_task = None
+    output_file_path = None
+    preparation = None
+    head = []
+    head_size = 0
+    feeding = True
+    try:
+        async with aiofiles.open(download_path, "wb") as download_file:
+            async for chunk in chunks:
+                await download_file.write(chunk)
+                if process is not None:
+                    if feeding:
+                        feeding = await _feed_ffmpeg(process, chunk)
+                    continue
+                if not feeding:
+                    continue
+                head.append(chunk)
+                head_size += len(chunk)
+                if head_size < DOWNLOAD_PROBE_HEAD_BYTES:
+                    continue
 
+                await download_file.flush()
+                media_info = await probe_media_async(download_path)
+                preparation = choose_audio_preparation(download_path, media_info)
+                if media_info is None or preparation == AUDIO_PASSTHROUGH:
+                    # Кодек по началу файла не определен (или FFmpeg не нужен) - просто скачиваем
+                    feeding = False
+                    head = []
+                    continue
 
+                if preparation == AUDIO_REMUX:
+                    target = PASSTHROUGH_FORMATS[media_info.audio_codec]
+                    output_args = ['-map', '0:a:0', '-c:a', 'copy', '-f', target["ffmpeg_format"]]
+                    extension = target["extension"]
+                else:
+                    upload_codec = get_upload_codec(codec)
+                    output_args = ['-vn', '-ac', '1', '-af', get_resample_filter(16000), *upload_codec["ffmpeg_args"]]
+                    extension = upload_codec["extension"]
+                if ffmpeg_slot is not None:
+                    await slot_stack.enter_async_context(ffmpeg_slot())
+                with tempfile.NamedTemporaryFile(suffix=extension, dir=work_dir, delete=False) as temp_audio_file:
+                    output_file_path = temp_audio_file.name
+                process = await asyncio.create_subprocess_exec(
+                    get_ffmpeg_path(),
+                    '-loglevel', 'error', '-i', 'pipe:0', *output_args, output_file_path, '-y',
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                # stderr читается параллельно, чтобы FFmpeg не остановился на заполненном канале
+                stderr_task = asyncio.create_task(process.stderr.read())
+                feeding = await _feed_ffmpeg(process, b"".join(head))
+                head = []
 
+        if process is None:
+            return None, None, None
+        if feeding:
+            process.stdin.close()
+        stderr = await stderr_task
+        if await process.wait() != 0:
+            error_msg = stderr.decode(errors='replace') or "FFmpeg conversion failed"
+            logger.warning(f"FFmpeg не смог подготовить аудио во время скачивания: {error_msg}")
+            await cleanup_temp_file_async(output_file_path)
+            return None, None, error_msg
+        return output_file_path, preparation, None
+    except BaseException:
+        # Ошибка скачивания или отмена: подготовленный файл не нужен
+        if output_file_path:
+            await cleanup_temp_file_async(output_file_path)
+        raise
+    finally:
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        if stderr_task is not None and not stderr_task.done():
+            stderr_task.cancel()
+        await slot_stack.aclose()
+
+
+async def get_audio_duration_async(input_file_path: str) -> float:
+    # Длительность аудио/видео файла в секундах (0.0, если ее не удалось определить).
+    # Сначала читается заголовок файла (в том числе атом mvhd MP4/M4A), ffprobe - только если это не удалось
+    if settings.media_header_probe_enabled:
+        loop = asyncio.get_running_loop()
+        duration = await loop.run_in_executor(None, read_header_duration, input_file_path)
+        if duration:
+            return duration
+    media_info = await probe_media_async(input_file_path)
+    if media_info is None:
+        return 0.0
+    if not media_info.duration:
+        logger.warning(f"Не удалось получить длительность файла {input_file_path}: результат не определен")
+    return media_info.duration
 
 
 # === НОВЫЕ АСИНХРОННЫЕ ФУНКЦИИ ===
@@ -61,7 +371,7 @@ async def extract_audio_from_video_async(input_file_path: str, output_file_path:
             stderr=asyncio.subprocess.PIPE       # Загружаем только stderr для получения ошибок
         )
         
-        stdout, stderr = await process.communicate()
+        stdout, stderr = await communicate_or_kill(process)
         
         if process.returncode == 0:
             return True, None
@@ -79,17 +389,19 @@ async def extract_audio_from_video_async(input_file_path: str, output_file_path:
         logger.error(error_msg)
         return False, error_msg
 
-async def convert_audio_to_wav_async(input_file_path: str, output_file_path: str) -> Tuple[bool, Optional[str]]:
-    # Асинхронная конвертация аудио в WAV формат с оптимизацией использования памяти
+async def convert_audio_to_wav_async(input_file_path: str, output_file_path: str, codec: str = DEFAULT_UPLOAD_CODEC) -> Tuple[bool, Optional[str]]:
+    # Асинхронная конвертация аудио в моно 16 кГц (по умолчанию WAV, см. UPLOAD_CODECS) с оптимизацией использования памяти
     try:
         process = await asyncio.create_subprocess_exec(
             get_ffmpeg_path(),
-            '-i', input_file_path, '-ac', '1', '-ar', '16000', output_file_path, '-y',
+            '-i', input_file_path, '-ac', '1', '-af', get_resample_filter(16000),
+            *get_upload_codec(codec)["ffmpeg_args"],
+            output_file_path, '-y',
             stdout=asyncio.subprocess.DEVNULL,  # Не загружаем stdout в память
             stderr=asyncio.subprocess.PIPE       # Загружаем только stderr для получения ошибок
         )
         
-        stdout, stderr = await process.communicate()
+        stdout, stderr = await communicate_or_kill(process)
         
         if process.returncode == 0:
             return True, None
@@ -107,19 +419,19 @@ async def convert_audio_to_wav_async(input_file_path: str, output_file_path: str
         logger.error(error_msg)
         return False, error_msg
 
-async def process_file_for_transcription_async(file_path: str, is_video: bool) -> Tuple[Optional[str], Optional[str]]:
+async def process_file_for_transcription_async(file_path: str, is_video: bool, codec: str = DEFAULT_UPLOAD_CODEC, work_dir: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
     # Асинхронная обработка файла для транскрипции
     temp_audio_path = None
     temp_extracted_path = None
     
     try:
         # Создаем временный файл для обработанного аудио
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_audio_file:
+        with tempfile.NamedTemporaryFile(suffix=get_upload_codec(codec)["extension"], dir=work_dir, delete=False) as temp_audio_file:
             temp_audio_path = temp_audio_file.name
         
         if is_video:
             # Для видео сначала извлекаем аудио
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_extracted_file:
+            with tempfile.NamedTemporaryFile(suffix='.wav', dir=work_dir, delete=False) as temp_extracted_file:
                 temp_extracted_path = temp_extracted_file.name
             
             success, error_msg = await extract_audio_from_video_async(file_path, temp_extracted_path)
@@ -127,7 +439,7 @@ async def process_file_for_transcription_async(file_path: str, is_video: bool) -
                 return None, f"Не удалось извлечь аудио из видео: {error_msg}"
             
             # Затем конвертируем извлеченный аудио в нужный формат
-            success, error_msg = await convert_audio_to_wav_async(temp_extracted_path, temp_audio_path)
+            success, error_msg = await convert_audio_to_wav_async(temp_extracted_path, temp_audio_path, codec)
             if not success:
                 return None, f"Не удалось конвертировать аудио: {error_msg}"
             
@@ -136,7 +448,7 @@ async def process_file_for_transcription_async(file_path: str, is_video: bool) -
             temp_extracted_path = None
         else:
             # Для аудио сразу конвертируем в нужный формат
-            success, error_msg = await convert_audio_to_wav_async(file_path, temp_audio_path)
+            success, error_msg = await convert_audio_to_wav_async(file_path, temp_audio_path, codec)
             if not success:
                 return None, f"Не удалось конвертировать аудио: {error_msg}"
         
@@ -154,23 +466,23 @@ async def process_file_for_transcription_async(file_path: str, is_video: bool) -
         return None, f"Ошибка при обработке файла: {str(e)}"
 
 
-async def process_file_for_transcription_optimized(file_path: str, is_video: bool) -> Tuple[Optional[str], Optional[str]]:
+async def process_file_for_transcription_optimized(file_path: str, is_video: bool, codec: str = DEFAULT_UPLOAD_CODEC, work_dir: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
     # Оптимизированная асинхронная обработка файла для транскрипции с улучшенным использованием ресурсов
     temp_audio_path = None
     
     try:
         # Создаем временный файл для обработанного аудио
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_audio_file:
+        with tempfile.NamedTemporaryFile(suffix=get_upload_codec(codec)["extension"], dir=work_dir, delete=False) as temp_audio_file:
             temp_audio_path = temp_audio_file.name
         
         if is_video:
             # Для видео извлекаем аудио и конвертируем в нужный формат в одном процессе FFmpeg
-            success, error_msg = await extract_and_convert_video_async(file_path, temp_audio_path)
+            success, error_msg = await extract_and_convert_video_async(file_path, temp_audio_path, codec)
             if not success:
                 return None, f"Не удалось обработать видео: {error_msg}"
         else:
             # Для аудио сразу конвертируем в нужный формат
-            success, error_msg = await convert_audio_to_wav_async(file_path, temp_audio_path)
+            success, error_msg = await convert_audio_to_wav_async(file_path, temp_audio_path, codec)
             if not success:
                 return None, f"Не удалось конвертировать аудио: {error_msg}"
         
@@ -186,7 +498,7 @@ async def process_file_for_transcription_optimized(file_path: str, is_video: boo
         return None, f"Ошибка при обработке файла: {str(e)}"
 
 
-async def extract_and_convert_video_async(input_file_path: str, output_file_path: str) -> Tuple[bool, Optional[str]]:
+async def extract_and_convert_video_async(input_file_path: str, output_file_path: str, codec: str = DEFAULT_UPLOAD_CODEC) -> Tuple[bool, Optional[str]]:
     # Асинхронное извлечение и конвертация аудио из видео в один шаг для оптимизации
     try:
         # Объединяем извлечение аудио и конвертацию в один процесс FFmpeg для эффективности
@@ -194,8 +506,8 @@ async def extract_and_convert_video_async(input_file_path: str, output_file_path
             get_ffmpeg_path(),
             '-i', input_file_path, 
             '-ac', '1',  # моно
-            '-ar', '16000',  # частота дискретизации 16kHz
-            '-q:a', '0',  # лучшее качество аудио
+            '-af', get_resample_filter(16000),  # частота дискретизации 16kHz (ресемплер soxr, если доступен)
+            *get_upload_codec(codec)["ffmpeg_args"],  # кодек и параметры формата загрузки
             '-map', 'a',  # карта аудио дорожки
             output_file_path, 
             '-y',  # перезаписать выходной файл
@@ -203,7 +515,7 @@ async def extract_and_convert_video_async(input_file_path: str, output_file_path
             stderr=asyncio.subprocess.PIPE       # Загружаем только stderr для получения ошибок
         )
         
-        stdout, stderr = await process.communicate()
+        stdout, stderr = await communicate_or_kill(process)
         
         if process.returncode == 0:
             return True, None
@@ -221,6 +533,214 @@ async def extract_and_convert_video_async(input_file_path: str, output_file_path
         logger.error(error_msg)
         return False, error_msg
 
+# Несжатый звук для потокового распознавания: моно 16 кГц, 16 бит (little-endian)
+PCM_SAMPLE_RATE = 16000
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * 2
+
+
+async def start_pcm_decoder_async(input_file_path: str) -> asyncio.subprocess.Process:
+    # Запуск FFmpeg, который декодирует файл в PCM (s16le, моно 16 кГц) и пишет его в stdout.
+    # Данные читаются из process.stdout по мере декодирования, без промежуточного файла.
+    return await asyncio.create_subprocess_exec(
+        get_ffmpeg_path(),
+        '-nostdin', '-loglevel', 'error',
+        '-i', input_file_path, '-vn', '-ac', '1', '-af', get_resample_filter(PCM_SAMPLE_RATE),
+        '-f', 's16le', '-acodec', 'pcm_s16le', 'pipe:1',
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+
+
+async def detect_silences_async(input_file_path: str, noise_db: int = -35, min_silence_seconds: float = 0.5) -> List[Tuple[float, float]]:
+    # Поиск пауз в записи фильтром silencedetect. Возвращает список интервалов тишины (начало, конец) в секундах
+    try:
+        process = await asyncio.create_subprocess_exec(
+            get_ffmpeg_path(),
+            '-i', input_file_path,
+            '-af', f'silencedetect=noise={noise_db}dB:d={min_silence_seconds}',
+            '-f', 'null', '-',
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        stdout, stderr = await communicate_or_kill(process)
+
+        if process.returncode != 0:
+            logger.error(f"FFmpeg silencedetect error for file {input_file_path}")
+            return []
+
+        silences = []
+        silence_start = None
+        for line in stderr.decode(errors='replace').splitlines():
+            start_match = re.search(r'silence_start: (-?[\d.]+)', line)
+            if start_match:
+                silence_start = max(0.0, float(start_match.group(1)))
+                continue
+            end_match = re.search(r'silence_end: ([\d.]+)', line)
+            if end_match and silence_start is not None:
+                silences.append((silence_start, float(end_match.group(1))))
+                silence_start = None
+        return silences
+    except Exception as e:
+        logger.error(f"Ошибка при поиске пауз в файле {input_file_path}: {e}")
+        return []
+
+
+def plan_chunk_boundaries(duration: float, silences: List[Tuple[float, float]], target_chunk_seconds: float, max_shift_seconds: float) -> List[float]:
+    # Точки разреза записи: примерно через каждые target_chunk_seconds, но по возможности
+    # в середине ближайшей паузы (не дальше max_shift_seconds от целевой точки), чтобы не резать слова
+    boundaries = []
+    previous = 0.0
+    while duration - previous > target_chunk_seconds * 1.5:
+        target = previous + target_chunk_seconds
+        best_cut = None
+        for silence_start, silence_end in silences:
+            midpoint = (silence_start + silence_end) / 2
+            if midpoint <= previous or abs(midpoint - target) > max_shift_seconds:
+                continue
+            if best_cut is None or abs(midpoint - target) < abs(best_cut - target):
+                best_cut = midpoint
+        cut = round(best_cut if best_cut is not None else target, 3)
+        boundaries.append(cut)
+        previous = cut
+    return boundaries
+
+
+async def split_audio_into_chunks_async(input_file_path: str, boundaries: List[float], work_dir: Optional[str] = None) -> Tuple[List[Tuple[str, float]], Optional[str]]:
+    # Разрезает обработанную запись по точкам boundaries одним процессом FFmpeg (без перекодирования).
+    # Без перекодирования сжатый звук (MP3, OGG, M4A) режется только по границам пакетов, поэтому фрагмент
+    # начинается не точно в boundary: смещения берутся из списка сегментов FFmpeg (CSV с фактическим началом),
+    # иначе метки времени склеенного результата сдвигаются.
+    # Возвращает кортеж: (список (путь к фрагменту, смещение начала в секундах), сообщение об ошибке)
+    extension = os.path.splitext(input_file_path)[1]
+    chunks_dir = tempfile.mkdtemp(prefix='chunks_', dir=work_dir)
+    segment_list_path = os.path.join(chunks_dir, 'segments.csv')
+    try:
+        process = await asyncio.create_subprocess_exec(
+            get_ffmpeg_path(),
+            '-i', input_file_path,
+            '-f', 'segment',
+            '-segment_times', ','.join(f'{boundary:.3f}' for boundary in boundaries),
+            '-segment_list', segment_list_path,
+            '-segment_list_type', 'csv',
+            '-reset_timestamps', '1',
+            '-c', 'copy',
+            os.path.join(chunks_dir, f'chunk_%04d{extension}'), '-y',
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        stdout, stderr = await communicate_or_kill(process)
+
+        if process.returncode != 0:
+            error_msg = stderr.decode() if stderr else "FFmpeg segmentation failed"
+            logger.error(f"FFmpeg segmentation error: {error_msg}")
+            await cleanup_temp_dir_async(chunks_dir)
+            return [], error_msg
+
+        # Строки списка: имя файла фрагмента, фактическое начало и конец в исходной записи
+        async with aiofiles.open(segment_list_path, 'r', newline='') as segment_list:
+            rows = list(csv.reader((await segment_list.read()).splitlines()))
+        chunks = [
+            (os.path.join(chunks_dir, os.path.basename(row[0])), float(row[1]))
+            for row in rows if len(row) >= 2
+        ]
+        if not chunks:
+            await cleanup_temp_dir_async(chunks_dir)
+            return [], "FFmpeg segmentation produced no segments"
+        return chunks, None
+    except Exception as e:
+        error_msg = f"Ошибка при разрезании аудио на фрагменты: {str(e)}"
+        logger.error(error_msg)
+        await cleanup_temp_dir_async(chunks_dir)
+        return [], error_msg
+
+
+async def split_for_transcription_async(file_path: str, duration: float, work_dir: Optional[str] = None) -> Tuple[List[Tuple[str, float]], Optional[str]]:
+    # Подготовка длинной записи к параллельной транскрипции: поиск пауз и разрезание на фрагменты.
+    # Короткие записи не режутся - возвращается пустой список
+    if duration < settings.chunked_transcription_min_duration_seconds:
+        return [], None
+
+    silences = await detect_silences_async(
+        file_path, settings.chunk_silence_noise_db, settings.chunk_silence_min_seconds
+    )
+    boundaries = plan_chunk_boundaries(
+        duration, silences, settings.chunk_target_duration_seconds, settings.chunk_max_boundary_shift_seconds
+    )
+    if not boundaries:
+        return [], None
+    return await split_audio_into_chunks_async(file_path, boundaries, work_dir)
+
+
+def _compute_file_hash(file_path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+async def compute_file_hash_async(file_path: str) -> Optional[str]:
+    # SHA-256 содержимого файла (чтение в пуле потоков, чтобы не блокировать цикл событий)
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, _compute_file_hash, file_path)
+    except OSError as e:
+        logger.warning(f"Не удалось вычислить хэш файла {file_path}: {e}")
+        return None
+
+
+async def iter_file_chunks_async(file_path: str, chunk_size: int = STREAM_CHUNK_BYTES) -> AsyncIterator[bytes]:
+    # Асинхронное чтение файла блоками (для загрузки без блокирующего open() в цикле событий)
+    async with aiofiles.open(file_path, "rb") as file:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def iter_transcoded_audio_async(input_file_path: str, codec: str = DEFAULT_UPLOAD_CODEC,
+                                      chunk_size: int = STREAM_CHUNK_BYTES,
+                                      status: Optional[TranscodeStatus] = None) -> AsyncIterator[bytes]:
+    # Перекодирование в формат загрузки (моно 16 кГц) с выдачей результата по мере работы FFmpeg:
+    # вывод идет в канал (pipe:1), временный файл не создается, загрузка идет одновременно с перекодированием.
+    # Ошибка FFmpeg после чтения всего вывода записывается в status и выдается исключением AudioTranscodeError.
+    upload_codec = get_upload_codec(codec)
+    process = await asyncio.create_subprocess_exec(
+        get_ffmpeg_path(),
+        '-nostdin', '-loglevel', 'error',
+        '-i', input_file_path, '-vn', '-ac', '1', '-af', get_resample_filter(16000),
+        *upload_codec["ffmpeg_args"],
+        '-f', upload_codec["ffmpeg_format"], 'pipe:1',
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    # stderr читается параллельно, чтобы FFmpeg не остановился на заполненном канале
+    stderr_task = asyncio.create_task(process.stderr.read())
+    try:
+        while True:
+            chunk = await process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        stderr = await stderr_task
+        if await process.wait() != 0:
+            error_msg = stderr.decode(errors="replace") or "FFmpeg conversion failed"
+            logger.error(f"FFmpeg streaming conversion error: {error_msg}")
+            if status is not None:
+                status.error = error_msg
+            raise AudioTranscodeError(error_msg)
+    finally:
+        # Загрузка прервана (ошибка сети, отмена) - останавливаем FFmpeg
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        if not stderr_task.done():
+            stderr_task.cancel()
+
+
 def get_file_size(file_path: str) -> int:
     # Получение размера файла в байтах
     try:
@@ -236,4 +756,14 @@ async def cleanup_temp_file_async(file_path: str):
             loop = asyncio.get_running_loop()
             await loop.run_in_executor(None, os.unlink, file_path)
     except Exception as e:
-        logger.warning(f"Ошибка при удалении временного файла {file_path}: {e}")
\ No newline at end of file
+        logger.warning(f"Ошибка при удалении временного файла {file_path}: {e}")
+
+
+async def cleanup_temp_dir_async(dir_path: str):
+    # Асинхронное удаление временной папки вместе с содержимым
+    try:
+        if dir_path and os.path.isdir(dir_path):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, shutil.rmtree, dir_path, True)
+    except Exception as e:
+        logger.warning(f"Ошибка при удалении временной папки {dir_path}: {e}")
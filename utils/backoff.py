@@ -0,0 +1,48 @@
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from config.settings import settings
+
+
+def compute_initial_poll_interval(audio_duration: float) -> float:
+    # Начальный интервал опроса: короткие записи проверяем почти сразу,
+    # длинные - реже, так как их обработка заведомо займет больше времени
+    interval = (audio_duration or 0.0) * settings.speechmatics_poll_interval_per_audio_second
+    return min(
+        max(interval, settings.speechmatics_poll_min_interval_seconds),
+        settings.speechmatics_poll_max_interval_seconds,
+    )
+
+
+def next_poll_interval(current_interval: float) -> float:
+    # Экспоненциальное увеличение интервала с ограничением сверху
+    return min(
+        current_interval * settings.speechmatics_poll_backoff_factor,
+        settings.speechmatics_poll_max_interval_seconds,
+    )
+
+
+def apply_jitter(interval: float) -> float:
+    # Случайное отклонение интервала, чтобы запросы разных задач не совпадали по времени
+    jitter = settings.speechmatics_poll_jitter
+    return max(0.0, interval * random.uniform(1 - jitter, 1 + jitter))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # Разбор заголовка Retry-After: число секунд или HTTP-дата
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -1,16 +1,30 @@
+import asyncio
+import functools
+import logging
 import os
 import platform
+import re
+from typing import Optional, Set
 
+logger = logging.getLogger(__name__)
 
+# Фильтры, без которых обработка не работает: нарезка по паузам, поиск речи, удаление пауз
+REQUIRED_FILTERS = ("aresample", "silencedetect", "aselect", "asetnsamples", "asetpts")
+# Кодировщик, который есть в любой сборке FFmpeg (WAV) - последний вариант формата загрузки
+REQUIRED_ENCODERS = ("pcm_s16le",)
+
+
+@functools.lru_cache(maxsize=None)
 def get_ffmpeg_path():
     # Получение пути к исполняемому файлу FFmpeg в зависимости от операционной системы
+    # (определяется один раз за время работы процесса)
     system = platform.system().lower()
-    
+
     if system == "windows":
         ffmpeg_path = os.path.join("bin", "windows", "ffmpeg", "bin", "ffmpeg.exe")
     else:  # linux или другие Unix-системы
         ffmpeg_path = os.path.join("bin", "linux", "ffmpeg", "bin", "ffmpeg")
-    
+
     # Если файл существует, возвращаем его абсолютный путь
     if os.path.exists(ffmpeg_path):
         return os.path.abspath(ffmpeg_path)
@@ -20,19 +34,145 @@ def get_ffmpeg_path():
         return "ffmpeg"
 
 
+@functools.lru_cache(maxsize=None)
 def get_ffprobe_path():
     # Получение пути к исполняемому файлу ffprobe в зависимости от операционной системы
+    # (определяется один раз за время работы процесса)
     system = platform.system().lower()
-    
+
     if system == "windows":
         ffprobe_path = os.path.join("bin", "windows", "ffmpeg", "bin", "ffprobe.exe")
     else:  # linux или другие Unix-системы
         ffprobe_path = os.path.join("bin", "linux", "ffmpeg", "bin", "ffprobe")
-    
+
     # Если файл существует, возвращаем его абсолютный путь
     if os.path.exists(ffprobe_path):
         return os.path.abspath(ffprobe_path)
     else:
         # Если локальный файл не найден, возвращаем просто имя исполняемого файла
         # и надеемся, что он доступен в PATH
-        return "ffprobe"
\ No newline at end of file
+        return "ffprobe"
+
+
+class FFmpegCapabilities:
+    # Возможности установленной сборки FFmpeg: версия, кодировщики, декодеры и фильтры
+    def __init__(self, version: str, configuration: str, encoders: Set[str], decoders: Set[str], filters: Set[str]):
+        self.version = version
+        self.configuration = configuration
+        self.encoders = encoders
+        self.decoders = decoders
+        self.filters = filters
+
+    def has_encoder(self, name: str) -> bool:
+        return name in self.encoders
+
+    def has_decoder(self, name: str) -> bool:
+        return name in self.decoders
+
+    def has_filter(self, name: str) -> bool:
+        return name in self.filters
+
+    @property
+    def soxr_available(self) -> bool:
+        # Ресемплер SoX (libsoxr) быстрее встроенного swr при том же качестве
+        return "--enable-libsoxr" in self.configuration
+
+
+# Результат проверки FFmpeg при запуске бота (None - проверка не выполнялась, например в процессах-исполнителях)
+_capabilities: Optional[FFmpegCapabilities] = None
+
+
+def get_ffmpeg_capabilities() -> Optional[FFmpegCapabilities]:
+    return _capabilities
+
+
+def get_resample_filter(sample_rate: int) -> str:
+    # Фильтр передискретизации: ресемплер SoX, если сборка FFmpeg его поддерживает, иначе встроенный
+    if _capabilities is not None and _capabilities.soxr_available:
+        return f"aresample={sample_rate}:resampler=soxr"
+    return f"aresample={sample_rate}"
+
+
+async def communicate_or_kill(process: asyncio.subprocess.Process, input: Optional[bytes] = None):
+    # process.communicate(); если задачу отменили (пользователь нажал "Отмена"), процесс FFmpeg
+    # завершается сразу, а не дорабатывает впустую до конца файла
+    try:
+        return await process.communicate(input)
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+
+
+async def _run_for_output(path: str, *args: str) -> str:
+    process = await asyncio.create_subprocess_exec(
+        path, '-hide_banner', *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"{path} {' '.join(args)} завершился с кодом {process.returncode}: {stderr.decode(errors='replace')}")
+    return stdout.decode(errors='replace')
+
+
+def _parse_codecs(output: str) -> Set[str]:
+    # Вывод -encoders/-decoders: после строки " ------" идут строки "флаги имя описание"
+    names = set()
+    started = False
+    for line in output.splitlines():
+        if line.strip().startswith("------"):
+            started = True
+            continue
+        parts = line.split()
+        if started and len(parts) >= 2:
+            names.add(parts[1])
+    return names
+
+
+def _parse_filters(output: str) -> Set[str]:
+    # Вывод -filters: строки "флаги имя входы->выходы описание"
+    names = set()
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and "->" in parts[2]:
+            names.add(parts[1])
+    return names
+
+
+async def probe_ffmpeg_capabilities_async() -> FFmpegCapabilities:
+    # Проверка FFmpeg и ffprobe при запуске бота: оба запускаются, версия, кодировщики, декодеры
+    # и фильтры сохраняются для выбора форматов. Если FFmpeg не найден или в сборке нет нужных фильтров,
+    # выбрасывается RuntimeError - бот не запускается, вместо ошибки на первом файле пользователя.
+    global _capabilities
+    ffmpeg_path = get_ffmpeg_path()
+    ffprobe_path = get_ffprobe_path()
+    try:
+        version_output = await _run_for_output(ffmpeg_path, '-version')
+        await _run_for_output(ffprobe_path, '-version')
+        encoders = _parse_codecs(await _run_for_output(ffmpeg_path, '-encoders'))
+        decoders = _parse_codecs(await _run_for_output(ffmpeg_path, '-decoders'))
+        filters = _parse_filters(await _run_for_output(ffmpeg_path, '-filters'))
+    except FileNotFoundError as e:
+        raise RuntimeError(f"FFmpeg или ffprobe не найден ({ffmpeg_path}, {ffprobe_path}): {e}")
+
+    version_match = re.search(r"version (\S+)", version_output)
+    configuration_match = re.search(r"^configuration: (.*)$", version_output, re.MULTILINE)
+    capabilities = FFmpegCapabilities(
+        version_match.group(1) if version_match else "unknown",
+        configuration_match.group(1) if configuration_match else "",
+        encoders, decoders, filters,
+    )
+
+    missing = [name for name in REQUIRED_FILTERS if not capabilities.has_filter(name)]
+    missing += [name for name in REQUIRED_ENCODERS if not capabilities.has_encoder(name)]
+    if missing:
+        raise RuntimeError(f"В сборке FFmpeg {capabilities.version} нет необходимых компонентов: {', '.join(missing)}")
+
+    _capabilities = capabilities
+    logger.info(
+        f"FFmpeg {capabilities.version} ({ffmpeg_path}): кодировщиков {len(encoders)}, декодеров {len(decoders)}, "
+        f"фильтров {len(filters)}, ресемплер {'soxr' if capabilities.soxr_available else 'swr'}"
+    )
+    return capabilities
@@ -0,0 +1,252 @@
+import os
+import struct
+from typing import BinaryIO, Optional
+
+# Чтение метаданных из заголовков распространенных форматов без запуска ffprobe:
+# WAV (fmt/data), FLAC (STREAMINFO), OGG Opus/Vorbis (заголовок потока и гранула последней страницы)
+# и длительность MP4/M4A/MOV (атом mvhd). Результат - словарь в формате вывода ffprobe
+# (format/streams), чтобы из него строился тот же MediaInfo. Все, что разобрать не удалось
+# (неизвестный формат, поврежденный или необычный заголовок), возвращает None - тогда используется ffprobe.
+
+# Сколько байт с конца файла OGG читать в поисках последней страницы (страница не больше ~64 КиБ)
+OGG_TAIL_BYTES = 64 * 1024
+# Сколько страниц в начале OGG просматривать в поисках заголовков других потоков (видео, субтитры)
+OGG_MAX_HEADER_PAGES = 16
+# Сколько атомов верхнего уровня MP4 просматривать в поисках moov
+MP4_MAX_TOP_LEVEL_ATOMS = 64
+
+# Кодек несжатого WAV по (формату, разрядности): 1 - целочисленный PCM, 3 - PCM с плавающей точкой
+WAV_PCM_CODECS = {
+    (1, 8): "pcm_u8",
+    (1, 16): "pcm_s16le",
+    (1, 24): "pcm_s24le",
+    (1, 32): "pcm_s32le",
+    (3, 32): "pcm_f32le",
+    (3, 64): "pcm_f64le",
+}
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Частота гранул Opus не зависит от исходной частоты записи
+OPUS_GRANULE_RATE = 48000
+
+
+def _probe_result(format_name: str, duration: float, codec_name: str, channels: int, sample_rate: int) -> Optional[dict]:
+    if duration <= 0 or channels <= 0 or sample_rate <= 0:
+        return None
+    return {
+        "format": {"format_name": format_name, "duration": f"{duration:.6f}"},
+        "streams": [{
+            "index": 0,
+            "codec_type": "audio",
+            "codec_name": codec_name,
+            "channels": channels,
+            "sample_rate": str(sample_rate),
+            "duration": f"{duration:.6f}",
+        }],
+    }
+
+
+def _skip_id3(file: BinaryIO) -> int:
+    # Смещение после тега ID3v2, который иногда пишут перед FLAC (размер - 4 байта по 7 бит)
+    header = file.read(10)
+    if len(header) == 10 and header[:3] == b"ID3":
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        footer = 10 if header[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _read_wav(file: BinaryIO, file_size: int) -> Optional[dict]:
+    header = file.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return None
+    fmt = None
+    while True:
+        chunk_header = file.read(8)
+        if len(chunk_header) < 8:
+            return None
+        chunk_id, chunk_size = chunk_header[:4], struct.unpack("<I", chunk_header[4:])[0]
+        if chunk_id == b"fmt ":
+            fmt = file.read(chunk_size)
+            if len(fmt) < 16:
+                return None
+            if chunk_size % 2:
+                file.seek(1, os.SEEK_CUR)
+        elif chunk_id == b"data":
+            break
+        else:
+            # Чанки выровнены по 2 байта
+            file.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+    if fmt is None:
+        return None
+
+    audio_format, channels, sample_rate, byte_rate, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if audio_format == WAVE_FORMAT_EXTENSIBLE:
+        if len(fmt) < 26:
+            return None
+        # Первые 2 байта GUID подформата совпадают с кодом формата
+        audio_format = struct.unpack("<H", fmt[24:26])[0]
+    codec_name = WAV_PCM_CODECS.get((audio_format, bits))
+    if codec_name is None or not byte_rate:
+        return None
+
+    data_offset = file.tell()
+    # FFmpeg, пишущий WAV в канал, оставляет размер data пустым или максимальным - тогда данные идут до конца файла
+    if chunk_size in (0, 0xFFFFFFFF) or data_offset + chunk_size > file_size:
+        chunk_size = file_size - data_offset
+    return _probe_result("wav", chunk_size / byte_rate, codec_name, channels, sample_rate)
+
+
+def _read_flac(file: BinaryIO) -> Optional[dict]:
+    file.seek(_skip_id3(file))
+    if file.read(4) != b"fLaC":
+        return None
+    block_header = file.read(4)
+    # Первый блок метаданных всегда STREAMINFO (тип 0, 34 байта)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0:
+        return None
+    streaminfo = file.read(34)
+    if len(streaminfo) < 34:
+        return None
+    # Байты 10-17: частота (20 бит), каналы - 1 (3 бита), разрядность - 1 (5 бит), число отсчетов (36 бит)
+    packed = int.from_bytes(streaminfo[10:18], "big")
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        return None
+    return _probe_result("flac", total_samples / sample_rate, "flac", channels, sample_rate)
+
+
+def _ogg_page(data: bytes, offset: int):
+    # Заголовок страницы OGG по смещению: (тип, гранула, серийный номер, смещение тела, длина тела) или None
+    if data[offset:offset + 4] != b"OggS" or len(data) < offset + 27:
+        return None
+    header_type = data[offset + 5]
+    granule, serial = struct.unpack("<qI", data[offset + 6:offset + 18])
+    segments = data[offset + 26]
+    body_offset = offset + 27 + segments
+    if len(data) < body_offset:
+        return None
+    return header_type, granule, serial, body_offset, sum(data[offset + 27:body_offset])
+
+
+def _read_ogg(file: BinaryIO, file_size: int) -> Optional[dict]:
+    head = file.read(OGG_TAIL_BYTES)
+    page = _ogg_page(head, 0)
+    if page is None:
+        return None
+    header_type, _, serial, body_offset, body_length = page
+    body = head[body_offset:body_offset + body_length]
+
+    if body[:8] == b"OpusHead" and len(body) >= 19:
+        codec_name = "opus"
+        channels = body[9]
+        pre_skip = struct.unpack("<H", body[10:12])[0]
+        sample_rate = OPUS_GRANULE_RATE
+    elif body[:7] == b"\x01vorbis" and len(body) >= 16:
+        codec_name = "vorbis"
+        channels = body[11]
+        sample_rate = struct.unpack("<I", body[12:16])[0]
+        pre_skip = 0
+    else:
+        return None
+
+    # Другие потоки (видео, второй звук) начинаются своими BOS-страницами сразу за первой
+    offset = body_offset + body_length
+    for _ in range(OGG_MAX_HEADER_PAGES):
+        page = _ogg_page(head, offset)
+        if page is None:
+            break
+        if page[0] & 0x02:
+            return None
+        if page[2] == serial and page[1] > 0:
+            break
+        offset = page[3] + page[4]
+
+    # Длительность - гранула последней страницы потока (в конце файла)
+    tail_offset = max(0, file_size - OGG_TAIL_BYTES)
+    file.seek(tail_offset)
+    tail = file.read(OGG_TAIL_BYTES)
+    position = tail.rfind(b"OggS")
+    while position >= 0:
+        page = _ogg_page(tail, position)
+        if page is not None and page[2] == serial and page[1] > 0:
+            return _probe_result("ogg", (page[1] - pre_skip) / sample_rate, codec_name, channels, sample_rate)
+        position = tail.rfind(b"OggS", 0, position)
+    return None
+
+
+def _read_mp4_duration(file: BinaryIO, file_size: int) -> Optional[float]:
+    # Атомы верхнего уровня просматриваются с перемоткой (mdat не читается), внутри moov ищется mvhd
+    position = 0
+    for _ in range(MP4_MAX_TOP_LEVEL_ATOMS):
+        if position + 8 > file_size:
+            return None
+        file.seek(position)
+        header = file.read(16)
+        size, atom_type = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - position
+        if size < header_size:
+            return None
+        if atom_type == b"moov":
+            return _read_mvhd(file, position + header_size, position + size)
+        if position == 0 and atom_type != b"ftyp":
+            return None
+        position += size
+    return None
+
+
+def _read_mvhd(file: BinaryIO, start: int, end: int) -> Optional[float]:
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        size, atom_type = struct.unpack(">I4s", file.read(8))
+        if size < 8:
+            return None
+        if atom_type == b"mvhd":
+            version = file.read(4)[0]
+            if version == 1:
+                timescale, duration = struct.unpack(">IQ", file.read(28)[16:28])
+            else:
+                timescale, duration = struct.unpack(">II", file.read(16)[8:16])
+            return duration / timescale if timescale and duration else None
+        position += size
+    return None
+
+
+def read_media_header(file_path: str) -> Optional[dict]:
+    # Метаданные файла WAV, FLAC или OGG (Opus/Vorbis) по заголовку в формате вывода ffprobe;
+    # None - формат не поддерживается или заголовок не удалось разобрать
+    try:
+        file_size = os.path.getsize(file_path)
+        with open(file_path, "rb") as file:
+            magic = file.read(4)
+            file.seek(0)
+            if magic == b"RIFF":
+                return _read_wav(file, file_size)
+            if magic == b"OggS":
+                return _read_ogg(file, file_size)
+            if magic in (b"fLaC", b"ID3\x02", b"ID3\x03", b"ID3\x04"):
+                return _read_flac(file)
+    except (OSError, struct.error, IndexError):
+        return None
+    return None
+
+
+def read_header_duration(file_path: str) -> Optional[float]:
+    # Длительность в секундах по заголовку (WAV, FLAC, OGG, MP4/M4A/MOV); None - нужен ffprobe
+    probe = read_media_header(file_path)
+    if probe is not None:
+        return float(probe["format"]["duration"])
+    try:
+        file_size = os.path.getsize(file_path)
+        with open(file_path, "rb") as file:
+            return _read_mp4_duration(file, file_size)
+    except (OSError, struct.error, IndexError):
+        return None
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import zlib
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+# Форматы, в которых можно получить результат транскрипции
+TRANSCRIPT_FORMATS = ("txt", "srt", "vtt", "json")
+DEFAULT_TRANSCRIPT_FORMAT = "txt"
+
+# Признаки присоединения знака препинания к соседним словам (без пробела)
+ATTACH_PREVIOUS = 1
+ATTACH_NEXT = 2
+
+# Ограничения одного субтитра
+SUBTITLE_MAX_DURATION_MS = 7000
+SUBTITLE_MAX_CHARS = 84
+SENTENCE_END_MARKS = (".", "?", "!", "…")
+
+# Сколько отрисованных результатов держать в памяти (повторные выгрузки из истории)
+RENDER_CACHE_MAX_ENTRIES = 32
+
+PACK_VERSION = 1
+
+# Элемент транскрипции: (начало в мс, конец в мс, текст, признаки присоединения)
+TranscriptItem = Tuple[int, int, str, int]
+
+
+def _attach_flags(item: dict) -> int:
+    if item.get("type") != "punctuation":
+        return 0
+    attaches_to = item.get("attaches_to", "previous")
+    flags = 0
+    if attaches_to in ("previous", "both"):
+        flags |= ATTACH_PREVIOUS
+    if attaches_to in ("next", "both"):
+        flags |= ATTACH_NEXT
+    return flags
+
+
+def _format_timestamp(ms: int, separator: str) -> str:
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{ms:03d}"
+
+
+class Transcript:
+    # Результат транскрипции в компактном виде: слова и знаки препинания с метками времени.
+    # Текст, субтитры и JSON строятся из него по запросу.
+
+    __slots__ = ("items",)
+
+    def __init__(self, items: Optional[List[TranscriptItem]] = None):
+        self.items = items if items is not None else []
+
+    @classmethod
+    def from_speechmatics(cls, result_data: dict, offset: float = 0.0) -> "Transcript":
+        # Разбор результата Speechmatics (json-v2); offset - начало фрагмента в исходной записи, в секундах
+        offset_ms = int(round(offset * 1000))
+        items = []
+        for item in result_data.get("results", []):
+            alternatives = item.get("alternatives") or [{}]
+            content = alternatives[0].get("content", "")
+            if not content:
+                continue
+            items.append((
+                int(round(item.get("start_time", 0.0) * 1000)) + offset_ms,
+                int(round(item.get("end_time", 0.0) * 1000)) + offset_ms,
+                content,
+                _attach_flags(item),
+            ))
+        return cls(items)
+
+    def extend(self, other: "Transcript"):
+        self.items.extend(other.items)
+
+    def remap_times(self, convert: Callable[[int], int]):
+        # Пересчет меток времени (например, из записи без пауз обратно в исходную)
+        self.items = [(convert(start), convert(end), text, flags) for start, end, text, flags in self.items]
+
+    def pack(self) -> bytes:
+        # Сжатое представление для хранения в базе
+        payload = json.dumps({"v": PACK_VERSION, "items": self.items}, ensure_ascii=False, separators=(",", ":"))
+        return zlib.compress(payload.encode("utf-8"))
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "Transcript":
+        payload = json.loads(zlib.decompress(data).decode("utf-8"))
+        return cls([tuple(item) for item in payload.get("items", [])])
+
+    def _join(self, items: List[TranscriptItem]) -> str:
+        parts = []
+        glue_next = True
+        for _, _, content, flags in items:
+            if parts and not glue_next and not flags & ATTACH_PREVIOUS:
+                parts.append(" ")
+            parts.append(content)
+            glue_next = bool(flags & ATTACH_NEXT)
+        return "".join(parts)
+
+    def to_text(self) -> str:
+        return self._join(self.items).strip()
+
+    def _cues(self) -> List[Tuple[int, int, str]]:
+        # Деление на субтитры: по концу предложения, длительности и длине строки
+        cues = []
+        current: List[TranscriptItem] = []
+        length = 0
+        for item in self.items:
+            start, end, content, flags = item
+            if current and not flags & ATTACH_PREVIOUS and (
+                end - current[0][0] > SUBTITLE_MAX_DURATION_MS or length + len(content) + 1 > SUBTITLE_MAX_CHARS
+            ):
+                cues.append((current[0][0], current[-1][1], self._join(current)))
+                current, length = [], 0
+            current.append(item)
+            length += len(content) + 1
+            if flags & ATTACH_PREVIOUS and content.endswith(SENTENCE_END_MARKS):
+                cues.append((current[0][0], current[-1][1], self._join(current)))
+                current, length = [], 0
+        if current:
+            cues.append((current[0][0], current[-1][1], self._join(current)))
+        return cues
+
+    def to_srt(self) -> str:
+        blocks = [
+            f"{index}\n{_format_timestamp(start, ',')} --> {_format_timestamp(end, ',')}\n{text}\n"
+            for index, (start, end, text) in enumerate(self._cues(), start=1)
+        ]
+        return "\n".join(blocks)
+
+    def to_vtt(self) -> str:
+        blocks = [
+            f"{_format_timestamp(start, '.')} --> {_format_timestamp(end, '.')}\n{text}\n"
+            for start, end, text in self._cues()
+        ]
+        return "WEBVTT\n\n" + "\n".join(blocks)
+
+    def to_json(self) -> str:
+        words = [
+            {
+                "start": start / 1000,
+                "end": end / 1000,
+                "content": content,
+                "type": "punctuation" if flags else "word",
+            }
+            for start, end, content, flags in self.items
+        ]
+        return json.dumps({"text": self.to_text(), "items": words}, ensure_ascii=False, indent=1)
+
+    def render(self, fmt: str) -> str:
+        if fmt == "srt":
+            return self.to_srt()
+        if fmt == "vtt":
+            return self.to_vtt()
+        if fmt == "json":
+            return self.to_json()
+        return self.to_text()
+
+
+def parse_speechmatics_response(body: bytes, offset: float = 0.0) -> Transcript:
+    # Тело ответа читается один раз и разбирается сразу в компактную модель
+    return Transcript.from_speechmatics(json.loads(body), offset)
+
+
+async def parse_speechmatics_response_async(body: bytes, offset: float = 0.0) -> Transcript:
+    # Разбор многочасовых результатов в пуле потоков, чтобы не блокировать цикл событий
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, parse_speechmatics_response, body, offset)
+
+
+def _render_packed(data: bytes, fmt: str) -> str:
+    return Transcript.unpack(data).render(fmt)
+
+
+async def render_packed_transcript_async(data: bytes, fmt: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _render_packed, data, fmt)
+
+
+async def render_transcript_async(transcript: Transcript, fmt: str = DEFAULT_TRANSCRIPT_FORMAT) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, transcript.render, fmt)
+
+
+async def pack_transcript_async(transcript: Transcript, time_map=None) -> Tuple[str, bytes]:
+    # Плоский текст и сжатое представление для сохранения в базе.
+    # time_map (utils/voice_activity.TimeMap) - метки времени записи без пауз переводятся в исходную запись
+    loop = asyncio.get_running_loop()
+    if time_map is not None:
+        await loop.run_in_executor(None, transcript.remap_times, time_map.to_original_ms)
+    text = await loop.run_in_executor(None, transcript.to_text)
+    data = await loop.run_in_executor(None, transcript.pack)
+    return text, data
+
+
+_render_cache: "OrderedDict[Tuple[int, int, str], str]" = OrderedDict()
+
+
+async def render_stored_transcript_async(transcription_id: int, data: bytes, fmt: str) -> str:
+    # Отрисовка сохраненной транскрипции в нужном формате с кэшированием последних результатов.
+    # Контрольная сумма в ключе не дает отдать чужой результат, если ID удаленной записи занят заново.
+    key = (transcription_id, zlib.crc32(data), fmt)
+    cached = _render_cache.get(key)
+    if cached is not None:
+        _render_cache.move_to_end(key)
+        return cached
+    loop = asyncio.get_running_loop()
+    rendered = await loop.run_in_executor(None, _render_packed, data, fmt)
+    _render_cache[key] = rendered
+    while len(_render_cache) > RENDER_CACHE_MAX_ENTRIES:
+        _render_cache.popitem(last=False)
+    return rendered
@@ -107,9 +107,34 @@ class InputValidator:
             return InputValidationResult(False, None, get_text("validation_api_key_invalid_characters", lang))
         
         return InputValidationResult(True, api_key, None)
+
+    @staticmethod
+    def validate_api_credential_input(input_str: str, lang: str) -> InputValidationResult:
+        # Валидирует ввод ключа для пула: "КЛЮЧ [АДРЕС_API] [АДРЕС_REALTIME] [ЛИМИТ_ЗАДАЧ]"
+        # Возвращает кортеж (ключ, адрес или None, лимит или None, адрес Realtime API или None)
+        parts = (input_str or "").split()
+        key_result = InputValidator.validate_api_key(parts[0] if parts else "", lang)
+        if not key_result.is_valid:
+            return key_result
+
+        api_url = None
+        realtime_url = None
+        max_jobs = None
+        for part in parts[1:]:
+            if re.match(r'^https?://[^\s<>"]+$', part) and api_url is None:
+                api_url = part
+            elif re.match(r'^wss?://[^\s<>"]+$', part) and realtime_url is None:
+                realtime_url = part
+            elif part.isdigit() and max_jobs is None:
+                max_jobs = int(part) or None
+            else:
+                return InputValidationResult(False, None, get_text("validation_api_credential_invalid", lang))
+
+        return InputValidationResult(True, (key_result.value, api_url, max_jobs, realtime_url), None)
     
 
     @staticmethod
     def validate_audio_duration_input(input_str: str, lang: str) -> InputValidationResult:
         # Валидирует продолжительность аудио (в минутах)
-        return InputValidator.validate_integer_input(input_str, lang, min_value=1, max_value=120)
\ No newline at end of file
+        # Длинные записи обрабатываются параллельно по фрагментам, поэтому допускаем до 10 часов
+        return InputValidator.validate_integer_input(input_str, lang, min_value=1, max_value=600)
\ No newline at end of file
@@ -0,0 +1,230 @@
+import bisect
+import json
+import logging
+import tempfile
+import asyncio
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import settings
+from utils.audio_processing import (
+    PCM_SAMPLE_RATE,
+    cleanup_temp_file_async,
+    get_upload_codec,
+    start_pcm_decoder_async,
+)
+from utils.ffmpeg_utils import communicate_or_kill, get_ffmpeg_path, get_resample_filter
+
+logger = logging.getLogger(__name__)
+
+# Анализ идет кадрами по 30 мс (480 отсчетов при 16 кГц)
+VAD_FRAME_SECONDS = 0.03
+VAD_FRAME_SAMPLES = int(PCM_SAMPLE_RATE * VAD_FRAME_SECONDS)
+# PCM читается из FFmpeg блоками по ~10 с (целое число кадров)
+VAD_READ_BYTES = VAD_FRAME_SAMPLES * 2 * 333
+
+# Доля смен знака в кадре: у шипящих согласных (с, ш, ф) она высокая при небольшой энергии,
+# у широкополосного шума (шипение, ветер) - еще выше
+VAD_FRICATIVE_ZCR = 0.15
+VAD_NOISE_ZCR = 0.45
+# Шипящие считаются речью даже на столько дБ ниже порога энергии
+VAD_FRICATIVE_MARGIN_DB = 6.0
+# Паузы короче этой длительности внутри фразы не разрывают отрезок речи
+VAD_MERGE_GAP_SECONDS = 0.3
+
+# Шаг сетки, по которой режется запись: FFmpeg выбирает кадры по 10 мс (asetnsamples),
+# поэтому границы отрезков, округленные до этого шага, совпадают с границами кадров
+TRIM_GRID_SECONDS = 0.01
+# Наибольшее число оставляемых отрезков: фильтр aselect проверяет каждое условие between() для каждого кадра,
+# поэтому при большем числе отрезков удаляются только самые длинные паузы
+TRIM_MAX_SEGMENTS = 64
+
+
+class VoiceActivity:
+    # Результат поиска речи: отрезки (начало, конец) в секундах и длительность записи
+    def __init__(self, segments: List[Tuple[float, float]], duration: float):
+        self.segments = segments
+        self.duration = duration
+
+    @property
+    def speech_seconds(self) -> float:
+        return sum(end - start for start, end in self.segments)
+
+    def is_silent(self) -> bool:
+        return self.speech_seconds < settings.vad_min_speech_seconds
+
+
+class TimeMap:
+    # Соответствие времени в записи без пауз и в исходной записи:
+    # отрезки (начало в обработанной записи, начало в исходной, длительность), в секундах
+
+    def __init__(self, entries: List[Tuple[float, float, float]]):
+        self.entries = entries
+        self._starts = [entry[0] for entry in entries]
+
+    @classmethod
+    def from_keep_segments(cls, keep: List[Tuple[float, float]]) -> "TimeMap":
+        entries = []
+        position = 0.0
+        for start, end in keep:
+            entries.append((round(position, 3), start, round(end - start, 3)))
+            position += end - start
+        return cls(entries)
+
+    @property
+    def processed_duration(self) -> float:
+        return sum(entry[2] for entry in self.entries)
+
+    def to_original_ms(self, ms: int) -> int:
+        index = max(0, bisect.bisect_right(self._starts, ms / 1000) - 1)
+        processed_start, original_start, _ = self.entries[index]
+        return int(round((original_start - processed_start) * 1000)) + ms
+
+    def to_json(self) -> str:
+        return json.dumps(self.entries)
+
+    @classmethod
+    def from_json(cls, value: Optional[str]) -> Optional["TimeMap"]:
+        return cls([tuple(entry) for entry in json.loads(value)]) if value else None
+
+
+def _frame_features(samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Энергия (дБ от полной шкалы) и доля смен знака для каждого полного кадра
+    count = len(samples) // VAD_FRAME_SAMPLES
+    frames = samples[:count * VAD_FRAME_SAMPLES].reshape(count, VAD_FRAME_SAMPLES).astype(np.float32) / 32768.0
+    energy_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+    return energy_db, zcr
+
+
+def detect_speech(energy_db: np.ndarray, zcr: np.ndarray) -> List[Tuple[float, float]]:
+    # Отрезки речи по энергии и доле смен знака кадров. Порог энергии адаптивный: на столько-то дБ выше
+    # уровня фона (10-й перцентиль), но не ниже абсолютного минимума. Если перепада между фоном и громкими
+    # кадрами нет (сплошная речь или сплошной шум), действует только абсолютный минимум - при сомнении
+    # запись считается речью, чтобы не отклонить ее по ошибке.
+    if len(energy_db) == 0:
+        return []
+    floor = float(np.percentile(energy_db, 10))
+    peak = float(np.percentile(energy_db, 90))
+    threshold = settings.vad_min_energy_db
+    if peak - floor > settings.vad_energy_margin_db:
+        threshold = max(threshold, floor + settings.vad_energy_margin_db)
+
+    fricative = (zcr >= VAD_FRICATIVE_ZCR) & (energy_db > threshold - VAD_FRICATIVE_MARGIN_DB)
+    speech = ((energy_db > threshold) | fricative) & (zcr < VAD_NOISE_ZCR)
+
+    # Границы серий речевых кадров: +1 - начало, -1 - конец
+    edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * VAD_FRAME_SECONDS
+    ends = np.flatnonzero(edges == -1) * VAD_FRAME_SECONDS
+
+    segments: List[Tuple[float, float]] = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if segments and start - segments[-1][1] < VAD_MERGE_GAP_SECONDS:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+    # Одиночные щелчки короче двух кадров речью не считаются
+    return [(start, end) for start, end in segments if end - start >= 2 * VAD_FRAME_SECONDS]
+
+
+async def analyze_voice_activity_async(input_file_path: str) -> Optional[VoiceActivity]:
+    # Поиск речи в записи: FFmpeg декодирует ее в PCM 16 кГц, признаки кадров считаются блоками
+    # по мере декодирования (вся запись в памяти не хранится). None - запись не удалось декодировать
+    process = await start_pcm_decoder_async(input_file_path)
+    stderr_task = asyncio.create_task(process.stderr.read())
+    energy_blocks, zcr_blocks = [], []
+    pending = b""
+    try:
+        while True:
+            data = await process.stdout.read(VAD_READ_BYTES)
+            if not data:
+                break
+            pending += data
+            usable = len(pending) - len(pending) % (VAD_FRAME_SAMPLES * 2)
+            if usable:
+                energy_db, zcr = _frame_features(np.frombuffer(pending[:usable], dtype="<i2"))
+                energy_blocks.append(energy_db)
+                zcr_blocks.append(zcr)
+                pending = pending[usable:]
+        stderr = await stderr_task
+        if await process.wait() != 0:
+            logger.warning(f"FFmpeg не смог декодировать {input_file_path} для поиска речи: {stderr.decode(errors='replace')}")
+            return None
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        if not stderr_task.done():
+            stderr_task.cancel()
+
+    if not energy_blocks:
+        return VoiceActivity([], 0.0)
+    energy_db = np.concatenate(energy_blocks)
+    zcr = np.concatenate(zcr_blocks)
+    loop = asyncio.get_running_loop()
+    segments = await loop.run_in_executor(None, detect_speech, energy_db, zcr)
+    return VoiceActivity(segments, len(energy_db) * VAD_FRAME_SECONDS)
+
+
+def _snap(seconds: float) -> float:
+    return round(round(seconds / TRIM_GRID_SECONDS) * TRIM_GRID_SECONDS, 2)
+
+
+def plan_silence_trim(activity: VoiceActivity) -> Optional[List[Tuple[float, float]]]:
+    # Отрезки, которые остаются после удаления длинных пауз: речь с запасом vad_padding_seconds с обеих сторон;
+    # паузы короче vad_min_silence_seconds не удаляются. None - удалять нечего (выигрыш меньше vad_min_trim_seconds)
+    padding = settings.vad_padding_seconds
+    keep: List[Tuple[float, float]] = []
+    for start, end in activity.segments:
+        start = _snap(max(0.0, start - padding))
+        end = _snap(min(activity.duration, end + padding))
+        if keep and start - keep[-1][1] < settings.vad_min_silence_seconds:
+            keep[-1] = (keep[-1][0], end)
+        else:
+            keep.append((start, end))
+    if len(keep) > TRIM_MAX_SEGMENTS:
+        # Сохраняются разрезы по TRIM_MAX_SEGMENTS - 1 самым длинным паузам, остальные паузы остаются в записи
+        gaps = sorted(range(1, len(keep)), key=lambda i: keep[i][0] - keep[i - 1][1], reverse=True)
+        cuts = sorted(gaps[:TRIM_MAX_SEGMENTS - 1])
+        starts = [0] + cuts
+        ends = [cut - 1 for cut in cuts] + [len(keep) - 1]
+        keep = [(keep[first][0], keep[last][1]) for first, last in zip(starts, ends)]
+    removed = activity.duration - sum(end - start for start, end in keep)
+    if not keep or removed < settings.vad_min_trim_seconds:
+        return None
+    return keep
+
+
+async def trim_silence_async(input_file_path: str, keep: List[Tuple[float, float]],
+                             codec: str, work_dir: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    # Запись без длинных пауз (моно 16 кГц в формате загрузки): FFmpeg оставляет только кадры по 10 мс,
+    # попадающие в отрезки keep. Возвращает кортеж: (путь к новому файлу, сообщение об ошибке)
+    upload_codec = get_upload_codec(codec)
+    half_frame = TRIM_GRID_SECONDS / 2
+    selection = "+".join(f"between(t,{start - half_frame:.3f},{end - half_frame - 0.001:.3f})" for start, end in keep)
+    with tempfile.NamedTemporaryFile(suffix=upload_codec["extension"], dir=work_dir, delete=False) as temp_audio_file:
+        output_file_path = temp_audio_file.name
+    try:
+        process = await asyncio.create_subprocess_exec(
+            get_ffmpeg_path(),
+            '-nostdin', '-loglevel', 'error',
+            '-i', input_file_path, '-vn',
+            '-af', f"{get_resample_filter(PCM_SAMPLE_RATE)},asetnsamples=n={int(PCM_SAMPLE_RATE * TRIM_GRID_SECONDS)},"
+                   f"aselect='{selection}',asetpts=N/SR/TB",
+            '-ac', '1', '-ar', str(PCM_SAMPLE_RATE), *upload_codec["ffmpeg_args"],
+            output_file_path, '-y',
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await communicate_or_kill(process)
+        if process.returncode == 0:
+            return output_file_path, None
+        error_msg = stderr.decode(errors='replace') if stderr else "FFmpeg silence trim failed"
+        logger.error(f"FFmpeg silence trim error: {error_msg}")
+    except Exception as e:
+        error_msg = f"Ошибка при удалении пауз: {str(e)}"
+        logger.error(error_msg)
+    await cleanup_temp_file_async(output_file_path)
+    return None, error_msg